@@ -1,23 +1,32 @@
+import argparse
 import asyncio
+import concurrent.futures
+import functools
 import io
 import json
+import os
+import queue
 import sys
 import threading
-import signal
+import commands
 import flask_helpers
+import sessions
 import cozmo
 import cubes as cb
-import numpy as np
-from threading import Thread
-import two_hands
+import image_cache
+import inference_pool
+import metrics
+import quality
+import recolor
+import tracing
 
 try:
-    from flask import Flask, render_template, request
+    from flask import Flask, abort, g, jsonify, make_response, render_template, request, url_for
 except ImportError:
     sys.exit("Cannot import from flask: Do `pip3 install --user flask` to install")
 
 try:
-    from PIL import Image, ImageDraw, ImageOps
+    from PIL import Image
 except ImportError:
     sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
 
@@ -53,9 +62,12 @@ def create_default_image(image_width, image_height, do_gradient=False):
 
 
 flask_app = Flask(__name__)
-remote_control_cozmo = None
-robot = None
 _default_camera_image = create_default_image(320, 240)
+# Sessions of the connected robots, each one has its own video broadcaster and detection process
+robot_sessions = sessions.SessionManager()
+# Recolored cube images, kept in memory and served by their content digest
+cube_image_cache = image_cache.EncodedImageCache(maxsize=64)
+CUBE_IMAGE_IDS = ("Cozmo_cube_add", "Cozmo_cube_substract", "Cozmo_cube_multiply")
 
 
 class RemoteControlCozmo:
@@ -68,9 +80,17 @@ class RemoteControlCozmo:
     cube3 = None
     cubes = None
 
-    def __init__(self, coz, cubes):
+    def __init__(self, coz, cubes, scheduler=None):
+        """
+        :param coz: An instance of cozmo Robot.
+        :param cubes: The Cubes of the robot.
+        :param scheduler: The commands.CommandScheduler sending the commands to the robot, the one of the cubes if
+            None. The commands are sent directly if neither has one.
+        """
+
         self.cozmo = coz
         self.cubes = cubes
+        self.scheduler = scheduler if scheduler is not None else cubes.scheduler
         self.cube1 = self.cubes.cube1
         self.cube2 = self.cubes.cube2
         self.cube3 = self.cubes.cube3
@@ -83,7 +103,16 @@ class RemoteControlCozmo:
         """
 
         angle = cozmo.util.degrees(float(angleValue))
-        self.cozmo.set_head_angle(angle, in_parallel=True)
+        if self.scheduler is None:
+            self._set_head_angle(angle)
+        else:
+            # Only the latest angle is sent. The game also moves the head without the scheduler, so an angle equal to
+            # the last one sent is not skipped
+            self.scheduler.submit('head', self._set_head_angle, angle)
+
+    def _set_head_angle(self, angle):
+        with metrics.timer('robot.head_angle'):
+            self.cozmo.set_head_angle(angle, in_parallel=True)
 
     def update_cube_color(self, cubeId, newColor):
         """
@@ -96,65 +125,84 @@ class RemoteControlCozmo:
         color = cozmo.lights.Light(cozmo.lights.Color(rgb=(r, g, b)))
 
         if cubeId == "Cozmo_cube_add":
-            self.cube1.set_lights(color)
+            self.cubes.send_lights(self.cube1, 'set_lights', color, key=(r, g, b))
             self.cubes.cube1_color = color
 
         if cubeId == "Cozmo_cube_substract":
-            self.cube2.set_lights(color)
+            self.cubes.send_lights(self.cube2, 'set_lights', color, key=(r, g, b))
             self.cubes.cube2_color = color
 
         if cubeId == "Cozmo_cube_multiply":
-            self.cube3.set_lights(color)
+            self.cubes.send_lights(self.cube3, 'set_lights', color, key=(r, g, b))
             self.cubes.cube3_color = color
 
 
+def get_session(robot_id=None):
+    """
+    Get the session of a robot, or answer 404 if it is not connected.
+
+    :param robot_id: Identifier of the robot, the default robot if None.
+    :return: **session** - The RobotSession of the robot.
+    """
+
+    session = robot_sessions.get(robot_id)
+    if session is None:
+        abort(404, "Unknown robot %s" % robot_id if robot_id is not None else "No robot connected")
+    return session
+
+
 @flask_app.route("/")
-def handle_index_page():
+@flask_app.route("/robot/<string:robot_id>/")
+def handle_index_page(robot_id=None):
     """
     Display html page.
 
+    :param robot_id: Identifier of the robot controlled by the page, the default robot if None.
     :return: Source code of our html page.
     """
 
-    return render_template('Cozmo_page.html')
+    return render_template('Cozmo_page.html', robot_id=robot_id, robot_ids=robot_sessions.ids())
 
 
-def streaming_video(url_root):
+@flask_app.route("/robots")
+def handle_robots():
+    """
+    Identifiers of the connected robots.
+    """
+
+    return jsonify(default=robot_sessions.default_id, robots=robot_sessions.ids())
+
+
+def streaming_video(url_root, broadcaster, overlay=False):
     """
     Video streaming generator function.
 
     :param url_root: Html page's URL.
+    :param broadcaster: The FrameBroadcaster of the robot's camera.
+    :param overlay: To stream the frames annotated with the detection results.
     """
 
     try:
-        while True:
-            if remote_control_cozmo:
-                image = remote_control_cozmo.cozmo.world.latest_image
-                image = image.raw_image
-                image = ImageOps.mirror(image)
-
-                img_io = io.BytesIO()
-                image.save(img_io, 'PNG')
-                img_io.seek(0)
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/png\r\n\r\n' + img_io.getvalue() + b'\r\n')
-            else:
-                asyncio.sleep(.1)
+        for frame in broadcaster.frames(overlay):
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
     except cozmo.exceptions.SDKShutdown:
         # Tell the main flask thread to shutdown
         requests.post(url_root + 'shutdown')
 
 
-def serve_single_image():
+def serve_single_image(robot_id=None):
     """
     To get cozmo's image.
 
+    :param robot_id: Identifier of the robot, the default robot if None.
     :return: Cozmo's image.
     """
 
-    if remote_control_cozmo:
+    session = robot_sessions.get(robot_id)
+    if session:
         try:
-            image = remote_control_cozmo.cozmo.world.latest_image
+            image = session.robot.world.latest_image
             image = image.raw_image
 
             if image:
@@ -165,8 +213,90 @@ def serve_single_image():
 
 
 @flask_app.route("/cozmoImage")
-def handle_cozmoImage():
-    return flask_helpers.stream_video(streaming_video, request.url_root)
+@flask_app.route("/robot/<string:robot_id>/cozmoImage")
+def handle_cozmoImage(robot_id=None):
+    """
+    Video stream of the robot's camera, annotated with the detection results with ?overlay=1.
+
+    :param robot_id: Identifier of the robot, the default robot if None.
+    """
+
+    session = get_session(robot_id)
+    overlay = request.args.get('overlay', '0') not in ('', '0')
+    return flask_helpers.stream_video(functools.partial(streaming_video, broadcaster=session.broadcaster,
+                                                        overlay=overlay), request.url_root)
+
+
+@flask_app.route("/metrics")
+def handle_metrics():
+    """
+    Latency histograms of the instrumented stages, in the Prometheus text format.
+    """
+
+    return metrics.registry.prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@flask_app.route("/metrics.json")
+def handle_metrics_json():
+    """
+    Percentiles and rates of the instrumented stages, for the page's live panel.
+    """
+
+    return jsonify(enabled=metrics.registry.enabled, stages=metrics.registry.summary())
+
+
+@flask_app.route("/trace.json")
+def handle_trace():
+    """
+    Last spans recorded by the tracer, in the trace event format of chrome://tracing and Perfetto.
+    """
+
+    response = jsonify(tracing.tracer.chrome_trace())
+    response.headers['Content-Disposition'] = 'attachment; filename=cozmo_trace.json'
+    return response
+
+
+@flask_app.route("/commands")
+@flask_app.route("/robot/<string:robot_id>/commands")
+def handle_commands(robot_id=None):
+    """
+    Queue depth and counts of the commands sent, dropped, skipped and failed by the robot's command scheduler.
+
+    :param robot_id: Identifier of the robot, the default robot if None.
+    """
+
+    return jsonify(get_session(robot_id).commands.stats())
+
+
+@flask_app.route("/quality")
+@flask_app.route("/robot/<string:robot_id>/quality")
+def handle_quality(robot_id=None):
+    """
+    Target, last measure, current level and last decisions of the robot's adaptive quality controller.
+
+    :param robot_id: Identifier of the robot, the default robot if None.
+    """
+
+    session = get_session(robot_id)
+    if session.quality is None:
+        return jsonify(enabled=False)
+    return jsonify(enabled=True, **session.quality.state())
+
+
+@flask_app.route("/game")
+@flask_app.route("/robot/<string:robot_id>/game")
+def handle_game(robot_id=None):
+    """
+    State of the robot's game, number of rounds, rounds per minute and time spent in each state.
+
+    :param robot_id: Identifier of the robot, the default robot if None.
+    """
+
+    session = get_session(robot_id)
+    if session.game is None:
+        return jsonify({'state': 'idle', 'round_active': False, 'rounds': 0, 'rounds_per_minute': 0.0,
+                        'state_times': {}, 'motion_skip_ratio': 0.0})
+    return jsonify(session.game.stats())
 
 
 @flask_app.route('/shutdown', methods=['POST'])
@@ -180,22 +310,31 @@ def shutdown():
 
 
 @flask_app.route('/reload', methods=['POST'])
-def reload():
-    cozmoThread = Thread(target=two_hands.cozmo_program, args=(robot, remote_control_cozmo.cubes), daemon=True)
-    cozmoThread.start()
+@flask_app.route('/robot/<string:robot_id>/reload', methods=['POST'])
+def reload(robot_id=None):
+    """
+    Start a new round, refused while a round is running.
+
+    :param robot_id: Identifier of the robot, the default robot if None.
+    """
+
+    if not get_session(robot_id).start_program():
+        return "Une partie est déjà en cours", 409
     return ""
 
 
 @flask_app.route('/headAngle/<string:angleValue>', methods=['POST'])
-def headAngle(angleValue):
+@flask_app.route('/robot/<string:robot_id>/headAngle/<string:angleValue>', methods=['POST'])
+def headAngle(angleValue, robot_id=None):
     """
     Get angle value from the slider in html page and update cozmo's head angle.
 
     :param angleValue: Angle value from slider.
+    :param robot_id: Identifier of the robot, the default robot if None.
     """
 
     angleValue = json.loads(angleValue)
-    remote_control_cozmo.update_head_angle(angleValue)
+    get_session(robot_id).remote_control.update_head_angle(angleValue)
     return ""
 
 
@@ -211,68 +350,96 @@ def hexa_color_converter(color_code):
     return -1, -1, -1
 
 
-def recolor_cube(image_path, color_code, save_image_name):
+def encode_cube_image(cubeId, color_code):
     """
-    Color cube image with new color.
+    Color a cube image with a new color and encode it in PNG.
 
-    :param image_path: Original image to color.
+    :param cubeId: The cube image to color.
     :param color_code: Hex code color.
-    :param save_image_name: Name of modified image.
+    :return: **data** - The PNG bytes of the colored image.
     """
 
-    r, g, b = hexa_color_converter(color_code)
-    if r == -1:
-        print("Bad color format")
-        return
-    red = (255, 0, 0, 255)
-    green = (0, 255, 0, 255)
-    blue = (0, 0, 255, 255)
-    image = Image.open(image_path)
-    im = np.array(image)
-
-    larg, long, coul = im.shape
-
-    for i in range(0, 30):
-        for j in range(30, 110):
-            for k in range(coul - 1):
-                if all(x == y for x, y in zip(im[i][j], green)) or all(x == y for x, y in zip(im[i][j], red)) or all(
-                        x == y for x, y in zip(im[i][j], blue)):
-                    im[i][j] = (r, g, b, 255)
-                    im[149 - i][149 - j] = (r, g, b, 255)
-                    im[j][i] = (r, g, b, 255)
-                    im[149 - j][149 - i] = (r, g, b, 255)
-            im[i][j][3] = 255
-
-    imag = Image.fromarray(im)
-    imag.save(save_image_name)
+    img_io = io.BytesIO()
+    Image.fromarray(recolor.recolor_cube_array("static/images/" + cubeId + ".png",
+                                               hexa_color_converter(color_code))).save(img_io, 'PNG')
+    return img_io.getvalue()
 
 
 @flask_app.route('/colorChange/', methods=['POST'])
-def colorChange():
+@flask_app.route('/robot/<string:robot_id>/colorChange/', methods=['POST'])
+def colorChange(robot_id=None):
     """
     Color real cozmo's cube.
 
-    :return: ID of modified color.
+    :param robot_id: Identifier of the robot, the default robot if None.
+    :return: ID of modified cube and URL of its colored image.
     """
 
+    session = get_session(robot_id)
     arguments = request.get_json()
 
-    newColor = arguments['newColor']
+    newColor = arguments['newColor'].lower()
     cubeId = arguments['cubeId']
-    recolor_cube("static/images/" + cubeId + ".png", newColor, "static/temp/" + cubeId + ".png")
-    remote_control_cozmo.update_cube_color(cubeId, newColor)
-    return cubeId
+    if cubeId not in CUBE_IMAGE_IDS or hexa_color_converter(newColor)[0] == -1:
+        return "Bad cube or color format", 400
+
+    with metrics.timer('web.recolor'):
+        digest = cube_image_cache.get_or_create((cubeId, newColor), lambda: encode_cube_image(cubeId, newColor))
+    session.remote_control.update_cube_color(cubeId, newColor)
+    return jsonify(cubeId=cubeId, url=url_for('cubeImage', digest=digest))
+
+
+@flask_app.route('/cubeImage/<string:digest>.png')
+def cubeImage(digest):
+    """
+    Serve a colored cube image from memory. Its URL depends on its content so it can be cached forever.
+
+    :param digest: Digest of the image returned by colorChange.
+    """
+
+    data = cube_image_cache.get(digest)
+    if data is None:
+        return "Unknown cube image", 404
+
+    response = make_response(data)
+    response.mimetype = 'image/png'
+    response.set_etag(digest)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+
+@flask_app.before_request
+def start_request_span():
+    g.request_span = tracing.span('web.' + (request.endpoint or 'unknown'), path=request.path)
+    g.request_span.__enter__()
+
+
+@flask_app.teardown_request
+def end_request_span(exception=None):
+    # A streamed response is only traced until its generator is returned
+    request_span = g.pop('request_span', None)
+    if request_span is not None:
+        request_span.__exit__(None, None, None)
 
 
 @flask_app.after_request
 def add_header(r):
-    r.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    r.headers['Pragma'] = 'no-cache'
+    # Keep the caching policy of the responses that set their own
+    if 'Cache-Control' not in r.headers:
+        r.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        r.headers['Pragma'] = 'no-cache'
     return r
 
 
-def run(sdk_conn):
-    global robot
+def add_robot(sdk_conn, robot_id=None):
+    """
+    Set up a newly connected robot, create its session and start its program.
+
+    :param sdk_conn: The connection to the robot.
+    :param robot_id: Identifier of the robot in the URLs, its connection number if None.
+    :return: **session** - The RobotSession of the robot.
+    """
+
     robot = sdk_conn.wait_for_robot()
     robot.enable_device_imu(True, True, True)
 
@@ -281,21 +448,179 @@ def run(sdk_conn):
     # Enable color image
     robot.camera.color_image_enabled = True
 
-    global remote_control_cozmo
-    remote_control_cozmo = RemoteControlCozmo(robot, cb.Cubes(robot))
+    scheduler = commands.CommandScheduler()
+    cubes = cb.Cubes(robot, scheduler)
+    session = robot_sessions.add(robot, robot_id, cubes=cubes, remote_control=RemoteControlCozmo(robot, cubes),
+                                 commands=scheduler)
+    session.start_program()
+    return session
+
+
+def serve(use_asgi=False):
+    """
+    Run the web server until it is shut down.
+
+    :param use_asgi: To run the asynchronous server of asgi_server, with its WebSocket, instead of Flask's one.
+    """
+
+    if use_asgi:
+        # Only imported in this mode, starlette and uvicorn are optional
+        import asgi_server
+        asgi_server.run_asgi(asgi_server.create_app(flask_app, robot_sessions))
+    else:
+        flask_helpers.run_flask(flask_app)
 
-    cozmoThread = Thread(target=two_hands.cozmo_program, args=(robot, remote_control_cozmo.cubes), daemon=True)
-    cozmoThread.start()
 
-    flask_helpers.run_flask(flask_app)
+def run(sdk_conn, use_asgi=False):
+    add_robot(sdk_conn)
+    try:
+        serve(use_asgi)
+    finally:
+        robot_sessions.close()
+
+
+class RobotConnection:
+    """
+    This class connects to the robot of one device on its own SDK event loop thread.
+
+    cozmo.connect runs the synchronous programs of all its connections on a single shared event loop, so it cannot
+    serve several devices at once.
+    """
+
+    def __init__(self, connector, timeout=30.0):
+        """
+        :param connector: The cozmo.run.DeviceConnector of the device, e.g. cozmo.run.AndroidConnector(serial=...).
+        :param timeout: Maximum time in seconds to open the connection.
+        """
+
+        self.connector = connector
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.connection = None
+        self._thread = None
+
+    def open(self):
+        """
+        Open the connection.
+
+        :return: **sdk_conn** - The connection, whose methods can be called from any thread.
+        """
+
+        opened = queue.Queue()
+        # As in cozmo.connect, the objects of a connection given an abort future wait for the coroutines they return
+        # when called from another thread than the loop's one
+        conn_factory = functools.partial(cozmo.conn.CozmoConnection, _sync_abort_future=concurrent.futures.Future())
+
+        def run_loop():
+            asyncio.set_event_loop(self.loop)
+            try:
+                opened.put(cozmo.connect_on_loop(self.loop, conn_factory, self.connector))
+            except Exception as e:
+                opened.put(e)
+                return
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run_loop, daemon=True)
+        self._thread.start()
+        try:
+            connection = opened.get(timeout=self.timeout)
+        except queue.Empty:
+            raise cozmo.ConnectionError("Timed out waiting for the connection to the device")
+        if isinstance(connection, Exception):
+            raise connection
+        self.connection = connection
+        # The proxy cozmo.connect gives to synchronous programs, the SDK has no public equivalent
+        return cozmo.base._SyncProxy(connection)
+
+    def close(self):
+        """
+        Shut the connection down and stop its event loop.
+        """
+
+        if self.connection is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.connection.shutdown(), self.loop).result(timeout=self.timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=self.timeout)
+        self.connection = None
+
+
+def run_robots(connectors, use_asgi=False):
+    """
+    Connect to several robots and serve all of them, each one at /robot/<id>/.
+
+    :param connectors: The cozmo.run.DeviceConnector of each robot's device, each one with its own serial.
+    :param use_asgi: To run the asynchronous server instead of Flask's one.
+    """
+
+    connections = []
+    try:
+        for connector in connectors:
+            connection = RobotConnection(connector)
+            sdk_conn = connection.open()
+            connections.append(connection)
+            session = add_robot(sdk_conn)
+            print("Robot %s (%s): /robot/%s/" % (session.robot_id, connector.serial, session.robot_id))
+        serve(use_asgi)
+    finally:
+        robot_sessions.close()
+        for connection in connections:
+            connection.close()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Web interface of the fingers counter with Cozmo")
+    parser.add_argument('--serials', nargs='+', default=(), metavar='SERIAL',
+                        help="Serial numbers of the devices of the robots to connect to, the first device if none")
+    parser.add_argument('--ios', action='store_true', help="The serials are the ones of iOS devices, not Android")
+    parser.add_argument('--pool', type=int, default=0, metavar='WORKERS',
+                        help="Share a pool of WORKERS inference processes between the robots instead of one each")
+    parser.add_argument('--asgi', action='store_true',
+                        help="Run the asynchronous server, with WebSocket control (needs starlette and uvicorn)")
+    parser.add_argument('--target-latency', type=float, default=150.0, metavar='MS',
+                        help="Target latency of the detection, the quality of the detection and of the stream is "
+                             "lowered above it")
+    parser.add_argument('--target-cpu', type=float, default=None, metavar='SHARE',
+                        help="Adapt the quality to a share of a core spent in the detection instead, e.g. 0.5")
+    parser.add_argument('--fixed-quality', action='store_true', help="Never adapt the quality to the load")
+    parser.add_argument('--gestures', action='store_true',
+                        help="Let the players show the operators with their hands as well as by tapping a cube")
+    parser.add_argument('--trace', action='store_true',
+                        help="Record the spans of the rounds, served at /trace.json and written to a file on SIGUSR2")
+    args = parser.parse_args()
+
+    if args.trace:
+        tracing.set_enabled(True)
+    tracing.install_signal_handler()
+
+    robot_sessions.session_params['gestures'] = args.gestures
+
+    if args.fixed_quality:
+        robot_sessions.session_params['adaptive_quality'] = False
+    elif args.target_cpu is not None:
+        robot_sessions.session_params['quality_params'] = {'target': quality.CPU, 'target_value': args.target_cpu}
+    else:
+        robot_sessions.session_params['quality_params'] = {'target': quality.LATENCY,
+                                                           'target_value': args.target_latency / 1000.0}
+
+    if args.pool:
+        # The frames of the robots are mixed in the workers, so they cannot rely on the tracking of the previous frame
+        robot_sessions.hands = inference_pool.InferencePool(args.pool, static_image_mode=True)
+
+    # Timings are shown in the page, unless disabled with COZMO_METRICS=0
+    metrics.set_enabled(os.environ.get('COZMO_METRICS', '1') != '0')
     cozmo.setup_basic_logging()
     cozmo.robot.Robot.drive_off_charger_on_connect = False  # RC can drive off charger if required
     try:
-        cozmo.connect(run)
+        if args.serials:
+            connector_class = cozmo.run.IOSConnector if args.ios else cozmo.run.AndroidConnector
+            run_robots([connector_class(serial=serial) for serial in args.serials], args.asgi)
+        else:
+            cozmo.connect(functools.partial(run, use_asgi=args.asgi))
     except KeyboardInterrupt as e:
         sys.exit()
     except cozmo.ConnectionError as e:
         sys.exit("A connection error occurred: %s" % e)
+    finally:
+        if robot_sessions.hands is not None:
+            robot_sessions.hands.close()
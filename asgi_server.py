@@ -0,0 +1,245 @@
+"""
+Asynchronous (ASGI) server mode of the web interface.
+
+The Flask application is mounted as is, so that all its routes keep working, and the ASGI application adds:
+
+- the video stream of each robot served from the event loop, fed by its FrameBroadcaster, instead of holding a thread
+  per client,
+- a WebSocket (``/ws`` and ``/robot/<id>/ws``) receiving the control commands of the page and pushing it the
+  detection results. Head angle commands are coalesced: while one is being sent to the robot, only the latest of the
+  next ones is kept.
+
+Run it with ``python UI.py --asgi``.
+"""
+
+import asyncio
+import json
+import sys
+
+import cozmo
+
+try:
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse, StreamingResponse
+    from starlette.routing import Mount, Route, WebSocketRoute
+    from starlette.websockets import WebSocketDisconnect
+except ImportError:
+    sys.exit("Cannot import from starlette: Do `pip3 install --user starlette` to install")
+
+try:
+    import uvicorn
+except ImportError:
+    sys.exit("Cannot import from uvicorn: Do `pip3 install --user uvicorn` to install")
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import flask_helpers
+
+# Minimum time in seconds between two head angle commands sent to a robot
+HEAD_ANGLE_INTERVAL = 0.05
+
+_server = None
+
+
+class LatestValueSender:
+    """
+    This class sends values with a blocking function, one at a time: the values submitted while one is being sent
+    replace each other, so that only the latest one is sent next.
+    """
+
+    def __init__(self, send, min_interval=0.0):
+        """
+        :param send: Blocking function sending a value, it runs in the default executor.
+        :param min_interval: Minimum time in seconds between two values sent.
+        """
+
+        self.send = send
+        self.min_interval = min_interval
+        self._pending = None
+        self._has_pending = False
+        self._task = None
+
+        # Number of values submitted and actually sent
+        self.submitted = 0
+        self.sent = 0
+
+    @property
+    def coalesced(self):
+        """
+        Number of values replaced by a later one before being sent.
+        """
+
+        return self.submitted - self.sent - self._has_pending
+
+    def submit(self, value):
+        """
+        Send a value as soon as the previous one has been sent, it must be called from the event loop.
+
+        :param value: The value to send.
+        """
+
+        self._pending = value
+        self._has_pending = True
+        self.submitted += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._has_pending:
+            value = self._pending
+            self._pending = None
+            self._has_pending = False
+            await loop.run_in_executor(None, self.send, value)
+            self.sent += 1
+            await asyncio.sleep(self.min_interval)
+
+
+class _Latest:
+    """
+    Latest value handed over from a thread to the event loop, the previous one is dropped if it was not read yet.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.value = None
+
+    def put_threadsafe(self, value):
+        try:
+            self.loop.call_soon_threadsafe(self._put, value)
+        except RuntimeError:
+            # The event loop is closed
+            pass
+
+    def _put(self, value):
+        self.value = value
+        self.event.set()
+
+    async def get(self):
+        await self.event.wait()
+        self.event.clear()
+        return self.value
+
+
+async def stream_frames(broadcaster, overlay=False):
+    """
+    Asynchronous generator of the multipart parts of a robot's video stream.
+
+    :param broadcaster: The FrameBroadcaster of the robot's camera.
+    :param overlay: To stream the frames annotated with the detection results.
+    """
+
+    latest = _Latest(asyncio.get_running_loop())
+
+    def on_frame(frame, error):
+        latest.put_threadsafe((frame, error))
+
+    broadcaster.add_listener(on_frame, overlay)
+    try:
+        while True:
+            frame, error = await latest.get()
+            if error is not None:
+                if isinstance(error, cozmo.exceptions.SDKShutdown) and _server is not None:
+                    _server.should_exit = True
+                return
+            yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame + b'\r\n'
+    finally:
+        broadcaster.remove_listener(on_frame)
+
+
+def result_message(result):
+    """
+    Build the message pushed to the page for a detection result.
+
+    :param result: The result_bus.BusResult.
+    :return: **message** - A JSON-serializable dictionary.
+    """
+
+    return {'type': 'detection', 'sequence': result.sequence, 'frame_id': result.frame_id, 'total': result.total,
+            'count': result.count,
+            'score': None if result.score is None else round(float(result.score), 3)}
+
+
+def create_app(flask_app, robot_sessions):
+    """
+    Create the ASGI application serving the web interface.
+
+    :param flask_app: The Flask application of the interface, mounted for all the other routes.
+    :param robot_sessions: The SessionManager of the connected robots.
+    :return: **app** - The Starlette application.
+    """
+
+    head_angle_senders = {}
+
+    def get_session(request):
+        return robot_sessions.get(request.path_params.get('robot_id'))
+
+    def head_angle_sender(session):
+        sender = head_angle_senders.get(session.robot_id)
+        if sender is None:
+            sender = LatestValueSender(session.remote_control.update_head_angle, HEAD_ANGLE_INTERVAL)
+            head_angle_senders[session.robot_id] = sender
+        return sender
+
+    async def video(request):
+        session = get_session(request)
+        if session is None:
+            return PlainTextResponse("Unknown robot", status_code=404)
+        overlay = request.query_params.get('overlay', '0') not in ('', '0')
+        return StreamingResponse(stream_frames(session.broadcaster, overlay),
+                                 media_type='multipart/x-mixed-replace; boundary=frame',
+                                 headers={'Cache-Control': 'no-cache, no-store, must-revalidate'})
+
+    async def control(websocket):
+        session = get_session(websocket)
+        if session is None:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+
+        results = _Latest(asyncio.get_running_loop())
+        session.results.subscribe(results.put_threadsafe)
+
+        async def push_results():
+            while True:
+                await websocket.send_text(json.dumps(result_message(await results.get())))
+
+        pusher = asyncio.ensure_future(push_results())
+        try:
+            while True:
+                command = json.loads(await websocket.receive_text())
+                if command.get('type') == 'headAngle':
+                    head_angle_sender(session).submit(float(command['value']))
+                elif command.get('type') == 'reload':
+                    session.start_program()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            pusher.cancel()
+            session.results.unsubscribe(results.put_threadsafe)
+
+    return Starlette(routes=[
+        Route('/cozmoImage', video),
+        Route('/robot/{robot_id}/cozmoImage', video),
+        WebSocketRoute('/ws', control),
+        WebSocketRoute('/robot/{robot_id}/ws', control),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ])
+
+
+def run_asgi(app, host_ip="127.0.0.1", host_port=5000, open_page=True, open_page_delay=1.0):
+    """
+    Run the ASGI application with uvicorn, as flask_helpers.run_flask does with Flask's server.
+    """
+
+    global _server
+
+    if open_page:
+        flask_helpers._delayed_open_web_browser("http://" + host_ip + ":" + str(host_port), delay=open_page_delay)
+
+    _server = uvicorn.Server(uvicorn.Config(app, host=host_ip, port=host_port, log_level='warning'))
+    _server.run()
@@ -0,0 +1,277 @@
+"""
+Offline benchmark of the fingers counting pipeline on recorded sessions.
+
+It reports the time spent in each stage (acquire, convert, mirror, infer, count), the throughput and, for the
+sessions recorded with a label, the accuracy of the counts. Run it from the project's root::
+
+    python benchmarks/bench_pipeline.py session1.npz session2.npz
+    python benchmarks/bench_pipeline.py --synthetic 300
+    python benchmarks/bench_pipeline.py --end-to-end session1.npz
+    python benchmarks/bench_pipeline.py --end-to-end --synthetic 300
+    python benchmarks/bench_pipeline.py --pool 4 session1.npz session2.npz
+"""
+
+import argparse
+import collections
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import detection  # noqa: E402
+import frames  # noqa: E402
+import hand as hd  # noqa: E402
+import hand_backends  # noqa: E402
+import inference_pool  # noqa: E402
+import replay  # noqa: E402
+import two_hands  # noqa: E402
+
+STAGES = ('acquire', 'convert', 'mirror', 'infer', 'count')
+
+
+def synthetic_session(nb_frames, label=3, width=320, height=240):
+    """
+    Build a session of blank frames, to be used with the synthetic backend.
+
+    :param nb_frames: Number of frames of the session.
+    :param label: Count shown during the session.
+    :return: **session** - The Session.
+    """
+
+    return replay.Session(np.zeros((nb_frames, height, width, 3), dtype=np.uint8),
+                          np.arange(nb_frames, dtype=np.float64) / 15.0, np.arange(nb_frames, dtype=np.int64),
+                          None, None, None, label)
+
+
+def run_stages(session, hands, timings):
+    """
+    Run the pipeline stage by stage on every frame of a session.
+
+    :param session: The Session to analyse.
+    :param hands: The backend performing the hands landmarks detection.
+    :param timings: Dictionary of lists receiving the duration of each stage.
+    :return: **totals** - The count of each frame, None when no hand is detected.
+    """
+
+    source = replay.ReplayFrameSource(session, realtime=False)
+    acquirer = frames.FrameAcquirer(mirror=True)
+    totals = []
+
+    try:
+        for _ in range(len(session.frames)):
+            start = time.perf_counter()
+            frame = source.get(timeout=5.0)
+            acquired = time.perf_counter()
+            if frame is None:
+                break
+
+            # The camera gives PIL images, build it outside of the measures
+            image = Image.fromarray(frame.image)
+            converted_start = time.perf_counter()
+            im = np.asarray(image)
+            converted = time.perf_counter()
+            im = acquirer.acquire(im)
+            mirrored = time.perf_counter()
+            im, results = hd.detectHandsLandmarks(im, hands)
+            inferred = time.perf_counter()
+            total = None
+            if results.multi_hand_landmarks:
+                im, fingers_statuses, count = hd.countFingers(im, results)
+                total = sum(count.values())
+            counted = time.perf_counter()
+
+            timings['acquire'].append(acquired - start)
+            timings['convert'].append(converted - converted_start)
+            timings['mirror'].append(mirrored - converted)
+            timings['infer'].append(inferred - mirrored)
+            timings['count'].append(counted - inferred)
+            totals.append(total)
+    finally:
+        source.close()
+
+    return totals
+
+
+def stable_count(totals):
+    """
+    Vote on the counts of a session as hand_detection does.
+
+    :param totals: The count of each frame.
+    :return: **count** - The first stable count and the index of the frame where it was reached, (None, None) if none.
+    """
+
+    stabilizer = detection.FingerCountStabilizer()
+    for index, total in enumerate(totals):
+        count = stabilizer.update(total)
+        if count is not None:
+            return count, index
+    return None, None
+
+
+def create_hands(args, path):
+    """
+    Create the backend analysing a session.
+
+    :param args: The command line arguments.
+    :param path: Path of the session, "synthetic" for the synthetic session.
+    :return: **hands** - The backend.
+    """
+
+    if path == "synthetic":
+        return hand_backends.create_backend('synthetic', counts=[args.label], loop=True)
+    if args.backend == 'replay':
+        return hand_backends.create_backend('replay', path=path, loop=False)
+    return hand_backends.create_backend(args.backend)
+
+
+def benchmark(args):
+    """
+    Run the pipeline stage by stage on each session and print the timings and the accuracy.
+    """
+
+    clips = [(path, replay.load_session(path)) for path in args.sessions]
+    if args.synthetic:
+        clips.append(("synthetic", synthetic_session(args.synthetic, args.label)))
+
+    timings = collections.defaultdict(list)
+    nb_frames = 0
+    wall_time = 0.0
+
+    print("%-30s %7s %7s %9s %9s %6s" % ("session", "frames", "label", "frame acc", "stable", "frame"))
+    for path, session in clips:
+        hands = create_hands(args, path)
+        start = time.perf_counter()
+        totals = run_stages(session, hands, timings)
+        wall_time += time.perf_counter() - start
+        nb_frames += len(totals)
+
+        count, index = stable_count(totals)
+        accuracy = "-" if session.label is None else "%.1f%%" % (
+            100.0 * sum(total == session.label for total in totals) / max(1, len(totals)))
+        print("%-30s %7d %7s %9s %9s %6s" % (os.path.basename(path)[:30], len(totals), session.label, accuracy,
+                                             count, index))
+        replay.close_session(session)
+
+    print()
+    print("%-10s %10s %10s %10s" % ("stage", "mean ms", "p50 ms", "p95 ms"))
+    for stage in STAGES:
+        values = np.array(timings[stage]) * 1000
+        if len(values):
+            print("%-10s %10.3f %10.3f %10.3f" % (stage, values.mean(), np.percentile(values, 50),
+                                                  np.percentile(values, 95)))
+    if wall_time:
+        print()
+        print("throughput: %.1f frames/s over %d frames" % (nb_frames / wall_time, nb_frames))
+
+
+def pool_throughput(args):
+    """
+    Analyse the frames of all the sessions with an InferencePool, keeping every worker busy, and print the
+    throughput.
+    """
+
+    clips = [replay.load_session(path) for path in args.sessions]
+    if args.synthetic:
+        clips.append(synthetic_session(args.synthetic, args.label))
+
+    if args.synthetic and not args.sessions:
+        pool = inference_pool.InferencePool(args.pool, 'synthetic', counts=[args.label], loop=True)
+    else:
+        pool = inference_pool.InferencePool(args.pool, args.backend, static_image_mode=True)
+
+    acquirer = frames.FrameAcquirer(mirror=True)
+    nb_frames = 0
+    nb_hands = 0
+    try:
+        start = time.perf_counter()
+        for session in clips:
+            for image in session.frames:
+                pool.submit(acquirer.acquire(image))
+                nb_frames += 1
+                # Read the results as soon as all the slots are in use
+                while pool.pending >= 2 * pool.size:
+                    nb_hands += bool(pool.get()[1].multi_hand_landmarks)
+        while pool.pending:
+            nb_hands += bool(pool.get()[1].multi_hand_landmarks)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+        for session in clips:
+            replay.close_session(session)
+
+    print("%d workers: %.1f frames/s over %d frames, hands found on %d frames (%d waits for a free slot)" % (
+        args.pool, nb_frames / elapsed, nb_frames, nb_hands, pool.slot_waits))
+
+
+def end_to_end(args):
+    """
+    Run hand_detection unchanged on a ReplayRobot playing each session at its recorded pace.
+    """
+
+    clips = [(path, path) for path in args.sessions]
+    if args.synthetic:
+        clips.append(("synthetic", synthetic_session(args.synthetic, args.label)))
+
+    print("%-30s %7s %7s %10s" % ("session", "label", "count", "time s"))
+    for path, session in clips:
+        robot = replay.ReplayRobot(session, realtime=True)
+        worker = detection.DetectionWorker(frames.CameraFrameSource(robot), hands=create_hands(args, path))
+        worker.start()
+        robot.play()
+
+        # hand_detection waits until a count is stable, give up shortly after the end of the session
+        counts = []
+        start = time.perf_counter()
+
+        def detect():
+            counts.append((two_hands.hand_detection(robot, worker), time.perf_counter() - start))
+
+        thread = threading.Thread(target=detect, daemon=True)
+        thread.start()
+        while thread.is_alive() and not robot.finished.wait(0.1):
+            pass
+        thread.join(timeout=2.0)
+        count, elapsed = counts[0] if counts else (None, time.perf_counter() - start)
+
+        worker.stop()
+        robot.stop()
+        print("%-30s %7s %7s %10.3f" % (os.path.basename(path)[:30], robot.session.label, count, elapsed))
+        print("    mean latency %.1f ms, %d frames dropped, %d frames skipped, %d results reused (%.0f %%)" % (
+            worker.frame_source.mean_latency * 1000, worker.frame_source.dropped, worker.frames_skipped,
+            worker.motion_gate.skipped, worker.motion_gate.skip_ratio * 100))
+        # The synthetic backend shows the label on every frame, a missing count is a bug of the pipeline
+        assert path != "synthetic" or count == args.label, "the synthetic session was counted %s" % count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('sessions', nargs='*', help="Recorded sessions (.npz)")
+    parser.add_argument('--backend', default='mediapipe', choices=('mediapipe', 'replay'),
+                        help="replay uses the landmarks recorded in the sessions")
+    parser.add_argument('--synthetic', type=int, default=0, metavar='FRAMES',
+                        help="Add a synthetic session of FRAMES blank frames analysed by the synthetic backend")
+    parser.add_argument('--label', type=int, default=3, help="Count shown in the synthetic session")
+    parser.add_argument('--end-to-end', action='store_true',
+                        help="Run two_hands.hand_detection on a replayed robot instead of the stages")
+    parser.add_argument('--pool', type=int, default=0, metavar='WORKERS',
+                        help="Measure the throughput of an inference pool of WORKERS processes")
+    args = parser.parse_args()
+
+    if not args.sessions and not args.synthetic:
+        parser.error("give at least one session or --synthetic")
+
+    if args.pool:
+        pool_throughput(args)
+    elif args.end_to_end:
+        end_to_end(args)
+    else:
+        benchmark(args)
+
+
+if __name__ == '__main__':
+    main()
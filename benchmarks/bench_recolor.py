@@ -0,0 +1,72 @@
+"""
+Benchmark of the vectorized cube recoloring against the former pixel by pixel loop.
+
+Run it from the project's root: ``python benchmarks/bench_recolor.py``
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import recolor  # noqa: E402
+
+CUBE_IMAGES = ["static/images/Cozmo_cube_add.png", "static/images/Cozmo_cube_substract.png",
+               "static/images/Cozmo_cube_multiply.png"]
+COLOR = (18, 52, 86)
+
+
+def recolor_cube_loop(image_path, rgb):
+    """
+    The former implementation of UI.recolor_cube, without the saving step.
+
+    :param image_path: Original image to color.
+    :param rgb: Tuple (r, g, b) of the new color.
+    :return: **im** - The colored image as a numpy array.
+    """
+
+    r, g, b = rgb
+    red = (255, 0, 0, 255)
+    green = (0, 255, 0, 255)
+    blue = (0, 0, 255, 255)
+    image = Image.open(image_path)
+    im = np.array(image)
+
+    larg, long, coul = im.shape
+
+    for i in range(0, 30):
+        for j in range(30, 110):
+            for k in range(coul - 1):
+                if all(x == y for x, y in zip(im[i][j], green)) or all(x == y for x, y in zip(im[i][j], red)) or all(
+                        x == y for x, y in zip(im[i][j], blue)):
+                    im[i][j] = (r, g, b, 255)
+                    im[149 - i][149 - j] = (r, g, b, 255)
+                    im[j][i] = (r, g, b, 255)
+                    im[149 - j][149 - i] = (r, g, b, 255)
+            im[i][j][3] = 255
+    return im
+
+
+def main(number=5):
+    os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+
+    for image_path in CUBE_IMAGES:
+        if not np.array_equal(recolor_cube_loop(image_path, COLOR), recolor.recolor_cube_array(image_path, COLOR)):
+            sys.exit("Vectorized recoloring differs from the loop for %s" % image_path)
+
+    loop = timeit.timeit(lambda: recolor_cube_loop(CUBE_IMAGES[0], COLOR), number=number) / number
+    recolor.load_cube_template.cache_clear()
+    cold = timeit.timeit(lambda: recolor.recolor_cube_array(CUBE_IMAGES[0], COLOR), number=1)
+    warm = timeit.timeit(lambda: recolor.recolor_cube_array(CUBE_IMAGES[0], COLOR), number=number * 100) / (number * 100)
+
+    print("pixel loop:            %8.3f ms" % (loop * 1000))
+    print("vectorized, cold mask: %8.3f ms" % (cold * 1000))
+    print("vectorized, cached:    %8.3f ms (x%.0f)" % (warm * 1000, loop / warm))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Scheduling of the commands sent to the robot.
+
+The web page can ask for many commands per second, e.g. while a slider moves, and each one becomes a radio message to
+cozmo or a cube. The CommandScheduler sits between the callers and the SDK and sends the commands of each actuator
+(head, lift, lights of each cube) from a single thread:
+
+- a command replaces the one of the same actuator still waiting to be sent, only the latest is sent,
+- the commands of an actuator are sent at most once per interval, see INTERVALS,
+- a command identical to the last one sent to its actuator is skipped.
+"""
+
+import threading
+import time
+
+import tracing
+
+# Minimum time in seconds between two commands of the actuators, the others use DEFAULT_INTERVAL
+INTERVALS = {'head': 0.05, 'lift': 0.05}
+DEFAULT_INTERVAL = 0.03
+
+
+class _Command:
+    """
+    A command waiting to be sent.
+    """
+
+    __slots__ = ('send', 'args', 'kwargs', 'key')
+
+    def __init__(self, send, args, kwargs, key):
+        self.send = send
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+
+
+class CommandScheduler:
+    """
+    This class coalesces, deduplicates and rate-limits the commands sent to the actuators of a robot.
+    """
+
+    def __init__(self, intervals=None, default_interval=DEFAULT_INTERVAL):
+        """
+        :param intervals: Dictionary of the minimum time in seconds between two commands of an actuator, INTERVALS if
+            None.
+        :param default_interval: Minimum time between two commands of the other actuators.
+        """
+
+        self.intervals = dict(INTERVALS if intervals is None else intervals)
+        self.default_interval = default_interval
+
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._last_keys = {}
+        self._next_times = {}
+        self._stopped = False
+
+        # Numbers of commands sent, replaced by a later one, skipped as identical to the last one and failed
+        self.sent = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.errors = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self):
+        """
+        Number of commands waiting to be sent.
+        """
+
+        return len(self._pending)
+
+    def submit(self, actuator, send, *args, key=None, **kwargs):
+        """
+        Schedule a command.
+
+        :param actuator: Name of the actuator, e.g. 'head' or 'cube1.lights'.
+        :param send: Function sending the command, e.g. robot.set_head_angle.
+        :param args: Positional arguments of send.
+        :param key: Hashable value identifying the command to detect the identical ones, e.g. the angle in degrees.
+            Commands without a key are never skipped.
+        :param kwargs: Keyword arguments of send.
+        :return: True if the command was scheduled, False if it was skipped.
+        """
+
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("The command scheduler is closed")
+
+            replaced = self._pending.pop(actuator, None)
+            if replaced is not None:
+                self.dropped += 1
+
+            if key is not None and self._last_keys.get(actuator) == key:
+                # The actuator is already in this state
+                self.skipped += 1
+                return False
+
+            self._pending[actuator] = _Command(send, args, kwargs, key)
+            self._condition.notify()
+        return True
+
+    def stats(self):
+        """
+        :return: **stats** - A dictionary of the queue depth and of the counts of commands sent, dropped, skipped and
+            failed.
+        """
+
+        return {'depth': self.depth, 'sent': self.sent, 'dropped': self.dropped, 'skipped': self.skipped,
+                'errors': self.errors}
+
+    def wait_idle(self, timeout=None):
+        """
+        Wait until all the commands have been sent.
+
+        :param timeout: Maximum waiting time in seconds.
+        :return: True if no command is waiting anymore.
+        """
+
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending, timeout)
+
+    def close(self):
+        """
+        Stop sending commands, the waiting ones are dropped.
+        """
+
+        with self._condition:
+            self._stopped = True
+            self.dropped += len(self._pending)
+            self._pending.clear()
+            self._condition.notify_all()
+        self._thread.join(timeout=1.0)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    now = time.monotonic()
+                    ready = [actuator for actuator in self._pending if self._next_times.get(actuator, 0.0) <= now]
+                    if ready:
+                        break
+                    # Wait for a new command, or for the first actuator allowed to send again
+                    waits = [self._next_times[actuator] - now for actuator in self._pending]
+                    self._condition.wait(min(waits) if waits else None)
+
+                commands = [(actuator, self._pending.pop(actuator)) for actuator in ready]
+                for actuator, command in commands:
+                    self._last_keys[actuator] = command.key
+                    self._next_times[actuator] = now + self.intervals.get(actuator, self.default_interval)
+                self._condition.notify_all()
+
+            for actuator, command in commands:
+                try:
+                    with tracing.span('robot.command', actuator=actuator):
+                        command.send(*command.args, **command.kwargs)
+                    self.sent += 1
+                except Exception as e:
+                    # The state of the actuator is unknown, the same command can be sent again
+                    with self._condition:
+                        self._last_keys.pop(actuator, None)
+                        self.errors += 1
+                    print("Command of %s failed: %r" % (actuator, e))
@@ -1,8 +1,9 @@
-import time
-
 import cozmo
 from cozmo.objects import LightCube1Id, LightCube2Id, LightCube3Id
 
+import light_animations
+import tracing
+
 
 class Cubes:
     """
@@ -17,9 +18,18 @@ class Cubes:
     cube2_color = None
     cube3_color = None
 
-    def __init__(self, robot):
+    def __init__(self, robot, scheduler=None, animator=None):
+        """
+        :param robot: An instance of cozmo Robot.
+        :param scheduler: The commands.CommandScheduler sending the lights commands, they are sent directly if None.
+        :param animator: The LightAnimator playing the blinking, a new one if None.
+        """
 
         self.robot = robot
+        self.scheduler = scheduler
+        self.animator = animator if animator is not None else light_animations.LightAnimator()
+        # Animation of the last cube tapped
+        self.blinking = None
         self.cube1 = robot.world.get_light_cube(LightCube1Id)
         self.cube2 = robot.world.get_light_cube(LightCube2Id)
         self.cube3 = robot.world.get_light_cube(LightCube3Id)
@@ -27,17 +37,34 @@ class Cubes:
         # Initialize cube one's color (red)
         if self.cube1 is not None:
             self.cube1_color = cozmo.lights.red_light
-            self.cube1.set_lights(self.cube1_color)
+            self.send_lights(self.cube1, 'set_lights', self.cube1_color, key='red')
 
         # Initialize cube two's color (blue)
         if self.cube2 is not None:
             self.cube2_color = cozmo.lights.blue_light
-            self.cube2.set_lights(self.cube2_color)
+            self.send_lights(self.cube2, 'set_lights', self.cube2_color, key='blue')
 
         # Initialize cube three's color (green)
         if self.cube3 is not None:
             self.cube3_color = cozmo.lights.green_light
-            self.cube3.set_lights(self.cube3_color)
+            self.send_lights(self.cube3, 'set_lights', self.cube3_color, key='green')
+
+    def send_lights(self, cube, method, *lights, key=None):
+        """
+        Send a lights command to a cube, through the scheduler if any.
+
+        :param cube: The LightCube.
+        :param method: Name of the LightCube method, e.g. 'set_lights' or 'set_light_corners'.
+        :param lights: The lights given to the method.
+        :param key: Value identifying the lights, e.g. their color, so that the scheduler skips them if the cube
+            already shows them.
+        """
+
+        send = getattr(cube, method)
+        if self.scheduler is None:
+            send(*lights)
+        else:
+            self.scheduler.submit('cube%d.lights' % cube.object_id, send, *lights, key=key)
 
     async def on_cube_tapped(self, **kw):
         """
@@ -45,52 +72,29 @@ class Cubes:
         """
         Cubes.cube_tapped_id = self.__getattribute__('obj').__getattribute__('object_id')
 
-    def cube_blinking(self, id_cube_tapped):
+    @tracing.traced('Cubes.cube_blinking')
+    def cube_blinking(self, id_cube_tapped, speech=None):
         """
-        This function performs cube blinking.
+        This function says the operator of the tapped cube and starts its blinking, without waiting for its end.
 
         :param id_cube_tapped: The id of the cube tapped.
-        :return: A string that represents operators linked to the cube tapped.
+        :param speech: The SpeechManager saying the operator without waiting, cozmo says it directly if None.
+        :return: A string that represents operators linked to the cube tapped, None for an unknown cube.
         """
-        if id_cube_tapped == self.cube1.__getattribute__('object_id'):
-            self.robot.say_text("plus", in_parallel=True).wait_for_completed()
-
-            # blinking of tapped cube 1
-            for i in range(4):
-                self.cube1.set_light_corners(self.cube1_color, cozmo.lights.off_light,
-                                             self.cube1_color, cozmo.lights.off_light)
-                time.sleep(0.3)
-                self.cube1.set_light_corners(cozmo.lights.off_light, self.cube1_color,
-                                             cozmo.lights.off_light, self.cube1_color)
-                time.sleep(0.3)
-            self.cube1.set_lights(self.cube1_color)
-            return "+"
-
-        # If cube 2 is tapped, it will make a difference
-        if id_cube_tapped == self.cube2.__getattribute__('object_id'):
-            self.robot.say_text("moins", in_parallel=True).wait_for_completed()
-
-            # blinking of tapped cube 2
-            for i in range(4):
-                self.cube2.set_light_corners(cozmo.lights.blue_light, cozmo.lights.off_light,
-                                             cozmo.lights.blue_light, cozmo.lights.off_light)
-                time.sleep(0.3)
-                self.cube2.set_light_corners(cozmo.lights.off_light, cozmo.lights.blue_light,
-                                             cozmo.lights.off_light, cozmo.lights.blue_light)
-                time.sleep(0.3)
-            self.cube2.set_lights(cozmo.lights.blue_light)
-            return "-"
-
-        if id_cube_tapped == self.cube3.__getattribute__('object_id'):
-            self.robot.say_text("fois", in_parallel=True).wait_for_completed()
-
-            # blinking of tapped cube 3
-            for i in range(4):
-                self.cube3.set_light_corners(cozmo.lights.green_light, cozmo.lights.off_light,
-                                             cozmo.lights.green_light, cozmo.lights.off_light)
-                time.sleep(0.3)
-                self.cube3.set_light_corners(cozmo.lights.off_light, cozmo.lights.green_light,
-                                             cozmo.lights.off_light, cozmo.lights.green_light)
-                time.sleep(0.3)
-            self.cube3.set_lights(cozmo.lights.green_light)
-            return "*"
+
+        for cube, color_name, word, operator in ((self.cube1, 'cube1_color', "plus", "+"),
+                                                 (self.cube2, 'cube2_color', "moins", "-"),
+                                                 (self.cube3, 'cube3_color', "fois", "*")):
+            if cube is not None and id_cube_tapped == cube.object_id:
+                self.blinking = self.animator.play(cube, light_animations.blink_pattern(getattr(self, color_name)),
+                                                   send=self._send_corners)
+                if speech is None:
+                    with tracing.span('robot.say_text', text=word):
+                        self.robot.say_text(word, in_parallel=True).wait_for_completed()
+                else:
+                    speech.say(word)
+                return operator
+        return None
+
+    def _send_corners(self, cube, lights):
+        self.send_lights(cube, 'set_light_corners', *lights)
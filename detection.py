@@ -0,0 +1,274 @@
+"""
+Hands detection running apart from the robot behaviors.
+"""
+
+import collections
+import math
+import queue
+import threading
+import time
+
+import frames
+import hand as hd
+import hand_backends
+import metrics
+import tracing
+
+# Result of the detection on one frame, total and score are None when no hand is detected. A result is reused when
+# the frame did not change since the last analysed one: the result of that frame still holds for it
+DetectionResult = collections.namedtuple('DetectionResult',
+                                         ['frame', 'results', 'fingers_statuses', 'count', 'total', 'score', 'reused'],
+                                         defaults=(False,))
+
+
+class DetectionWorker(threading.Thread):
+    """
+    This class runs the hands landmarks detection and the fingers counting on every frame of a frame source in a
+    dedicated thread, and streams the results in a queue.
+
+    The worker never waits for its consumer: when the results queue is full, the oldest result is dropped.
+    """
+
+    def __init__(self, frame_source, hands=None, acquirer=None, max_pending_results=30, track_roi=False,
+                 backend_params=None, listeners=None, motion_gate=True):
+        """
+        :param frame_source: The FrameSource giving the camera frames.
+        :param hands: The backend performing the hands landmarks detection, or the name of a backend to create, the
+            shared mediapipe one if None.
+        :param acquirer: The FrameAcquirer turning camera images into mirrored frames, a new one if None.
+        :param max_pending_results: Maximum number of results waiting to be consumed.
+        :param track_roi: To only analyse the region of the hands found on the previous frame, see HandsRoiTracker.
+            The backend must then be in static image mode: the video mode of mediapipe already tracks the hands
+            between frames, and giving it regions of changing geometry breaks its tracking.
+        :param backend_params: Parameters of the backend created when hands is a name.
+        :param listeners: List of callables also called with each DetectionResult from the worker thread, e.g. to
+            push the counts to the web page. The list can be changed while the worker runs.
+        :param motion_gate: The MotionGate skipping the detection on the frames that did not change, True for a
+            default one, None to analyse every frame.
+        """
+
+        super().__init__(daemon=True)
+        self.frame_source = frame_source
+        if isinstance(hands, str):
+            hands = hand_backends.create_backend(hands, **(backend_params or {}))
+        self.hands = hands if hands is not None else hd.hands_videos
+        if track_roi:
+            self.hands = hd.HandsRoiTracker(self.hands)
+        self.acquirer = acquirer if acquirer is not None else frames.FrameAcquirer(mirror=True)
+        self.results = queue.Queue(maxsize=max_pending_results)
+        self.listeners = listeners if listeners is not None else []
+        self.motion_gate = hd.MotionGate() if motion_gate is True else motion_gate
+        self._last_result = None
+        self._stop_event = threading.Event()
+
+        # Scale of the images given to the detection and number of frames skipped after each analysed one, they can
+        # be changed while the worker runs, e.g. by a quality.AdaptiveQualityController
+        self.inference_scale = 1.0
+        self.frame_skip = 0
+        self._frames_received = 0
+        self._scale_used = 1.0
+
+        # Number of frames analysed and skipped, of results dropped because nobody consumed them, and time in seconds
+        # spent in the detection
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.results_dropped = 0
+        self.busy_time = 0.0
+
+    def stop(self):
+        """
+        Stop the worker after the frame being processed.
+        """
+
+        self._stop_event.set()
+
+    def get(self, timeout=None):
+        """
+        Wait for the next detection result.
+
+        :param timeout: Maximum waiting time in seconds.
+        :return: **result** - A DetectionResult, or None on timeout.
+        """
+
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def detect(self, frame):
+        """
+        Detect the hands and count the fingers up on a frame.
+
+        :param frame: The Frame to analyse.
+        :return: **result** - The DetectionResult of the frame.
+        """
+
+        with metrics.timer('frame.acquire'):
+            im = self.acquirer.acquire(frame.image)
+
+        if self.motion_gate is not None:
+            with metrics.timer('frame.motion'):
+                changed = self.motion_gate.changed(im)
+            if not changed and self._last_result is not None:
+                # The scene did not change, the last result holds for this frame
+                return self._last_result._replace(frame=frame, reused=True)
+
+        self._last_result = self._detect(frame, im)
+        return self._last_result
+
+    def _detect(self, frame, im):
+        scale = self.inference_scale
+        if scale != self._scale_used:
+            # The region tracked on the previous frames is in pixels of the previous scale
+            if isinstance(self.hands, hd.HandsRoiTracker):
+                self.hands.roi = None
+            self._scale_used = scale
+        if scale < 1.0:
+            import cv2
+
+            height, width = im.shape[:2]
+            # The landmarks are normalized, so they do not depend on the size of the image
+            im = cv2.resize(im, (max(1, round(width * scale)), max(1, round(height * scale))),
+                            interpolation=cv2.INTER_AREA)
+
+        im, results = hd.detectHandsLandmarks(im, self.hands)
+
+        if not results.multi_hand_landmarks:
+            return DetectionResult(frame, results, None, None, None, None)
+
+        im, fingers_statuses, count = hd.countFingers(im, results)
+        # The detection is as reliable as its least certain hand
+        score = min(hand_info.classification[0].score for hand_info in results.multi_handedness)
+        return DetectionResult(frame, results, fingers_statuses, count, sum(count.values()), score)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            frame = self.frame_source.get(timeout=0.5)
+            if frame is None:
+                continue
+
+            self._frames_received += 1
+            if self.frame_skip and self._frames_received % (self.frame_skip + 1) != 1:
+                self.frames_skipped += 1
+                continue
+
+            start = time.perf_counter()
+            with tracing.span('detection.frame', sequence=frame.sequence):
+                result = self.detect(frame)
+            self.busy_time += time.perf_counter() - start
+            metrics.observe('detection.latency', self.frame_source.done(frame))
+            self.frames_processed += 1
+            self._publish(result)
+            for listener in tuple(self.listeners):
+                listener(result)
+
+    def _publish(self, result):
+        while True:
+            try:
+                self.results.put_nowait(result)
+                return
+            except queue.Full:
+                try:
+                    self.results.get_nowait()
+                    self.results_dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class FingerCountStabilizer:
+    """
+    This class turns the noisy counts of successive frames into stable counts with a majority vote over a sliding
+    window of the last frames.
+
+    A count is emitted as soon as it gets enough votes, and only once: the same count is not emitted again until
+    another count has been emitted or the stabilizer is reset.
+    """
+
+    def __init__(self, window=7, min_agreement=0.7, min_score=0.5):
+        """
+        :param window: Number of the last frames taking part in the vote.
+        :param min_agreement: Fraction of the window that must agree on a count to emit it.
+        :param min_score: Minimum detection score for a count to take part in the vote.
+        """
+
+        self.window = window
+        self.min_votes = max(1, math.ceil(window * min_agreement))
+        self.min_score = min_score
+        self._counts = collections.deque(maxlen=window)
+        self.stable_count = None
+
+    def reset(self):
+        """
+        Forget the last counts and the last emitted count.
+        """
+
+        self._counts.clear()
+        self.stable_count = None
+
+    def update(self, total, score=1.0):
+        """
+        Add the count of a new frame.
+
+        :param total: The number of fingers up in the frame, None when no hand is detected.
+        :param score: The confidence of the detection, the count is ignored if it is lower than min_score.
+        :return: **count** - The new stable count, or None if no new count reached the consensus.
+        """
+
+        if total is not None and (score is None or score < self.min_score):
+            total = None
+        self._counts.append(total)
+
+        votes = collections.Counter(count for count in self._counts if count is not None)
+        if not votes:
+            return None
+
+        count, nb_votes = votes.most_common(1)[0]
+        if nb_votes >= self.min_votes and count != self.stable_count:
+            self.stable_count = count
+            return count
+        return None
+
+
+class CountGap:
+    """
+    This class tells when the hands showing a count have gone: a few frames in a row without hand, or with another
+    count, must be seen before the next counts are voted. It keeps a hand still showing the previous number or
+    operator from being read as the next one.
+    """
+
+    def __init__(self, min_frames=2, min_score=0.5):
+        """
+        :param min_frames: Number of frames in a row that must show no hand or another count.
+        :param min_score: Minimum detection score for a count to be considered, see FingerCountStabilizer.
+        """
+
+        self.min_frames = min_frames
+        self.min_score = min_score
+        self.reset()
+
+    def reset(self, previous=None):
+        """
+        Wait for the hands showing a count to go.
+
+        :param previous: The count shown until now, None if there is nothing to wait for.
+        """
+
+        self.previous = previous
+        self._other_frames = 0
+        self.passed = previous is None
+
+    def update(self, total, score=1.0):
+        """
+        Add the count of a new frame.
+
+        :param total: The number of fingers up in the frame, None when no hand is detected.
+        :param score: The confidence of the detection.
+        :return: True once the gap has been seen, from this frame on.
+        """
+
+        if total is not None and (score is None or score < self.min_score):
+            total = None
+        if not self.passed:
+            self._other_frames = self._other_frames + 1 if total != self.previous else 0
+            self.passed = self._other_frames >= self.min_frames
+        return self.passed
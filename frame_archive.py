@@ -0,0 +1,279 @@
+"""
+Memory-mapped archive of camera frames for long recorded sessions.
+
+An archive is a directory holding:
+
+- ``meta.json``: the shape and dtype of the frames and free metadata,
+- ``frames.bin``: the raw frames one after the other, the file grows by chunks of frames,
+- ``index.bin``: one fixed-size record (timestamp, frame id) per frame.
+
+A frame is written before its index record, so a reader only ever sees complete frames and can read an archive while
+it is still being written. Frames are read from a memory map, without any copy.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+import cozmo
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('frame_id', '<i8')])
+META_FILE = "meta.json"
+FRAMES_FILE = "frames.bin"
+INDEX_FILE = "index.bin"
+
+
+class FrameArchiveWriter:
+    """
+    This class appends frames of a fixed shape to an archive.
+    """
+
+    def __init__(self, path, shape=(240, 320, 3), dtype=np.uint8, chunk_frames=256, metadata=None):
+        """
+        :param path: Directory of the archive, created if needed. Frames are appended to an existing archive.
+        :param shape: Shape of the frames, cozmo's camera gives 320x240 RGB frames.
+        :param dtype: Data type of the frames.
+        :param chunk_frames: Number of frames by which the frames file grows.
+        :param metadata: Dictionary of free metadata saved with the archive.
+        """
+
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = chunk_frames
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+            if tuple(meta['shape']) != self.shape or np.dtype(meta['dtype']) != self.dtype:
+                raise ValueError("Archive %s holds %s %s frames" % (path, meta['shape'], meta['dtype']))
+        else:
+            with open(meta_path, 'w') as meta_file:
+                json.dump({'shape': list(self.shape), 'dtype': self.dtype.str, 'metadata': metadata or {}}, meta_file)
+
+        self._index = open(os.path.join(path, INDEX_FILE), 'ab')
+        frames_path = os.path.join(path, FRAMES_FILE)
+        # Not in append mode, which would ignore the position of the writes
+        self._frames = open(frames_path, 'r+b' if os.path.exists(frames_path) else 'w+b')
+        self.count = self._index.tell() // INDEX_DTYPE.itemsize
+        self._capacity = os.fstat(self._frames.fileno()).st_size // self.frame_bytes
+
+    def append(self, frame, timestamp=None, frame_id=-1):
+        """
+        Append a frame.
+
+        :param frame: Numpy array of the archive's shape, or a PIL image.
+        :param timestamp: Time of the frame, now if None.
+        :param frame_id: Id of the frame given by the camera.
+        :return: **index** - The index of the frame in the archive.
+        """
+
+        frame = np.ascontiguousarray(frame, dtype=self.dtype)
+        if frame.shape != self.shape:
+            raise ValueError("Frame of shape %s, the archive holds %s frames" % (frame.shape, self.shape))
+
+        with self._lock:
+            index = self.count
+
+            # Grow the frames file by a whole chunk to limit the file system updates
+            if index >= self._capacity:
+                self._capacity = index + self.chunk_frames
+                self._frames.truncate(self._capacity * self.frame_bytes)
+
+            self._frames.seek(index * self.frame_bytes)
+            self._frames.write(memoryview(frame).cast('B'))
+            self._frames.flush()
+
+            # The index record makes the frame visible to the readers
+            record = np.array([(time.time() if timestamp is None else timestamp, frame_id)], dtype=INDEX_DTYPE)
+            self._index.write(record.tobytes())
+            self._index.flush()
+
+            self.count += 1
+        return index
+
+    def close(self):
+        """
+        Close the archive, the frames file is trimmed to the written frames.
+        """
+
+        with self._lock:
+            self._frames.truncate(self.count * self.frame_bytes)
+            self._frames.close()
+            self._index.close()
+
+
+class FrameArchive:
+    """
+    This class reads the frames of an archive by index from a memory map, possibly while it is written.
+
+    It can be used as a read-only sequence of frames, e.g. as the frames of a replay.Session.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Directory of the archive.
+        """
+
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.metadata = meta.get('metadata', {})
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self._frames = None
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._index_file = open(os.path.join(path, INDEX_FILE), 'rb')
+        self.refresh()
+
+    def refresh(self):
+        """
+        Take into account the frames appended since the last refresh.
+
+        :return: **count** - The number of frames of the archive.
+        """
+
+        # Only read the new complete records
+        self._index_file.seek(len(self.index) * INDEX_DTYPE.itemsize)
+        data = self._index_file.read()
+        data = data[:len(data) - len(data) % INDEX_DTYPE.itemsize]
+        if not data:
+            return len(self.index)
+
+        index = np.concatenate((self.index, np.frombuffer(data, dtype=INDEX_DTYPE)))
+        count = len(index)
+
+        if self._frames is None or len(self._frames) < count:
+            capacity = os.path.getsize(os.path.join(self.path, FRAMES_FILE)) // self.frame_bytes
+            self._frames = np.memmap(os.path.join(self.path, FRAMES_FILE), dtype=self.dtype, mode='r',
+                                     shape=(capacity,) + self.shape)
+
+        self.index = index
+        return count
+
+    def close(self):
+        """
+        Close the archive.
+        """
+
+        self._index_file.close()
+        self._frames = None
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    @property
+    def frame_ids(self):
+        return self.index['frame_id']
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        """
+        Get frames without copying them.
+
+        :param index: Index or slice of the frames, negative indexes count from the last frame.
+        :return: **frame** - A read-only view of the memory-mapped frames.
+        """
+
+        if self._frames is None:
+            raise IndexError("The archive is empty")
+        return self._frames[:len(self.index)][index]
+
+    def frame(self, index):
+        """
+        Get a frame without copying it.
+
+        :param index: Index of the frame.
+        :return: **frame** - A read-only view of the memory-mapped frame.
+        """
+
+        return self[index]
+
+
+class ArchiveRecorder:
+    """
+    This class appends the frames of cozmo's camera to an archive while the robot is running.
+
+    The frames are written by a thread of the recorder, the SDK's event loop only queues them. When the disk falls
+    behind and the queue is full, the new frames are dropped rather than blocking the loop.
+    """
+
+    def __init__(self, robot, path, chunk_frames=256, metadata=None, max_pending_frames=64):
+        """
+        :param robot: An instance of cozmo Robot.
+        :param path: Directory of the archive.
+        :param chunk_frames: Number of frames by which the frames file grows.
+        :param metadata: Dictionary of free metadata saved with the archive.
+        :param max_pending_frames: Maximum number of frames waiting to be written.
+        """
+
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.metadata = metadata
+        self.writer = None
+        # Number of frames dropped because the queue was full
+        self.dropped = 0
+        # Camera images waiting to be written, None stops the thread
+        self._pending = queue.Queue(maxsize=max_pending_frames)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._handler = robot.world.add_event_handler(cozmo.world.EvtNewCameraImage, self._on_new_camera_image)
+
+    def _on_new_camera_image(self, evt, *, image, **kw):
+        # Called from the SDK's event loop, which must never wait for the disk
+        try:
+            self._pending.put_nowait(image)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            image = self._pending.get()
+            if image is None:
+                return
+            frame = np.asarray(image.raw_image)
+            if self.writer is None:
+                # The shape of the frames is known with the first one
+                self.writer = FrameArchiveWriter(self.path, frame.shape, frame.dtype, self.chunk_frames,
+                                                 self.metadata)
+            self.writer.append(frame, image.image_recv_time, image.image_number)
+
+    def stop(self):
+        """
+        Stop recording, write the queued frames and close the archive.
+        """
+
+        self._handler.disable()
+        self._pending.put(None)
+        self._thread.join()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def archive_frame_grabber(archive):
+    """
+    Build a frame grabber for a FrameBroadcaster showing the last frame of an archive, e.g. one being recorded.
+
+    :param archive: The FrameArchive to show.
+    :return: **grab** - A callable returning a tuple (frame index, frame) or None if the archive is empty.
+    """
+
+    def grab():
+        count = archive.refresh()
+        if not count:
+            return None
+        return count - 1, archive[count - 1]
+
+    return grab
@@ -0,0 +1,232 @@
+"""
+Acquisition of the camera frames given to the hands landmarks detection.
+"""
+
+import collections
+import threading
+import time
+
+import cozmo
+import numpy as np
+
+# A camera image with the moment it was received, to measure the detection latency
+Frame = collections.namedtuple('Frame', ['sequence', 'image', 'frame_id', 'arrival_time'])
+
+
+class FrameAcquirer:
+    """
+    This class turns camera images into numpy frames while limiting the copies made for each frame.
+
+    The horizontal flip is a negative-stride view of the image, which is only copied into a preallocated buffer
+    when a contiguous array is needed (e.g. by mediapipe). The returned frame is therefore only valid until the
+    next call to :meth:`acquire`.
+    """
+
+    def __init__(self, mirror=True):
+        """
+        :param mirror: To flip horizontally the frames.
+        """
+
+        self.mirror = mirror
+        self._buffer = None
+
+        # Number of frames acquired and of arrays allocated for them
+        self.frames = 0
+        self.allocations = 0
+
+    @property
+    def allocations_per_frame(self):
+        """
+        Average number of arrays allocated per acquired frame.
+        """
+
+        return self.allocations / self.frames if self.frames else 0.0
+
+    def acquire(self, image, contiguous=True):
+        """
+        Get the frame of a camera image.
+
+        :param image: A PIL image or a numpy array of shape (height, width, channels).
+        :param contiguous: To return a C-contiguous array, otherwise the frame may be a view of the image.
+        :return: **frame** - The frame as a numpy array, flipped if specified.
+        """
+
+        self.frames += 1
+
+        if isinstance(image, np.ndarray):
+            frame = image
+        else:
+            # Exporting a PIL image always makes one copy
+            frame = np.asarray(image)
+            self.allocations += 1
+
+        if self.mirror:
+            frame = frame[:, ::-1]
+
+        if not contiguous or frame.flags.c_contiguous:
+            return frame
+
+        if self._buffer is None or self._buffer.shape != frame.shape or self._buffer.dtype != frame.dtype:
+            self._buffer = np.empty(frame.shape, dtype=frame.dtype)
+            self.allocations += 1
+
+        np.copyto(self._buffer, frame)
+        return self._buffer
+
+
+class LatestFrameQueue:
+    """
+    This class is a queue holding at most one frame: putting a frame replaces the one not consumed yet.
+
+    Producers never block, and a consumer always gets the most recent frame, exactly once.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._closed = False
+
+        # Number of frames replaced before being consumed
+        self.dropped = 0
+
+    def put(self, frame):
+        """
+        Put a frame in the queue, replacing the pending one.
+
+        :param frame: The new frame.
+        """
+
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._condition.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Wait for a frame and remove it from the queue.
+
+        :param timeout: Maximum waiting time in seconds, None to wait until a frame arrives or the queue is closed.
+        :return: **frame** - The most recent frame, or None on timeout or if the queue is closed.
+        """
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame is not None or self._closed, timeout)
+            frame, self._frame = self._frame, None
+            self._condition.notify_all()
+            return frame
+
+    def wait_empty(self, timeout=None):
+        """
+        Wait until the pending frame is consumed.
+
+        :param timeout: Maximum waiting time in seconds.
+        :return: True if the queue is empty or closed, False on timeout.
+        """
+
+        with self._condition:
+            return self._condition.wait_for(lambda: self._frame is None or self._closed, timeout)
+
+    def close(self):
+        """
+        Close the queue, waking up the waiting consumers.
+        """
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class FrameSource:
+    """
+    This class is the base of the frame sources: frames are pushed into a latest-only queue by a producer and
+    consumed by the detection, which reports when it is done with each of them to measure its latency.
+    """
+
+    def __init__(self, latency_window=100):
+        """
+        :param latency_window: Number of latencies kept to compute the mean latency.
+        """
+
+        self.queue = LatestFrameQueue()
+        self.latencies = collections.deque(maxlen=latency_window)
+        self._sequence = 0
+
+    def push(self, image, frame_id=None):
+        """
+        Push a new image, this never blocks.
+
+        :param image: The camera image.
+        :param frame_id: Id of the image given by the camera, if any.
+        """
+
+        self._sequence += 1
+        self.queue.put(Frame(self._sequence, image, frame_id, time.monotonic()))
+
+    def get(self, timeout=None):
+        """
+        Wait for the next frame, each frame is returned only once.
+
+        :param timeout: Maximum waiting time in seconds.
+        :return: **frame** - A Frame, or None on timeout or if the source is closed.
+        """
+
+        return self.queue.get(timeout)
+
+    def done(self, frame):
+        """
+        Record that the processing of a frame is over.
+
+        :param frame: The processed frame.
+        :return: **latency** - Time in seconds between the arrival of the frame and the end of its processing.
+        """
+
+        latency = time.monotonic() - frame.arrival_time
+        self.latencies.append(latency)
+        return latency
+
+    @property
+    def mean_latency(self):
+        """
+        Mean latency in seconds of the last processed frames.
+        """
+
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    @property
+    def dropped(self):
+        """
+        Number of frames which arrived while the previous one was still waiting to be processed.
+        """
+
+        return self.queue.dropped
+
+    def close(self):
+        """
+        Stop the source.
+        """
+
+        self.queue.close()
+
+
+class CameraFrameSource(FrameSource):
+    """
+    This class receives the frames of cozmo's camera from the new camera image events of the SDK.
+    """
+
+    def __init__(self, robot, latency_window=100):
+        """
+        :param robot: An instance of cozmo Robot.
+        :param latency_window: Number of latencies kept to compute the mean latency.
+        """
+
+        super().__init__(latency_window)
+        self._handler = robot.world.add_event_handler(cozmo.world.EvtNewCameraImage, self._on_new_camera_image)
+
+    def _on_new_camera_image(self, evt, *, image, **kw):
+        # Called on the SDK event loop, this must not block
+        self.push(image.raw_image, image.image_number)
+
+    def close(self):
+        self._handler.disable()
+        super().close()
@@ -0,0 +1,323 @@
+"""
+Game loop of a robot as an explicit state machine.
+
+A round goes through the states:
+
+- WAITING_FOR_OPERAND: the fingers of the first number are counted,
+- WAITING_FOR_OPERATOR: cozmo waits for a cube to be tapped, or in gesture mode for an operator shown with the hands
+  once the hands showing the first number have gone or changed, whichever comes first,
+- WAITING_FOR_OPERAND: the fingers of the second number are counted, once the hands showing the first number or the
+  operator have gone or changed,
+- ANNOUNCING: cozmo says the operation and its result,
+
+and the engine is IDLE between the rounds. The engine lives as long as the robot: its detection worker and its tap
+handler are created once and reused by every round, and a round can only start when none is running.
+"""
+
+import collections
+import operator
+import queue
+import threading
+import time
+
+import cozmo
+
+import detection
+import frames
+import gestures as gs
+import metrics
+import speech as sp
+import tracing
+import two_hands
+
+IDLE = "idle"
+WAITING_FOR_OPERAND = "waiting_for_operand"
+WAITING_FOR_OPERATOR = "waiting_for_operator"
+ANNOUNCING = "announcing"
+
+OPERATIONS = {'+': operator.add, '-': operator.sub, '*': operator.mul}
+
+# Time window in seconds over which the rounds per minute are computed
+ROUNDS_WINDOW = 300.0
+
+
+class GameEngine:
+    """
+    This class plays the rounds of the game with a robot, one at a time.
+    """
+
+    def __init__(self, robot, cubes, hands=None, listeners=None, speech=None, continuous=False, tap_timeout=30.0,
+                 quality=None, gestures=False):
+        """
+        :param robot: An instance of cozmo Robot.
+        :param cubes: The Cubes of the robot.
+        :param hands: The backend performing the hands landmarks detection, the shared mediapipe one if None.
+        :param listeners: List of callables called with each detection result, see DetectionWorker.
+        :param speech: The SpeechManager saying cozmo's phrases, one is created if None.
+        :param continuous: To start a new round as soon as one ends, otherwise each round is requested.
+        :param tap_timeout: Time in seconds after which cozmo asks again to tap a cube.
+        :param quality: The quality.AdaptiveQualityController adjusting the detection worker, if any.
+        :param gestures: To also recognize the operators shown with the hands, see gestures.
+        """
+
+        self.robot = robot
+        self.cubes = cubes
+        self.hands = hands
+        self.listeners = listeners
+        self.own_speech = speech is None
+        self.speech = speech if speech is not None else sp.SpeechManager(robot)
+        self.continuous = continuous
+        self.tap_timeout = tap_timeout
+        self.quality = quality
+        self.gestures = gs.GestureRecognizer() if gestures else None
+        # The next input is only read once the hands showing the count of the last one have gone
+        self._gesture_gap = detection.CountGap()
+        self._shown_total = None
+
+        self.state = IDLE
+        # Operator inputs as tuples ('tap', cube id) or ('gesture', operator), None when the engine stops
+        self.inputs = queue.Queue()
+        self.worker = None
+        self._handler = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._round_requested = threading.Event()
+        self._stop_event = threading.Event()
+        self._round_active = False
+
+        # Time of entry in the current state, end times of the rounds and total time spent in each state
+        self._state_start = time.monotonic()
+        self._round_ends = collections.deque()
+        self.rounds = 0
+        self.state_times = collections.defaultdict(float)
+        # Number of operators given by each kind of input
+        self.operator_inputs = collections.Counter()
+
+    @property
+    def round_active(self):
+        """
+        True while a round is being played or is about to start.
+        """
+
+        return self._round_active or self._round_requested.is_set()
+
+    def setup(self):
+        """
+        Prepare the robot and create the resources shared by the rounds, only done once.
+        """
+
+        if self.worker is not None:
+            return
+
+        with metrics.timer('robot.setup'), tracing.span('robot.setup'):
+            # Set cozmo's head angle
+            self.robot.set_head_angle(cozmo.robot.MAX_HEAD_ANGLE / 2, in_parallel=True).wait_for_completed()
+
+            # Set cozmo's lift height
+            if self.robot.lift_height.distance_mm != cozmo.robot.MIN_LIFT_HEIGHT_MM:
+                self.robot.set_lift_height(0.0).wait_for_completed()
+
+        self._handler = self.robot.add_event_handler(cozmo.objects.EvtObjectTapped, self._on_cube_tapped)
+
+        # Analyse the camera frames as long as the engine lives
+        self.worker = detection.DetectionWorker(frames.CameraFrameSource(self.robot), hands=self.hands,
+                                                listeners=self.listeners)
+        if self.quality is not None:
+            self.quality.attach(self.worker)
+        self.worker.start()
+
+    def start(self):
+        """
+        Start the engine's thread, which plays the rounds as they are requested.
+        """
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def request_round(self):
+        """
+        Ask for a new round.
+
+        :return: True if the round will start, False if a round is already running.
+        """
+
+        with self._lock:
+            if self.round_active:
+                return False
+            self._round_requested.set()
+        return True
+
+    def stop(self):
+        """
+        Stop the engine, the running round is abandoned.
+        """
+
+        self._stop_event.set()
+        self._round_requested.set()
+        # Wake up a round waiting for an operator
+        self.inputs.put(None)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5.0)
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker.frame_source.close()
+        if self._handler is not None:
+            self._handler.disable()
+        if self.own_speech:
+            self.speech.close()
+
+    def play_round(self):
+        """
+        Play a round in the calling thread.
+
+        :return: **result** - A tuple (first number, operation, second number, result), None if the engine was
+            stopped.
+        """
+
+        self.setup()
+        with self._lock:
+            self._round_active = True
+            self._round_requested.clear()
+        self.speech.start_round()
+        round_start = time.monotonic()
+
+        try:
+            state = WAITING_FOR_OPERAND
+            numbers = []
+            operation = None
+            self._shown_total = None
+            while state is not None:
+                self._enter(state)
+
+                if state == WAITING_FOR_OPERAND:
+                    # The hands still showing the first number or the operator must go before the second number
+                    number = two_hands.hand_detection(self.robot, self.worker, speech=self.speech,
+                                                      stop_event=self._stop_event, previous_total=self._shown_total)
+                    if number is None:
+                        return None
+                    print(number)
+                    numbers.append(number)
+                    self._shown_total = number
+                    state = WAITING_FOR_OPERATOR if len(numbers) == 1 else ANNOUNCING
+
+                elif state == WAITING_FOR_OPERATOR:
+                    operation = self._wait_operator()
+                    if operation is None:
+                        return None
+                    state = WAITING_FOR_OPERAND
+
+                elif state == ANNOUNCING:
+                    result = OPERATIONS[operation](*numbers)
+                    # Cozmo say the operation and its result in a single sentence
+                    self.speech.announce(numbers[0], operation, numbers[1], result)
+                    print(result)
+                    print("Temps de parole : %.1f s" % self.speech.end_round())
+                    state = None
+
+            self._round_ends.append(time.monotonic())
+            self.rounds += 1
+            return numbers[0], operation, numbers[1], result
+        finally:
+            self._enter(IDLE)
+            tracing.add_span('game.round', round_start, time.monotonic() - round_start, {'round': self.rounds})
+            with self._lock:
+                self._round_active = False
+
+    def rounds_per_minute(self):
+        """
+        :return: **rate** - The number of rounds per minute over the last ROUNDS_WINDOW seconds.
+        """
+
+        now = time.monotonic()
+        while self._round_ends and self._round_ends[0] < now - ROUNDS_WINDOW:
+            self._round_ends.popleft()
+        return 60.0 * len(self._round_ends) / ROUNDS_WINDOW
+
+    def stats(self):
+        """
+        :return: **stats** - A dictionary of the current state, the number of rounds, the rounds per minute, the
+            total time in seconds spent in each state, the number of operators given by taps and by gestures and the
+            fraction of the frames whose detection was skipped.
+        """
+
+        gate = self.worker.motion_gate if self.worker is not None else None
+        return {'state': self.state, 'round_active': self.round_active, 'rounds': self.rounds,
+                'rounds_per_minute': self.rounds_per_minute(), 'state_times': dict(self.state_times),
+                'operator_inputs': dict(self.operator_inputs),
+                'motion_skip_ratio': gate.skip_ratio if gate is not None else 0.0}
+
+    def _enter(self, state):
+        now = time.monotonic()
+        duration = now - self._state_start
+        self.state_times[self.state] += duration
+        metrics.observe('game.' + self.state, duration)
+        if self.state != IDLE:
+            tracing.add_span('game.' + self.state, self._state_start, duration)
+        self.state = state
+        self._state_start = now
+
+    def _on_cube_tapped(self, evt, **kw):
+        self.inputs.put(('tap', evt.obj.object_id))
+
+    def _on_result(self, result):
+        # Called from the detection thread while waiting for an operator
+        if not self._gesture_gap.update(result.total, result.score):
+            return
+        operation = self.gestures.update(result)
+        if operation is not None:
+            # The hands showing the operator also show a count
+            self._shown_total = result.total
+            self.inputs.put(('gesture', operation))
+
+    def _wait_operator(self):
+        # The inputs given before this state do not count
+        while not self.inputs.empty():
+            self.inputs.get_nowait()
+
+        if self.gestures is not None:
+            self.gestures.reset()
+            self._gesture_gap.reset(self._shown_total)
+            self.worker.listeners.append(self._on_result)
+        try:
+            print('J\'' + 'attends que tu tapes')
+            while not self._stop_event.is_set():
+                # The cube can be tapped or the operator shown while cozmo speaks
+                self.speech.say("Tape sur un cube" if self.gestures is None else "Tape sur un cube ou fais un signe")
+                try:
+                    operator_input = self.inputs.get(timeout=self.tap_timeout)
+                except queue.Empty:
+                    continue
+                if operator_input is None:
+                    break
+
+                kind, value = operator_input
+                if kind == 'gesture':
+                    operation = value
+                    self.speech.say(sp.OPERATOR_WORDS[operation])
+                else:
+                    with metrics.timer('cubes.blinking'):
+                        operation = self.cubes.cube_blinking(value, self.speech)
+                if operation is not None:
+                    self.operator_inputs[kind] += 1
+                    return operation
+            return None
+        finally:
+            if self.gestures is not None:
+                self.worker.listeners.remove(self._on_result)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not self.continuous:
+                self._round_requested.wait()
+            if self._stop_event.is_set():
+                return
+            try:
+                self.play_round()
+            except Exception as e:
+                # A failed round must not stop the engine, the next one can be requested
+                print("The round failed: %r" % e)
+                with self._lock:
+                    self._round_requested.clear()
+                # Do not retry at once in continuous mode
+                self._stop_event.wait(1.0)
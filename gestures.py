@@ -0,0 +1,158 @@
+"""
+Recognition of the operators shown with the hands.
+
+The operators are recognized on the landmarks already detected to count the fingers, so no other inference is run.
+Each hand is described by the angles of the joints of its fingers, computed for all the hands at once, and by the
+direction of its palm:
+
+- a flat horizontal hand, its four fingers straight, is a minus '-',
+- the index and the middle fingers straight and crossed, the other ones folded, is a times '*',
+- the index fingers of both hands straight and crossing each other at a right angle is a plus '+'.
+
+The landmarks are normalized by the width and the height of the image, so their x is first scaled by the aspect ratio
+of the image for the angles to be those seen in it.
+"""
+
+import numpy as np
+
+import detection
+import hand_backends
+
+# Landmarks of each finger from the wrist to the tip, in the order of hand.FINGERS_NAMES
+FINGERS_CHAINS = np.array([[0, 1, 2, 3, 4], [0, 5, 6, 7, 8], [0, 9, 10, 11, 12], [0, 13, 14, 15, 16],
+                           [0, 17, 18, 19, 20]])
+WRIST = 0
+INDEX_MCP = 5
+INDEX_TIP = 8
+MIDDLE_MCP = 9
+MIDDLE_TIP = 12
+
+# Smallest joint angle in degrees of a straight finger
+STRAIGHT_ANGLE = 150.0
+# Largest vertical part of the direction of a horizontal hand
+MAX_HORIZONTAL_SLOPE = 0.35
+# Smallest angle in degrees between two crossing index fingers
+MIN_CROSSING_ANGLE = 60.0
+# Width over height of the images of cozmo's camera, 320x240
+CAMERA_ASPECT_RATIO = 320 / 240
+
+
+def joint_angles(landmarks):
+    """
+    Compute the angle of each joint of the fingers of any number of hands at once.
+
+    :param landmarks: A float array of shape (..., 21, 3) containing the landmarks of the hands.
+    :return: **angles** - A float array of shape (..., 5, 3) of the angles in degrees at the three joints of each
+        finger, 180 for a straight joint.
+    """
+
+    chains = np.asarray(landmarks)[..., FINGERS_CHAINS, :]
+    before = chains[..., :-2, :] - chains[..., 1:-1, :]
+    after = chains[..., 2:, :] - chains[..., 1:-1, :]
+    cosines = (before * after).sum(axis=-1) / np.maximum(
+        np.linalg.norm(before, axis=-1) * np.linalg.norm(after, axis=-1), 1e-9)
+    return np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+
+
+def hand_directions(landmarks):
+    """
+    :param landmarks: A float array of shape (..., 21, 3) containing the landmarks of the hands.
+    :return: **directions** - A float array of shape (..., 2) of the unit vectors from the wrist to the base of the
+        middle finger, in the image plane.
+    """
+
+    landmarks = np.asarray(landmarks)
+    vectors = landmarks[..., MIDDLE_MCP, :2] - landmarks[..., WRIST, :2]
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-9)
+
+
+def _segments_cross(a0, a1, b0, b1):
+    # The segments cross if the ends of each one are on both sides of the other one
+    def side(p, q, r):
+        return np.sign((q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0]))
+
+    return side(a0, a1, b0) != side(a0, a1, b1) and side(b0, b1, a0) != side(b0, b1, a1)
+
+
+def classify(landmarks, aspect_ratio=CAMERA_ASPECT_RATIO):
+    """
+    Recognize the operator shown by the hands.
+
+    :param landmarks: A float array of shape (hands, 21, 3) containing the landmarks of the hands, normalized by the
+        size of the image.
+    :param aspect_ratio: Width over height of the image the landmarks were detected on.
+    :return: **operator** - '+', '-' or '*', None if the hands show no operator.
+    """
+
+    landmarks = np.asarray(landmarks)
+    if len(landmarks) == 0:
+        return None
+    # Same unit on both axes, mediapipe gives z at about the scale of x
+    landmarks = landmarks * [aspect_ratio, 1.0, aspect_ratio]
+
+    # The base of a straight finger can still make an angle with the palm, only its two other joints are checked
+    straight = joint_angles(landmarks)[..., 1:].min(axis=-1) >= STRAIGHT_ANGLE
+
+    if len(landmarks) >= 2 and straight[0, 1] and straight[1, 1]:
+        first = landmarks[0, [INDEX_MCP, INDEX_TIP], :2]
+        second = landmarks[1, [INDEX_MCP, INDEX_TIP], :2]
+        first_direction = (first[1] - first[0]) / max(np.linalg.norm(first[1] - first[0]), 1e-9)
+        second_direction = (second[1] - second[0]) / max(np.linalg.norm(second[1] - second[0]), 1e-9)
+        angle = np.degrees(np.arccos(np.clip(abs(np.dot(first_direction, second_direction)), 0.0, 1.0)))
+        if angle >= MIN_CROSSING_ANGLE and _segments_cross(first[0], first[1], second[0], second[1]):
+            return '+'
+
+    directions = hand_directions(landmarks)
+    for hand_landmarks, hand_straight, direction in zip(landmarks, straight, directions):
+        if hand_straight[1:].all() and abs(direction[1]) <= MAX_HORIZONTAL_SLOPE:
+            return '-'
+
+        if hand_straight[1] and hand_straight[2] and not hand_straight[3] and not hand_straight[4]:
+            # The tips are in the reverse order of the bases when the fingers are crossed
+            bases = hand_landmarks[INDEX_MCP, 0] - hand_landmarks[MIDDLE_MCP, 0]
+            tips = hand_landmarks[INDEX_TIP, 0] - hand_landmarks[MIDDLE_TIP, 0]
+            if bases * tips < 0:
+                return '*'
+    return None
+
+
+class GestureRecognizer:
+    """
+    This class recognizes the operators shown on successive detection results, and emits one once it is stable over
+    a few frames.
+    """
+
+    def __init__(self, window=7, min_agreement=0.7, min_score=0.5, aspect_ratio=CAMERA_ASPECT_RATIO):
+        """
+        :param window: Number of the last frames taking part in the vote.
+        :param min_agreement: Fraction of the window that must agree on an operator to emit it.
+        :param min_score: Minimum detection score for a frame to take part in the vote.
+        :param aspect_ratio: Width over height of the analysed images.
+        """
+
+        self.stabilizer = detection.FingerCountStabilizer(window, min_agreement, min_score)
+        self.aspect_ratio = aspect_ratio
+        self._last_results = None
+        self._last_operator = None
+
+    def reset(self):
+        """
+        Forget the last frames, e.g. before waiting for a new operator.
+        """
+
+        self.stabilizer.reset()
+        self._last_results = None
+
+    def update(self, result):
+        """
+        Add the result of a new frame, it can be called from a DetectionWorker listener.
+
+        :param result: The DetectionResult of the frame.
+        :return: **operator** - The new stable operator, or None if no operator reached the consensus.
+        """
+
+        # The same results are given again for the frames skipped by the motion gate, they are classified once
+        if result.results is not self._last_results:
+            self._last_results = result.results
+            self._last_operator = classify(hand_backends.results_to_arrays(result.results)[0], self.aspect_ratio)
+        return self.stabilizer.update(self._last_operator, result.score)
@@ -1,35 +1,297 @@
-import cv2
-import mediapipe as mp
+import numpy as np
 
-# Initialize the mediapipe hands class.
-mp_hands = mp.solutions.hands
+import hand_backends
+import metrics
+import tracing
 
-# Set up the Hands functions for images and videos.
-hands_videos = mp_hands.Hands(static_image_mode=False, max_num_hands=2, min_detection_confidence=0.5)
+# Indexes of the landmarks used to count fingers, as in mediapipe's HandLandmark.
+NB_LANDMARKS = hand_backends.NB_LANDMARKS
+WRIST = 0
+THUMB_TIP = 4
+THUMB_MCP = THUMB_TIP - 2
+FINGERS_TIPS_IDS = np.array([8, 12, 16, 20])
+FINGERS_PIPS_IDS = FINGERS_TIPS_IDS - 2
 
+# Names of the fingers, in the order of the statuses computed by count_fingers_array.
+FINGERS_NAMES = ('THUMB', 'INDEX', 'MIDDLE', 'RING', 'PINKY')
+FINGERS_STATUSES_KEYS = {label: tuple(label + "_" + name for name in FINGERS_NAMES) for label in ('RIGHT', 'LEFT')}
 
-def detectHandsLandmarks(image, hands):
+
+def __getattr__(name):
+    # The Hands function for videos used to be created at import, it is now created on first use.
+    if name == 'hands_videos':
+        return hand_backends.get_backend('mediapipe', static_image_mode=False, max_num_hands=2,
+                                         min_detection_confidence=0.5)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def detectHandsLandmarks(image, hands, draw=False):
     """
     This function performs hands landmarks detection on an image.
 
     :param image:   The input image with prominent hand(s) whose landmarks needs to be detected.
     :param hands:   The Hands function required to perform the hands landmarks detection.
+    :param draw:    To get a copy of the input image to draw the landmarks on, instead of the input image itself.
     :returns:
-        - **output_image** - A copy of input image with the detected hands landmarks drawn if it was specified.
+        - **output_image** - A copy of input image to draw the detected hands landmarks on if it was specified,
+          otherwise the input image.
         - **results** - The output of the hands landmarks detection on the input image.
 
     """
 
-    # Create a copy of the input image to draw landmarks on.
-    output_image = image.copy()
+    # Only copy the input image if landmarks are drawn on it.
+    output_image = image.copy() if draw else image
 
     # Perform the Hands Landmarks Detection.
-    results = hands.process(image)
+    with metrics.timer('hands.infer'), tracing.span('hands.infer'):
+        results = hands.process(image)
 
     # Return the output image and results of hands landmarks detection.
     return output_image, results
 
 
+class HandsRoiTracker:
+    """
+    This class reduces the image given to the hands landmarks detection to the region of the hands found on the
+    previous frame.
+
+    While the hands are tracked, the detection runs on the padded bounding box of their landmarks, downscaled if
+    needed, and the landmarks are mapped back to the full frame coordinates. The full frame is analysed again when
+    the confidence drops, when a hand is lost or gets close to the border of the region, and periodically to catch
+    new hands. It can be used wherever a Hands function is expected.
+
+    The Hands function must be in static image mode: in video mode, mediapipe already tracks the hands between frames
+    from the previous landmarks, which the regions of changing geometry would break.
+    """
+
+    def __init__(self, hands, padding=0.3, max_side=192, min_score=0.8, edge_margin=0.02, refresh_interval=30):
+        """
+        :param hands: The Hands function performing the hands landmarks detection, in static image mode.
+        :param padding: Margin added around the bounding box of the hands, as a fraction of its size.
+        :param max_side: Maximum size in pixels of the longest side of the region given to the detection.
+        :param min_score: Minimum handedness score to keep tracking the hands.
+        :param edge_margin: Fraction of the region near its border where a landmark means that the hand is leaving.
+        :param refresh_interval: Maximum number of consecutive frames analysed on the region only.
+        """
+
+        self.hands = hands
+        self.padding = padding
+        self.max_side = max_side
+        self.min_score = min_score
+        self.edge_margin = edge_margin
+        self.refresh_interval = refresh_interval
+
+        # Region of the hands (x0, y0, x1, y1) in pixels and number of hands in it, None when not tracking
+        self.roi = None
+        self._nb_hands = 0
+        self._frames_since_full = 0
+
+        # Number of frames analysed on the full frame or on the region only
+        self.full_frames = 0
+        self.roi_frames = 0
+
+    def process(self, image):
+        """
+        Perform the hands landmarks detection on an image.
+
+        :param image: The input image as a numpy array of shape (height, width, 3).
+        :return: **results** - The output of the hands landmarks detection, in the full frame coordinates.
+        """
+
+        height, width = image.shape[:2]
+
+        if self.roi is not None and self._frames_since_full < self.refresh_interval:
+            x0, y0, x1, y1 = self.roi
+            crop = image[y0:y1, x0:x1]
+
+            # Downscale the region if it is still large
+            scale = self.max_side / max(x1 - x0, y1 - y0)
+            if scale < 1.0:
+                import cv2
+
+                crop = cv2.resize(crop, (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale))),
+                                  interpolation=cv2.INTER_AREA)
+            else:
+                crop = np.ascontiguousarray(crop)
+
+            results = self.hands.process(crop)
+            if self._is_tracked(results):
+                self._to_full_frame(results, x0, y0, x1 - x0, y1 - y0, width, height)
+                self._update_roi(results, width, height)
+                self._frames_since_full += 1
+                self.roi_frames += 1
+                return results
+
+        # Fall back on the full frame
+        results = self.hands.process(image)
+        self._frames_since_full = 0
+        self.full_frames += 1
+
+        if results.multi_hand_landmarks and self._min_score(results) >= self.min_score:
+            self._update_roi(results, width, height)
+        else:
+            self.roi = None
+        return results
+
+    @staticmethod
+    def _min_score(results):
+        return min(hand_info.classification[0].score for hand_info in results.multi_handedness)
+
+    def _is_tracked(self, results):
+        if not results.multi_hand_landmarks or len(results.multi_hand_landmarks) < self._nb_hands:
+            return False
+        if self._min_score(results) < self.min_score:
+            return False
+
+        # A hand touching the border of the region is probably leaving it
+        landmarks = hand_backends.results_to_arrays(results)[0]
+        coordinates = landmarks[..., :2]
+        return bool(np.all((coordinates > self.edge_margin) & (coordinates < 1.0 - self.edge_margin)))
+
+    @staticmethod
+    def _to_full_frame(results, x0, y0, roi_width, roi_height, width, height):
+        for hand_landmarks in results.multi_hand_landmarks:
+            for landmark in hand_landmarks.landmark:
+                landmark.x = (landmark.x * roi_width + x0) / width
+                landmark.y = (landmark.y * roi_height + y0) / height
+                landmark.z = landmark.z * roi_width / width
+
+    def _update_roi(self, results, width, height):
+        landmarks = hand_backends.results_to_arrays(results)[0]
+        x_min, y_min = landmarks[..., :2].reshape(-1, 2).min(axis=0)
+        x_max, y_max = landmarks[..., :2].reshape(-1, 2).max(axis=0)
+
+        # Pad the bounding box, and make it square to keep the hands proportions when downscaled
+        side = max((x_max - x_min) * width, (y_max - y_min) * height) * (1.0 + 2.0 * self.padding)
+        center_x = (x_min + x_max) / 2.0 * width
+        center_y = (y_min + y_max) / 2.0 * height
+
+        x0 = int(max(0, center_x - side / 2.0))
+        y0 = int(max(0, center_y - side / 2.0))
+        x1 = int(min(width, center_x + side / 2.0))
+        y1 = int(min(height, center_y + side / 2.0))
+
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            self.roi = None
+        else:
+            self.roi = (x0, y0, x1, y1)
+            self._nb_hands = len(results.multi_hand_landmarks)
+
+
+class MotionGate:
+    """
+    This class tells whether a frame changed enough since the last analysed one to be worth a new hands landmarks
+    detection, so that the result of the last analysed frame can be reused on static scenes.
+
+    The frames are compared on a grayscale thumbnail taken every step pixels, cut into blocks of block by block
+    samples: the mean absolute difference of the thumbnails, in gray levels, must reach the threshold in at least one
+    block. A finger folded in a corner of the frame changes a few blocks a lot but the whole thumbnail very little, so
+    the blocks are not averaged together. The reference is the last analysed frame, so that a slow drift ends up
+    triggering a detection, and a detection is forced every refresh_interval frames.
+    """
+
+    def __init__(self, step=8, block=4, threshold=8.0, refresh_interval=15):
+        """
+        :param step: Distance in pixels between the samples of the thumbnail.
+        :param block: Side in samples of the blocks of the thumbnail.
+        :param threshold: Minimum mean absolute difference of a block, in gray levels, for a frame to be analysed.
+        :param refresh_interval: Maximum number of consecutive frames skipped.
+        """
+
+        self.step = step
+        self.block = block
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self._reference = None
+        self._frames_since_analysed = 0
+
+        # Number of frames seen and of frames whose detection was skipped
+        self.frames = 0
+        self.skipped = 0
+
+    @property
+    def skip_ratio(self):
+        """
+        Fraction of the frames whose detection was skipped.
+        """
+
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def reset(self):
+        """
+        Forget the reference frame, the next frame is analysed.
+        """
+
+        self._reference = None
+
+    def changed(self, image):
+        """
+        Compare a frame to the last analysed one.
+
+        :param image: The frame as a numpy array of shape (height, width, channels).
+        :return: True if the frame must be analysed, it then becomes the reference.
+        """
+
+        self.frames += 1
+        thumbnail = image[::self.step, ::self.step].mean(axis=-1, dtype=np.float32)
+
+        if (self._reference is not None and self._reference.shape == thumbnail.shape
+                and self._frames_since_analysed < self.refresh_interval
+                and self._max_block_difference(thumbnail) < self.threshold):
+            self._frames_since_analysed += 1
+            self.skipped += 1
+            return False
+
+        self._reference = thumbnail
+        self._frames_since_analysed = 0
+        return True
+
+    def _max_block_difference(self, thumbnail):
+        # The last blocks of a row or a column can be smaller than the other ones
+        difference = np.abs(thumbnail - self._reference)
+        rows = np.arange(0, difference.shape[0], self.block)
+        columns = np.arange(0, difference.shape[1], self.block)
+        sums = np.add.reduceat(np.add.reduceat(difference, rows, axis=0), columns, axis=1)
+        sizes = np.outer(np.diff(np.append(rows, difference.shape[0])),
+                         np.diff(np.append(columns, difference.shape[1])))
+        return (sums / sizes).max()
+
+
+def count_fingers_array(landmarks, is_right):
+    """
+    This function computes the status of each finger of any number of hands at once.
+
+    Extra leading dimensions are allowed, e.g. landmarks of shape (frames, hands, 21, 3) with is_right of shape
+    (frames, hands) to score a recorded session. Missing hands can be filled with NaN, they count no finger up.
+
+    :param landmarks: A float array of shape (..., 21, 3) containing the landmarks of the hands.
+    :param is_right: A boolean array of shape (...), True for the right hands.
+    :returns:
+        - **fingers_statuses** - A boolean array of shape (..., 5), True for the fingers up, in the order of
+          FINGERS_NAMES.
+        - **count** - An int array of shape (...) containing the count of the fingers that are up of each hand.
+
+    """
+
+    landmarks = np.asarray(landmarks)
+    tips_y = landmarks[..., FINGERS_TIPS_IDS, 1]
+    pips_y = landmarks[..., FINGERS_PIPS_IDS, 1]
+
+    # The hand is up if the wrist is lower than the tip, in which case a finger is up if its tip is higher than its
+    # pip, and the other way around if the hand is down.
+    hand_up = landmarks[..., WRIST, np.newaxis, 1] > tips_y
+    fingers_up = np.where(hand_up, tips_y < pips_y, tips_y > pips_y)
+
+    # The thumb is up if its tip is outside its mcp, depending on the hand.
+    thumb_tip_x = landmarks[..., THUMB_TIP, 0]
+    thumb_mcp_x = landmarks[..., THUMB_MCP, 0]
+    thumb_up = np.where(is_right, thumb_tip_x < thumb_mcp_x, thumb_tip_x > thumb_mcp_x)
+
+    fingers_statuses = np.concatenate((thumb_up[..., np.newaxis], fingers_up), axis=-1)
+    return fingers_statuses, fingers_statuses.sum(axis=-1)
+
+
+@tracing.traced('countFingers')
 def countFingers(image, results):
     """
     This function will count the number of fingers up for each hand in the image.
@@ -37,76 +299,31 @@ def countFingers(image, results):
     :param image:   The image of the hands on which the fingers counting is required to be performed.
     :param results: The output of the hands landmarks detection performed on the image of the hands.
     :returns:
-        - **output_image** - A copy of the input image with the fingers count written, if it was specified.
+        - **output_image** - The input image, nothing is drawn on it.
         - **fingers_statuses** - A dictionary containing the status (i.e., open or close) of each finger of both hands.
         - **count** - A dictionary containing the count of the fingers that are up, of both hands.
 
     """
 
-    # Get the height and width of the input image.
-    height, width, _ = image.shape
-
-    # Create a copy of the input image to write the count of fingers on.
-    output_image = image.copy()
-
     # Initialize a dictionary to store the count of fingers of both hands.
     count = {'RIGHT': 0, 'LEFT': 0}
 
-    # Store the indexes of the tips landmarks of each finger of a hand in a list.
-    fingers_tips_ids = [mp_hands.HandLandmark.INDEX_FINGER_TIP, mp_hands.HandLandmark.MIDDLE_FINGER_TIP,
-                        mp_hands.HandLandmark.RING_FINGER_TIP, mp_hands.HandLandmark.PINKY_TIP]
-
     # Initialize a dictionary to store the status (i.e., True for open and False for close) of each finger of both hands.
-    fingers_statuses = {'RIGHT_THUMB': False, 'RIGHT_INDEX': False, 'RIGHT_MIDDLE': False, 'RIGHT_RING': False,
-                        'RIGHT_PINKY': False, 'LEFT_THUMB': False, 'LEFT_INDEX': False, 'LEFT_MIDDLE': False,
-                        'LEFT_RING': False, 'LEFT_PINKY': False}
-
-    # Iterate over the found hands in the image.
-    for hand_index, hand_info in enumerate(results.multi_handedness):
+    fingers_statuses = dict.fromkeys(FINGERS_STATUSES_KEYS['RIGHT'] + FINGERS_STATUSES_KEYS['LEFT'], False)
 
-        # Retrieve the label of the found hand.
-        hand_label = hand_info.classification[0].label
+    # Compute the fingers of all the found hands at once.
+    with metrics.timer('hands.count'):
+        landmarks, is_right, _ = hand_backends.results_to_arrays(results)
+        hands_statuses, hands_count = count_fingers_array(landmarks, is_right)
 
-        # Retrieve the landmarks of the found hand.
-        hand_landmarks = results.multi_hand_landmarks[hand_index]
+    for hand_right, hand_statuses, hand_count in zip(is_right, hands_statuses, hands_count):
+        hand_label = 'RIGHT' if hand_right else 'LEFT'
 
-        # Iterate over the indexes of the tips landmarks of each finger of the hand.
-        for tip_index in fingers_tips_ids:
+        for key, status in zip(FINGERS_STATUSES_KEYS[hand_label], hand_statuses):
+            if status:
+                fingers_statuses[key] = True
 
-            # Retrieve the label (i.e., index, middle, etc.) of the finger on which we are iterating upon.
-            finger_name = tip_index.name.split("_")[0]
+        count[hand_label] += int(hand_count)
 
-            if (hand_landmarks.landmark[0].y > hand_landmarks.landmark[tip_index].y):
-                # Hand up
-                # Check if the finger is up by comparing the y-coordinates of the tip and pip landmarks.
-                if (hand_landmarks.landmark[tip_index].y < hand_landmarks.landmark[tip_index - 2].y):
-                    # Update the status of the finger in the dictionary to true.
-                    fingers_statuses[hand_label.upper() + "_" + finger_name] = True
-
-                    # Increment the count of the fingers up of the hand by 1.
-                    count[hand_label.upper()] += 1
-            else:
-                # Hand down
-                # Check if the finger is up by comparing the y-coordinates of the tip and pip landmarks.
-                if (hand_landmarks.landmark[tip_index].y > hand_landmarks.landmark[tip_index - 2].y):
-                    # Update the status of the finger in the dictionary to true.
-                    fingers_statuses[hand_label.upper() + "_" + finger_name] = True
-
-                    # Increment the count of the fingers up of the hand by 1.
-                    count[hand_label.upper()] += 1
-
-        # Retrieve the x-coordinates of the tip and mcp landmarks of the thumb of the hand.
-        thumb_tip_x = hand_landmarks.landmark[mp_hands.HandLandmark.THUMB_TIP].x
-        thumb_mcp_x = hand_landmarks.landmark[mp_hands.HandLandmark.THUMB_TIP - 2].x
-
-        # Check if the thumb is up by comparing the hand label and the x-coordinates of the retrieved landmarks.
-        if (hand_label == 'Right' and (thumb_tip_x < thumb_mcp_x)) or (
-                hand_label == 'Left' and (thumb_tip_x > thumb_mcp_x)):
-            # Update the status of the thumb in the dictionary to true.
-            fingers_statuses[hand_label.upper() + "_THUMB"] = True
-
-            # Increment the count of the fingers up of the hand by 1.
-            count[hand_label.upper()] += 1
-
-    # Return the output image, the status of each finger and the count of the fingers up of both hands.
-    return output_image, fingers_statuses, count
\ No newline at end of file
+    # Return the image, the status of each finger and the count of the fingers up of both hands.
+    return image, fingers_statuses, count
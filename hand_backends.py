@@ -0,0 +1,379 @@
+"""
+Registry of the backends performing the hands landmarks detection.
+
+A backend is any object with a ``process(image)`` method returning results laid out as mediapipe's ones
+(``multi_hand_landmarks`` and ``multi_handedness``). Backends are only created on first use, so that importing the
+project does not load mediapipe and its models.
+"""
+
+import multiprocessing
+import threading
+
+import numpy as np
+
+NB_LANDMARKS = 21
+
+_factories = {}
+_instances = {}
+
+
+def register_backend(name, factory):
+    """
+    Register a backend factory under a name.
+
+    :param name: Name of the backend.
+    :param factory: Callable creating the backend from keyword parameters.
+    """
+
+    _factories[name] = factory
+
+
+def create_backend(name='mediapipe', **params):
+    """
+    Create a new backend.
+
+    :param name: Name of a registered backend.
+    :param params: Parameters of the backend.
+    :return: **backend** - The new backend.
+    """
+
+    try:
+        factory = _factories[name]
+    except KeyError:
+        raise ValueError("Unknown hands backend %r, available backends: %s" % (name, ", ".join(sorted(_factories))))
+    return factory(**params)
+
+
+def get_backend(name='mediapipe', **params):
+    """
+    Get the backend shared by all the callers using the same name and parameters, it is created on the first call.
+
+    :param name: Name of a registered backend.
+    :param params: Parameters of the backend, they must be hashable.
+    :return: **backend** - The shared backend.
+    """
+
+    key = (name, tuple(sorted(params.items())))
+    if key not in _instances:
+        _instances[key] = create_backend(name, **params)
+    return _instances[key]
+
+
+class Landmark:
+    """
+    A landmark in the normalized coordinates of the image.
+    """
+
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x, y, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+class HandLandmarks:
+    """
+    The 21 landmarks of a hand.
+    """
+
+    __slots__ = ('landmark',)
+
+    def __init__(self, landmark):
+        self.landmark = landmark
+
+
+class Classification:
+    """
+    The label ('Right' or 'Left') of a hand and its score.
+    """
+
+    __slots__ = ('label', 'score')
+
+    def __init__(self, label, score=1.0):
+        self.label = label
+        self.score = score
+
+
+class Handedness:
+    """
+    The classifications of a hand, the first one is the most likely.
+    """
+
+    __slots__ = ('classification',)
+
+    def __init__(self, classification):
+        self.classification = classification
+
+
+class HandsResults:
+    """
+    Results of a hands landmarks detection, as returned by mediapipe: both lists are None when no hand is detected.
+    """
+
+    __slots__ = ('multi_hand_landmarks', 'multi_handedness')
+
+    def __init__(self, multi_hand_landmarks=None, multi_handedness=None):
+        self.multi_hand_landmarks = multi_hand_landmarks or None
+        self.multi_handedness = multi_handedness or None
+
+
+def results_from_arrays(landmarks, is_right, scores=None):
+    """
+    Build detection results from landmark arrays, hands with NaN landmarks are left out.
+
+    :param landmarks: A float array of shape (hands, 21, 3).
+    :param is_right: A boolean array of shape (hands,), True for the right hands.
+    :param scores: The handedness scores of shape (hands,), 1 if None.
+    :return: **results** - The HandsResults of the hands.
+    """
+
+    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, NB_LANDMARKS, 3)
+    if scores is None:
+        scores = np.ones(len(landmarks))
+
+    multi_hand_landmarks = []
+    multi_handedness = []
+    for hand_landmarks, hand_right, score in zip(landmarks, is_right, scores):
+        if np.isnan(hand_landmarks).any():
+            continue
+        multi_hand_landmarks.append(HandLandmarks([Landmark(float(x), float(y), float(z))
+                                                   for x, y, z in hand_landmarks]))
+        multi_handedness.append(Handedness([Classification('Right' if hand_right else 'Left', float(score))]))
+
+    return HandsResults(multi_hand_landmarks, multi_handedness)
+
+
+def results_to_arrays(results):
+    """
+    Convert detection results into arrays that are cheap to send to another process.
+
+    :param results: The output of a backend.
+    :returns:
+        - **landmarks** - A float32 array of shape (hands, 21, 3).
+        - **is_right** - A boolean array of shape (hands,), True for the right hands.
+        - **scores** - A float32 array of shape (hands,) containing the handedness scores.
+
+    """
+
+    if not results.multi_hand_landmarks:
+        return np.zeros((0, NB_LANDMARKS, 3), dtype=np.float32), np.zeros(0, dtype=bool), np.zeros(0, dtype=np.float32)
+
+    landmarks = np.array([[(landmark.x, landmark.y, landmark.z) for landmark in hand_landmarks.landmark]
+                          for hand_landmarks in results.multi_hand_landmarks], dtype=np.float32)
+    is_right = np.array([hand_info.classification[0].label == 'Right' for hand_info in results.multi_handedness])
+    scores = np.array([hand_info.classification[0].score for hand_info in results.multi_handedness],
+                      dtype=np.float32)
+    return landmarks.reshape(-1, NB_LANDMARKS, 3), is_right, scores
+
+
+def synthetic_hand(fingers_up, is_right=True):
+    """
+    Build the landmarks of an upright hand with the given fingers up.
+
+    :param fingers_up: Five booleans for the thumb, index, middle, ring and pinky fingers.
+    :param is_right: To build a right hand, otherwise a left one.
+    :return: **landmarks** - A float32 array of shape (21, 3).
+    """
+
+    landmarks = np.zeros((NB_LANDMARKS, 3), dtype=np.float32)
+    landmarks[:, 0] = 0.5
+    landmarks[:, 1] = 0.6
+
+    # The wrist is at the bottom of the hand
+    landmarks[0, 1] = 0.9
+
+    # Fingers: the tip is above its pip when the finger is up, below otherwise
+    for finger, tip in enumerate((8, 12, 16, 20), start=1):
+        landmarks[tip - 2, 1] = 0.5
+        landmarks[tip, 1] = 0.2 if fingers_up[finger] else 0.7
+
+    # Thumb: the tip is outside its mcp when the thumb is up
+    outside = -0.1 if is_right else 0.1
+    landmarks[4, 0] = 0.5 + (outside if fingers_up[0] else -outside)
+    return landmarks
+
+
+class MediaPipeBackend:
+    """
+    The mediapipe Hands solution, mediapipe is imported when the first backend is created.
+    """
+
+    def __init__(self, static_image_mode=False, max_num_hands=2, min_detection_confidence=0.5,
+                 min_tracking_confidence=0.5):
+        """
+        :param static_image_mode: To detect the hands on every image instead of tracking them.
+        :param max_num_hands: Maximum number of hands to detect.
+        :param min_detection_confidence: Minimum confidence of the hands detection.
+        :param min_tracking_confidence: Minimum confidence of the hands tracking.
+        """
+
+        import mediapipe as mp
+
+        self.hands = mp.solutions.hands.Hands(static_image_mode=static_image_mode, max_num_hands=max_num_hands,
+                                              min_detection_confidence=min_detection_confidence,
+                                              min_tracking_confidence=min_tracking_confidence)
+
+    def process(self, image):
+        return self.hands.process(image)
+
+    def close(self):
+        self.hands.close()
+
+
+class ReplayBackend:
+    """
+    Replay landmarks recorded in a .npz file, one frame per call to process.
+
+    The file holds ``landmarks`` of shape (frames, hands, 21, 3), NaN for the missing hands, ``is_right`` of shape
+    (frames, hands) and optionally ``scores`` of shape (frames, hands).
+    """
+
+    def __init__(self, path, loop=True):
+        """
+        :param path: Path of the recorded landmarks.
+        :param loop: To start again from the first frame after the last one, otherwise no hand is detected anymore.
+        """
+
+        with np.load(path) as recording:
+            self.landmarks = recording['landmarks']
+            self.is_right = recording['is_right']
+            self.scores = recording['scores'] if 'scores' in recording else np.ones(self.is_right.shape)
+        self.loop = loop
+        self.index = 0
+
+    def process(self, image):
+        if self.index >= len(self.landmarks):
+            if not self.loop or not len(self.landmarks):
+                return HandsResults()
+            self.index = 0
+
+        index = self.index
+        self.index += 1
+        return results_from_arrays(self.landmarks[index], self.is_right[index], self.scores[index])
+
+
+class SyntheticBackend:
+    """
+    Generate hands showing a sequence of counts, e.g. for tests: the right hand shows up to five fingers, the left hand
+    the rest.
+    """
+
+    def __init__(self, counts=(None,), loop=True, score=1.0):
+        """
+        :param counts: Sequence of counts, one per call to process, None for no hand.
+        :param loop: To start again from the first count after the last one, otherwise the last count is kept.
+        :param score: Handedness score of the generated hands.
+        """
+
+        self.counts = list(counts)
+        self.loop = loop
+        self.score = score
+        self.index = 0
+
+    def process(self, image):
+        if self.index >= len(self.counts):
+            self.index = 0 if self.loop else len(self.counts) - 1
+
+        count = self.counts[self.index]
+        self.index += 1
+        if count is None:
+            return HandsResults()
+
+        hands = [synthetic_hand([finger < min(count, 5) for finger in range(5)], is_right=True)]
+        is_right = [True]
+        if count > 5:
+            hands.append(synthetic_hand([finger < count - 5 for finger in range(5)], is_right=False))
+            is_right.append(False)
+        return results_from_arrays(np.stack(hands), is_right, [self.score] * len(hands))
+
+
+def _process_backend_main(connection, backend, params):
+    """
+    Loop of the child process of a ProcessBackend: it analyses the images it receives until it receives None.
+    """
+
+    try:
+        hands = create_backend(backend, **params)
+    except Exception as e:
+        connection.send(('error', "Cannot create the %s backend: %r" % (backend, e)))
+        return
+    connection.send(('ready', None))
+
+    while True:
+        image = connection.recv()
+        if image is None:
+            break
+        try:
+            connection.send(('results', results_to_arrays(hands.process(image))))
+        except Exception as e:
+            connection.send(('error', repr(e)))
+
+    if hasattr(hands, 'close'):
+        hands.close()
+
+
+class ProcessBackend:
+    """
+    Run another backend in a child process, so that the inference of each robot runs on its own core and out of the
+    GIL of the web server and the robot behaviors.
+
+    The images are sent to the child process and the results come back as arrays, rebuilt into HandsResults.
+    """
+
+    def __init__(self, backend='mediapipe', start_method='spawn', startup_timeout=60.0, **params):
+        """
+        :param backend: Name of the backend run by the child process.
+        :param start_method: The multiprocessing start method, spawn does not inherit the threads of the parent.
+        :param startup_timeout: Maximum time in seconds to wait for the child backend to be created.
+        :param params: Parameters of the child backend.
+        """
+
+        context = multiprocessing.get_context(start_method)
+        self._connection, child_connection = context.Pipe()
+        self._lock = threading.Lock()
+        self.child = context.Process(target=_process_backend_main, args=(child_connection, backend, params),
+                                       daemon=True)
+        self.child.start()
+        child_connection.close()
+
+        try:
+            if not self._connection.poll(startup_timeout):
+                raise EOFError
+            status, message = self._connection.recv()
+        except EOFError:
+            status, message = 'error', "The %s backend process did not start" % backend
+        if status == 'error':
+            self.close()
+            raise RuntimeError(message)
+
+    def process(self, image):
+        # A single image at a time goes through the pipe
+        with self._lock:
+            self._connection.send(np.ascontiguousarray(image))
+            status, message = self._connection.recv()
+        if status == 'error':
+            raise RuntimeError("Hands backend process: %s" % message)
+        return results_from_arrays(*message)
+
+    def close(self):
+        """
+        Stop the child process.
+        """
+
+        with self._lock:
+            if self.child.is_alive():
+                try:
+                    self._connection.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+                self.child.join(timeout=5.0)
+            if self.child.is_alive():
+                self.child.terminate()
+            self._connection.close()
+
+
+register_backend('mediapipe', MediaPipeBackend)
+register_backend('replay', ReplayBackend)
+register_backend('synthetic', SyntheticBackend)
+register_backend('process', ProcessBackend)
@@ -0,0 +1,80 @@
+"""
+In-memory cache of encoded images, addressed by their content.
+"""
+
+import collections
+import hashlib
+import threading
+
+
+class EncodedImageCache:
+    """
+    This class keeps the most recently used encoded images in memory.
+
+    Images are stored under a key (e.g. a cube and a color) and can be fetched back by the digest of their bytes,
+    which makes their URL change only when their content does.
+    """
+
+    def __init__(self, maxsize=64):
+        """
+        :param maxsize: Maximum number of images kept in memory.
+        """
+
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._data = {}
+        self._references = collections.Counter()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_create(self, key, producer):
+        """
+        Get the image stored under a key, create it on a miss.
+
+        :param key: Hashable key of the image.
+        :param producer: Callable with no argument returning the encoded bytes of the image.
+        :return: **digest** - The digest of the image, to fetch it with :meth:`get`.
+        """
+
+        with self._lock:
+            digest = self._entries.get(key)
+            if digest is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return digest
+            self.misses += 1
+
+        # Encode outside the lock, a concurrent miss on the same key only wastes an encoding
+        data = producer()
+        digest = hashlib.sha1(data).hexdigest()
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = digest
+                self._data[digest] = data
+                self._references[digest] += 1
+                while len(self._entries) > self.maxsize:
+                    self._release(self._entries.popitem(last=False)[1])
+        return digest
+
+    def get(self, digest):
+        """
+        Get an image by its digest.
+
+        :param digest: Digest returned by :meth:`get_or_create`.
+        :return: **data** - The encoded bytes of the image, or None if it is not in the cache anymore.
+        """
+
+        with self._lock:
+            return self._data.get(digest)
+
+    def _release(self, digest):
+        self._references[digest] -= 1
+        if self._references[digest] <= 0:
+            del self._references[digest]
+            del self._data[digest]
@@ -0,0 +1,288 @@
+"""
+Hands landmarks detection in a pool of worker processes.
+
+Each worker process keeps its own backend (e.g. a mediapipe Hands instance) for its whole life, so that the
+inference runs on every core and out of the GIL of the web server, the video encoding and the robot behaviors.
+The frames are written into shared memory slots instead of being pickled, only their slot, shape and type go
+through the tasks queue, and only the landmark arrays come back. Each frame gets a sequence number and the results
+are handed back in the order of the frames whatever the worker that analysed them.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import hand_backends
+import metrics
+import tracing
+
+# Size in bytes of a shared memory slot, enough for a 640x480 RGB frame
+SLOT_BYTES = 640 * 480 * 3
+
+# Sequence number of the message telling that a worker is ready
+_READY = -1
+
+
+def _worker_main(slot_names, tasks, results, backend, params):
+    """
+    Loop of a worker process: it analyses the frames of the tasks queue until it receives None.
+    """
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        hands = hand_backends.create_backend(backend, **params)
+    except Exception as e:
+        results.put((_READY, None, None, None, "Cannot create the %s backend: %r" % (backend, e)))
+        return
+    results.put((_READY, None, None, None, None))
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            sequence, slot, shape, dtype = task
+            image = np.ndarray(shape, dtype=dtype, buffer=slots[slot].buf)
+            start = time.monotonic()
+            try:
+                arrays = hand_backends.results_to_arrays(hands.process(image))
+                error = None
+            except Exception as e:
+                arrays, error = None, repr(e)
+            del image
+            # The monotonic clock is shared by the processes, the start is used to trace the inference
+            results.put((sequence, slot, arrays, (os.getpid(), start, time.monotonic() - start), error))
+    finally:
+        if hasattr(hands, 'close'):
+            hands.close()
+        for memory in slots:
+            memory.close()
+
+
+class InferencePool:
+    """
+    This class runs a backend in a pool of worker processes, it can be used as a backend itself.
+
+    Frames are either submitted and their results read in order with get, to keep every worker busy, or analysed one
+    at a time with process. With several workers, the frames of a stream are spread over different backends, so the
+    tracking of mediapipe (static_image_mode=False) only sees part of them.
+    """
+
+    def __init__(self, size=None, backend='mediapipe', slots=None, slot_bytes=SLOT_BYTES, start_method='spawn',
+                 startup_timeout=60.0, **params):
+        """
+        :param size: Number of worker processes, the number of cores if None.
+        :param backend: Name of the backend created in each worker.
+        :param slots: Number of frames that can be in flight at once, twice the number of workers if None.
+        :param slot_bytes: Maximum size in bytes of a frame.
+        :param start_method: The multiprocessing start method, spawn does not inherit the threads of the parent.
+        :param startup_timeout: Maximum time in seconds to wait for the workers to create their backend.
+        :param params: Parameters of the backend.
+        """
+
+        self.size = size or os.cpu_count() or 1
+        self.slot_bytes = slot_bytes
+        nb_slots = slots or 2 * self.size
+
+        self._memories = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(nb_slots)]
+        self._free_slots = queue.Queue()
+        for slot in range(nb_slots):
+            self._free_slots.put(slot)
+
+        context = multiprocessing.get_context(start_method)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self.workers = [context.Process(target=_worker_main, daemon=True,
+                                        args=([memory.name for memory in self._memories], self._tasks, self._results,
+                                              backend, params))
+                        for _ in range(self.size)]
+        for worker in self.workers:
+            worker.start()
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._next_sequence = 0
+        self._next_result = 0
+        # Reorder buffer: results received before the ones of earlier frames, by sequence number
+        self._done = {}
+        self._taken = set()
+        self._closed = False
+
+        # Number of frames analysed and of frames that waited for a free slot
+        self.frames_processed = 0
+        self.slot_waits = 0
+
+        try:
+            for _ in range(self.size):
+                sequence, _, _, _, error = self._results.get(timeout=startup_timeout)
+                if error is not None:
+                    raise RuntimeError(error)
+        except queue.Empty:
+            self.close()
+            raise RuntimeError("The %s backend workers did not start" % backend)
+        except RuntimeError:
+            self.close()
+            raise
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    @property
+    def pending(self):
+        """
+        Number of frames submitted whose results were not read yet.
+        """
+
+        with self._lock:
+            return self._next_sequence - self._next_result - len(self._taken)
+
+    def submit(self, image, timeout=None):
+        """
+        Submit a frame to the workers, it waits for a free slot when too many frames are in flight.
+
+        :param image: Numpy array of the frame.
+        :param timeout: Maximum waiting time in seconds for a free slot.
+        :return: **sequence** - The sequence number of the frame.
+        """
+
+        image = np.asarray(image)
+        if image.nbytes > self.slot_bytes:
+            raise ValueError("Frame of %d bytes, the slots hold %d bytes" % (image.nbytes, self.slot_bytes))
+
+        if self._closed:
+            raise RuntimeError("The inference pool is closed")
+        try:
+            slot = self._free_slots.get_nowait()
+        except queue.Empty:
+            self.slot_waits += 1
+            try:
+                slot = self._free_slots.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError("No free slot within %s seconds" % timeout)
+
+        with self._condition:
+            # close puts None to wake up the submits waiting for a slot, it is left for the next one
+            if slot is None or self._closed:
+                self._free_slots.put(slot)
+                raise RuntimeError("The inference pool is closed")
+
+            # The copy is done with the lock held, so that close cannot release the shared memory meanwhile
+            np.ndarray(image.shape, dtype=image.dtype, buffer=self._memories[slot].buf)[...] = image
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            try:
+                self._tasks.put((sequence, slot, image.shape, image.dtype.str))
+            except Exception as e:
+                # The frame will never be analysed: get and result give its error rather than waiting for it
+                self._free_slots.put(slot)
+                self._done[sequence] = (None, "Frame %d not submitted: %r" % (sequence, e))
+                self._condition.notify_all()
+                raise
+        return sequence
+
+    def get(self, timeout=None):
+        """
+        Wait for the result of the next frame, in the order of submission.
+
+        :param timeout: Maximum waiting time in seconds.
+        :return: **result** - A tuple (sequence number, HandsResults), or None on timeout.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                # The frames analysed with process are not returned here
+                while self._next_result in self._taken:
+                    self._taken.remove(self._next_result)
+                    self._next_result += 1
+                if self._next_result in self._done:
+                    sequence = self._next_result
+                    self._next_result += 1
+                    return sequence, self._unpack(self._done.pop(sequence))
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def result(self, sequence, timeout=None):
+        """
+        Wait for the result of a given frame, which is then skipped by get.
+
+        :param sequence: The sequence number returned by submit.
+        :param timeout: Maximum waiting time in seconds.
+        :return: **results** - The HandsResults of the frame.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while sequence not in self._done:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No result for frame %d within %s seconds" % (sequence, timeout))
+                self._condition.wait(remaining)
+            if sequence >= self._next_result:
+                self._taken.add(sequence)
+            return self._unpack(self._done.pop(sequence))
+
+    def process(self, image):
+        """
+        Analyse a frame and wait for its result, as a backend does.
+
+        :param image: Numpy array of the frame.
+        :return: **results** - The HandsResults of the frame.
+        """
+
+        return self.result(self.submit(image))
+
+    @staticmethod
+    def _unpack(done):
+        arrays, error = done
+        if error is not None:
+            raise RuntimeError("Hands backend worker: %s" % error)
+        return hand_backends.results_from_arrays(*arrays)
+
+    def _collect(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                return
+            sequence, slot, arrays, timing, error = message
+            pid, start, duration = timing
+
+            # The worker does not read the slot anymore
+            self._free_slots.put(slot)
+            metrics.observe('pool.infer', duration)
+            tracing.add_span('pool.infer', start, duration, {'sequence': sequence}, pid=pid, tid=pid)
+            with self._condition:
+                self._done[sequence] = (arrays, error)
+                self.frames_processed += 1
+                self._condition.notify_all()
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory.
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._free_slots.put(None)
+
+        for _ in self.workers:
+            self._tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+        self._results.put(None)
+
+        for memory in self._memories:
+            memory.close()
+            memory.unlink()
@@ -0,0 +1,224 @@
+"""
+Declarative animations of the cubes' lights.
+
+A LightPattern is a sequence of keyframes, each one giving the lights of the four corners of a cube and how long they
+stay on. A LightAnimator plays patterns on any number of cubes at once from a single timer thread, which keeps the
+next keyframe of every animation in a heap: playing a pattern returns immediately and can be cancelled.
+"""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+import cozmo
+
+# Lights of the four corners of a cube and their duration in seconds
+Keyframe = collections.namedtuple('Keyframe', ['lights', 'duration'])
+
+
+class LightPattern:
+    """
+    This class describes a light animation as keyframes, played repeat times, and the lights left at the end.
+    """
+
+    def __init__(self, keyframes, repeat=1, final=None):
+        """
+        :param keyframes: Sequence of Keyframe.
+        :param repeat: Number of times the keyframes are played, forever if None.
+        :param final: Lights of the four corners at the end or on cancellation, unchanged if None.
+        """
+
+        self.keyframes = tuple(keyframes)
+        self.repeat = repeat
+        self.final = final
+
+    def frames(self):
+        """
+        :return: An iterator over the keyframes to play.
+        """
+
+        if self.repeat is None:
+            return itertools.cycle(self.keyframes)
+        return itertools.chain.from_iterable(itertools.repeat(self.keyframes, self.repeat))
+
+    @property
+    def duration(self):
+        """
+        Duration of the pattern in seconds, None if it plays forever.
+        """
+
+        if self.repeat is None:
+            return None
+        return self.repeat * sum(keyframe.duration for keyframe in self.keyframes)
+
+
+def blink_pattern(color, period=0.3, times=4):
+    """
+    Build the pattern of a cube blinking its opposite corners in turn.
+
+    :param color: The Light of the cube.
+    :param period: Time in seconds of each half of a blink.
+    :param times: Number of blinks.
+    :return: **pattern** - The LightPattern, the cube is left with all its corners in color.
+    """
+
+    off = cozmo.lights.off_light
+    return LightPattern([Keyframe((color, off, color, off), period), Keyframe((off, color, off, color), period)],
+                        repeat=times, final=(color,) * 4)
+
+
+def set_corners(cube, lights):
+    """
+    Default way of showing a keyframe: set the corners' lights of the cube directly.
+    """
+
+    cube.set_light_corners(*lights)
+
+
+class Animation:
+    """
+    A pattern being played on a cube by a LightAnimator.
+    """
+
+    def __init__(self, animator, cube, pattern, send):
+        self.animator = animator
+        self.cube = cube
+        self.pattern = pattern
+        self.send = send
+        self.cancelled = False
+        self._frames = pattern.frames()
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        """
+        True once the animation has ended or has been cancelled.
+        """
+
+        return self._done.is_set()
+
+    def cancel(self, restore=True):
+        """
+        Stop the animation.
+
+        :param restore: To show the final lights of the pattern.
+        """
+
+        self.animator.cancel(self, restore)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the end of the animation.
+
+        :param timeout: Maximum waiting time in seconds.
+        :return: True if the animation has ended.
+        """
+
+        return self._done.wait(timeout)
+
+
+class LightAnimator:
+    """
+    This class plays light patterns on cubes from a single timer thread, started on the first animation.
+
+    Playing a pattern on a cube cancels the animation the cube was playing.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._heap = []
+        self._counter = itertools.count()
+        self._animations = {}
+        self._thread = None
+
+    def play(self, cube, pattern, send=set_corners):
+        """
+        Start playing a pattern on a cube, it returns immediately.
+
+        :param cube: The LightCube.
+        :param pattern: The LightPattern to play.
+        :param send: Callable showing lights on the cube as send(cube, lights), e.g. through a CommandScheduler.
+        :return: **animation** - The Animation, to wait for its end or cancel it.
+        """
+
+        animation = Animation(self, cube, pattern, send)
+        with self._condition:
+            previous = self._animations.get(id(cube))
+            if previous is not None:
+                self._finish(previous, restore=False)
+            self._animations[id(cube)] = animation
+            heapq.heappush(self._heap, (time.monotonic(), next(self._counter), animation))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return animation
+
+    def cancel(self, animation, restore=True):
+        """
+        Stop an animation, its entry in the heap is skipped when it is due.
+
+        :param animation: The Animation to stop.
+        :param restore: To show the final lights of the pattern.
+        """
+
+        with self._condition:
+            if not animation.done:
+                self._finish(animation, restore)
+
+    def cancel_all(self, restore=True):
+        """
+        Stop all the animations.
+
+        :param restore: To show the final lights of the patterns.
+        """
+
+        with self._condition:
+            for animation in list(self._animations.values()):
+                self._finish(animation, restore)
+
+    @property
+    def running(self):
+        """
+        Number of animations being played.
+        """
+
+        return len(self._animations)
+
+    def _finish(self, animation, restore=True, cancelled=True):
+        # Called with the condition held, so that no keyframe is shown after the final lights
+        animation.cancelled = cancelled
+        if restore and animation.pattern.final is not None:
+            animation.send(animation.cube, animation.pattern.final)
+        if self._animations.get(id(animation.cube)) is animation:
+            del self._animations[id(animation.cube)]
+        animation._done.set()
+
+    def _run(self):
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                due, _, animation = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._condition.wait(due - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                if animation.done:
+                    continue
+
+                keyframe = next(animation._frames, None)
+                if keyframe is None:
+                    self._finish(animation, cancelled=False)
+                    continue
+
+                animation.send(animation.cube, keyframe.lights)
+                # Keep the pace of the pattern even if the thread woke up late
+                heapq.heappush(self._heap, (max(due + keyframe.duration, now), next(self._counter), animation))
@@ -0,0 +1,245 @@
+"""
+Lightweight latency instrumentation of the hot paths.
+
+Stages are timed into fixed-bucket histograms, which give percentiles and rates and are exposed in the Prometheus text
+format. When the registry is disabled, timers are a shared no-op object, so that instrumented code costs about one
+attribute lookup and one function call.
+"""
+
+import bisect
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the histogram buckets, from 0.1 ms to 10 s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+# Time window in seconds over which the rates are computed
+RATE_WINDOW = 5.0
+
+
+class Histogram:
+    """
+    This class accumulates durations into fixed buckets.
+    """
+
+    def __init__(self, name, buckets=BUCKETS):
+        """
+        :param name: Name of the measured stage.
+        :param buckets: Sorted upper bounds of the buckets, in seconds.
+        """
+
+        self.name = name
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+        self._recent = []
+
+    def observe(self, duration):
+        """
+        Add a duration.
+
+        :param duration: Duration in seconds.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, duration)] += 1
+            self.count += 1
+            self.sum += duration
+            self._recent.append(now)
+            if self._recent[0] < now - RATE_WINDOW:
+                del self._recent[:bisect.bisect_left(self._recent, now - RATE_WINDOW)]
+
+    def percentile(self, q):
+        """
+        Estimate a percentile by linear interpolation in its bucket.
+
+        :param q: The percentile, from 0 to 100.
+        :return: **duration** - The estimated duration in seconds, 0 if nothing was observed.
+        """
+
+        counts, total, _ = self.snapshot()
+        return self._percentile(counts, total, q)
+
+    def _percentile(self, counts, total, q):
+        if not total:
+            return 0.0
+        rank = q / 100.0 * total
+        cumulated = 0
+        for index, count in enumerate(counts):
+            if count and cumulated + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulated) / count
+            cumulated += count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        """
+        Copy the state of the histogram, so that it can be formatted while durations are being added.
+
+        :return: **snapshot** - A tuple (counts of the buckets, count, sum).
+        """
+
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    def rate(self):
+        """
+        :return: **rate** - The number of observations per second over the last RATE_WINDOW seconds.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for moment in self._recent if moment >= now - RATE_WINDOW) / RATE_WINDOW
+
+
+class _Timer:
+    """
+    Context manager timing a block into a histogram.
+    """
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    """
+    Context manager doing nothing, used when the registry is disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """
+    This class holds the histograms of the instrumented stages.
+    """
+
+    def __init__(self, enabled=False):
+        """
+        :param enabled: To record the timings, otherwise the timers do nothing.
+        """
+
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        """
+        Get the histogram of a stage, created on first use.
+
+        :param name: Name of the stage.
+        :return: **histogram** - The Histogram of the stage.
+        """
+
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram(name))
+        return histogram
+
+    def timer(self, name):
+        """
+        Time a block of code, e.g. ``with metrics.timer('infer'): ...``.
+
+        :param name: Name of the stage.
+        :return: A context manager.
+        """
+
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.histogram(name))
+
+    def observe(self, name, duration):
+        """
+        Add a duration measured by the caller.
+
+        :param name: Name of the stage.
+        :param duration: Duration in seconds.
+        """
+
+        if self.enabled:
+            self.histogram(name).observe(duration)
+
+    def summary(self):
+        """
+        :return: **summary** - A dictionary giving for each stage its count, mean, p50, p95 and p99 in milliseconds and
+            its rate per second.
+        """
+
+        summary = {}
+        for name, histogram in self._sorted_histograms():
+            counts, count, total = histogram.snapshot()
+            summary[name] = {
+                'count': count,
+                'mean_ms': 1000.0 * total / count if count else 0.0,
+                'p50_ms': 1000.0 * histogram._percentile(counts, count, 50),
+                'p95_ms': 1000.0 * histogram._percentile(counts, count, 95),
+                'p99_ms': 1000.0 * histogram._percentile(counts, count, 99),
+                'rate': histogram.rate(),
+            }
+        return summary
+
+    def prometheus(self):
+        """
+        :return: **text** - The histograms in the Prometheus text exposition format.
+        """
+
+        lines = ["# HELP cozmo_stage_seconds Duration of the instrumented stages.",
+                 "# TYPE cozmo_stage_seconds histogram"]
+        for name, histogram in self._sorted_histograms():
+            # The buckets, the count and the sum of a stage are taken at once, so that they agree with each other
+            counts, count, total = histogram.snapshot()
+            cumulated = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulated += bucket_count
+                lines.append('cozmo_stage_seconds_bucket{stage="%s",le="%g"} %d' % (name, bound, cumulated))
+            lines.append('cozmo_stage_seconds_bucket{stage="%s",le="+Inf"} %d' % (name, count))
+            lines.append('cozmo_stage_seconds_sum{stage="%s"} %f' % (name, total))
+            lines.append('cozmo_stage_seconds_count{stage="%s"} %d' % (name, count))
+        return "\n".join(lines) + "\n"
+
+    def _sorted_histograms(self):
+        # A histogram can be created by another thread while they are formatted
+        with self._lock:
+            return sorted(self._histograms.items())
+
+
+# Registry shared by the whole program, enabled with the COZMO_METRICS environment variable or set_enabled
+registry = MetricsRegistry(enabled=os.environ.get('COZMO_METRICS', '') not in ('', '0'))
+timer = registry.timer
+observe = registry.observe
+
+
+def set_enabled(enabled):
+    """
+    Enable or disable the recording of the timings.
+
+    :param enabled: True to record the timings.
+    """
+
+    registry.enabled = enabled
@@ -0,0 +1,198 @@
+"""
+Adaptive quality of the detection and of the video stream.
+
+On a loaded host the detection falls behind the camera and the latency grows. The AdaptiveQualityController measures
+once per interval either the latency of the detection results or the share of the time the detection keeps busy, and
+compares it to its target:
+
+- above the target, it moves to the next level of LEVELS, which analyses smaller images, skips more frames and
+  encodes the video stream with a lower JPEG quality and frame rate,
+- well below the target for a few intervals in a row, it moves back to the previous level.
+"""
+
+import collections
+import threading
+import time
+
+# Settings applied together: scale of the images given to the detection, number of frames skipped after each analysed
+# one, JPEG quality and maximum frame rate of the video stream
+QualityLevel = collections.namedtuple('QualityLevel', ['inference_scale', 'frame_skip', 'jpeg_quality', 'max_fps'])
+
+# Levels from the best quality to the cheapest one
+LEVELS = (
+    QualityLevel(1.0, 0, 70, 15),
+    QualityLevel(0.75, 0, 60, 12),
+    QualityLevel(0.75, 1, 50, 10),
+    QualityLevel(0.5, 1, 40, 8),
+    QualityLevel(0.5, 2, 30, 5),
+)
+
+# Targets of the controller
+LATENCY = "latency"
+CPU = "cpu"
+
+
+class AdaptiveQualityController:
+    """
+    This class adjusts the quality level of a robot's detection worker and video broadcaster to hold a latency or a
+    CPU share target.
+    """
+
+    def __init__(self, broadcaster=None, worker=None, target=LATENCY, target_value=0.15, interval=1.0, levels=LEVELS,
+                 recover_ratio=0.6, recover_intervals=3, max_decisions=20):
+        """
+        :param broadcaster: The FrameBroadcaster of the video stream, its quality is set with set_quality.
+        :param worker: The DetectionWorker, it can also be attached later.
+        :param target: LATENCY to target the mean time in seconds between the arrival of an analysed frame and its
+            result, or CPU to target the share of the time spent in the detection, e.g. 0.5 for half a core.
+        :param target_value: The value of the target.
+        :param interval: Time in seconds between two decisions.
+        :param levels: Sequence of QualityLevel from the best quality to the cheapest one.
+        :param recover_ratio: Fraction of the target under which the measure must stay to move back to a better level.
+        :param recover_intervals: Number of intervals in a row the measure must stay low to move back.
+        :param max_decisions: Number of the last decisions kept.
+        """
+
+        if target not in (LATENCY, CPU):
+            raise ValueError("Unknown quality target %r, use %r or %r" % (target, LATENCY, CPU))
+
+        self.broadcaster = broadcaster
+        self.worker = None
+        self.target = target
+        self.target_value = target_value
+        self.interval = interval
+        self.levels = tuple(levels)
+        self.recover_ratio = recover_ratio
+        self.recover_intervals = recover_intervals
+
+        self.level = 0
+        self.measure = None
+        self.decisions = collections.deque(maxlen=max_decisions)
+        self._low_intervals = 0
+        self._latencies = []
+        self._lock = threading.Lock()
+        self._busy_time = 0.0
+        self._last_update = time.monotonic()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        if worker is not None:
+            self.attach(worker)
+
+    @property
+    def settings(self):
+        """
+        The QualityLevel currently applied.
+        """
+
+        return self.levels[self.level]
+
+    def attach(self, worker):
+        """
+        Control a detection worker, the current level is applied to it.
+
+        :param worker: The DetectionWorker.
+        """
+
+        with self._lock:
+            if self.worker is not None:
+                self.worker.listeners.remove(self._on_result)
+            self.worker = worker
+            self._busy_time = worker.busy_time
+            self._latencies = []
+        worker.listeners.append(self._on_result)
+        self._apply()
+
+    def start(self):
+        """
+        Start taking decisions in a background thread.
+        """
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop taking decisions, the current level stays applied.
+        """
+
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1.0)
+        with self._lock:
+            if self.worker is not None and self._on_result in self.worker.listeners:
+                self.worker.listeners.remove(self._on_result)
+
+    def update(self):
+        """
+        Measure the last interval and change the level if needed, it is called periodically by the thread.
+
+        :return: **level** - The index of the level in levels.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            latencies, self._latencies = self._latencies, []
+            elapsed, self._last_update = now - self._last_update, now
+            busy_time = self.worker.busy_time if self.worker is not None else 0.0
+            busy, self._busy_time = busy_time - self._busy_time, busy_time
+
+        if self.target == LATENCY:
+            # Without results, there is nothing to judge
+            if not latencies:
+                return self.level
+            self.measure = sum(latencies) / len(latencies)
+        else:
+            if self.worker is None or elapsed <= 0.0:
+                return self.level
+            self.measure = busy / elapsed
+
+        if self.measure > self.target_value:
+            self._low_intervals = 0
+            if self.level < len(self.levels) - 1:
+                self._set_level(self.level + 1)
+        elif self.measure < self.target_value * self.recover_ratio:
+            self._low_intervals += 1
+            if self._low_intervals >= self.recover_intervals and self.level > 0:
+                self._low_intervals = 0
+                self._set_level(self.level - 1)
+        else:
+            self._low_intervals = 0
+        return self.level
+
+    def state(self):
+        """
+        :return: **state** - A dictionary of the target, the last measure, the current level and settings, and the last
+            decisions.
+        """
+
+        return {'target': self.target, 'target_value': self.target_value, 'measure': self.measure,
+                'level': self.level, 'levels': len(self.levels), 'settings': self.settings._asdict(),
+                'decisions': list(self.decisions)}
+
+    def _set_level(self, level):
+        self.decisions.append({'time': time.time(), 'from': self.level, 'to': level, 'measure': self.measure})
+        self.level = level
+        self._apply()
+
+    def _apply(self):
+        settings = self.settings
+        if self.worker is not None:
+            self.worker.inference_scale = settings.inference_scale
+            self.worker.frame_skip = settings.frame_skip
+        if self.broadcaster is not None:
+            self.broadcaster.set_quality(settings.jpeg_quality, settings.max_fps)
+
+    def _on_result(self, result):
+        # Called from the worker thread. The results reused for the frames skipped by the motion gate come out at once,
+        # they would hide the latency of the detection
+        if result.reused:
+            return
+        latency = time.monotonic() - result.frame.arrival_time
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.update()
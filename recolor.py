@@ -0,0 +1,85 @@
+"""
+Vectorized recoloring of the cube images displayed in the web interface.
+
+The pixels to recolor only depend on the source image, so they are computed once per image and kept in memory:
+a recolor is then a single masked assignment.
+"""
+
+import functools
+import sys
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+# Colors of the source images which are replaced by the new color
+RECOLORABLE_COLORS = np.array([(255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255)], dtype=np.uint8)
+
+# Area scanned for recolorable pixels, the three other borders of the cube are its symmetric quadrants
+SCAN_ROWS = slice(0, 30)
+SCAN_COLUMNS = slice(30, 110)
+IMAGE_SIZE = 150
+
+
+def recolorable_mask(im):
+    """
+    Compute the pixels of a cube image that take the new color.
+
+    :param im: Cube image as a numpy array of shape (height, width, channels), at least 150x150.
+    :return: **mask** - A boolean array of shape (height, width), True for the pixels to recolor.
+    """
+
+    channels = min(im.shape[2], RECOLORABLE_COLORS.shape[1])
+    region = im[SCAN_ROWS, SCAN_COLUMNS, :channels]
+
+    # A pixel is recolorable if it exactly matches one of the colors
+    region_mask = (region[:, :, np.newaxis, :] == RECOLORABLE_COLORS[:, :channels]).all(axis=3).any(axis=2)
+
+    # Mirror the scanned border on the three other borders of the cube
+    mask = np.zeros(im.shape[:2], dtype=bool)
+    cube = mask[:IMAGE_SIZE, :IMAGE_SIZE]
+    cube[SCAN_ROWS, SCAN_COLUMNS] = region_mask
+    cube |= cube[::-1, ::-1].copy()
+    cube |= cube.T.copy()
+    return mask
+
+
+@functools.lru_cache(maxsize=16)
+def load_cube_template(image_path):
+    """
+    Load a cube image and the mask of its recolorable pixels, the result is cached per image.
+
+    :param image_path: Path of the cube image.
+    :returns:
+        - **template** - The image as a read-only RGBA numpy array, with the scanned border made opaque.
+        - **mask** - The boolean mask of the recolorable pixels.
+    """
+
+    im = np.array(Image.open(image_path).convert('RGBA'))
+    if im.shape[0] < IMAGE_SIZE or im.shape[1] < IMAGE_SIZE:
+        raise ValueError("Cube image %s must be at least %dx%d" % (image_path, IMAGE_SIZE, IMAGE_SIZE))
+
+    mask = recolorable_mask(im)
+    im[SCAN_ROWS, SCAN_COLUMNS, 3] = 255
+
+    im.flags.writeable = False
+    mask.flags.writeable = False
+    return im, mask
+
+
+def recolor_cube_array(image_path, rgb):
+    """
+    Color a cube image with a new color.
+
+    :param image_path: Original image to color.
+    :param rgb: Tuple (r, g, b) of the new color.
+    :return: **im** - The colored image as a RGBA numpy array.
+    """
+
+    template, mask = load_cube_template(image_path)
+    im = template.copy()
+    im[mask] = (*rgb, 255)
+    return im
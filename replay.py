@@ -0,0 +1,413 @@
+"""
+Recording of cozmo's camera sessions and their replay without a robot.
+
+A session is saved as a compressed .npz file holding the frames, their reception times and camera ids, optionally the
+landmarks detected on them and the expected count (label) of the session. Long sessions can also be recorded in a
+frame archive (see frame_archive), which is replayed the same way. A ReplayRobot plays a session back through
+the same events as a real robot, so that the detection code runs unchanged offline.
+"""
+
+import asyncio
+import collections
+import os
+import threading
+import time
+
+import cozmo
+import numpy as np
+
+import frame_archive
+import frames
+import hand_backends
+
+# Maximum number of hands recorded per frame
+MAX_HANDS = 2
+
+Session = collections.namedtuple('Session', ['frames', 'timestamps', 'frame_ids', 'landmarks', 'is_right', 'scores',
+                                             'label'])
+
+
+class SessionRecorder:
+    """
+    This class records the frames of cozmo's camera, and optionally the landmarks detected on them.
+    """
+
+    def __init__(self, robot, max_frames=None):
+        """
+        :param robot: An instance of cozmo Robot.
+        :param max_frames: Maximum number of frames to record, no limit if None.
+        """
+
+        self.max_frames = max_frames
+        self.frames = []
+        self.timestamps = []
+        self.frame_ids = []
+        self._landmarks = {}
+        self._lock = threading.Lock()
+        self._handler = robot.world.add_event_handler(cozmo.world.EvtNewCameraImage, self._on_new_camera_image)
+
+    def _on_new_camera_image(self, evt, *, image, **kw):
+        with self._lock:
+            if self.max_frames is None or len(self.frames) < self.max_frames:
+                self.frames.append(np.asarray(image.raw_image))
+                self.timestamps.append(image.image_recv_time)
+                self.frame_ids.append(image.image_number)
+
+    def add_result(self, result):
+        """
+        Record the landmarks of a detection result, e.g. from a DetectionWorker.
+
+        :param result: The DetectionResult of a recorded frame.
+        """
+
+        if result.total is not None:
+            self._landmarks[result.frame.frame_id] = hand_backends.results_to_arrays(result.results)
+
+    def stop(self):
+        """
+        Stop recording.
+        """
+
+        self._handler.disable()
+
+    def save(self, path, label=None):
+        """
+        Save the recorded session.
+
+        :param path: Path of the .npz file.
+        :param label: The number of fingers shown during the session, if known.
+        """
+
+        with self._lock:
+            recording = dict(frames=np.stack(self.frames), timestamps=np.array(self.timestamps, dtype=np.float64),
+                             frame_ids=np.array(self.frame_ids, dtype=np.int64))
+
+        if self._landmarks:
+            nb_frames = len(recording['frames'])
+            landmarks = np.full((nb_frames, MAX_HANDS, hd.NB_LANDMARKS, 3), np.nan, dtype=np.float32)
+            is_right = np.zeros((nb_frames, MAX_HANDS), dtype=bool)
+            scores = np.zeros((nb_frames, MAX_HANDS), dtype=np.float32)
+            for index, frame_id in enumerate(recording['frame_ids']):
+                if frame_id in self._landmarks:
+                    hand_landmarks, hand_right, hand_scores = self._landmarks[frame_id]
+                    landmarks[index, :len(hand_landmarks)] = hand_landmarks[:MAX_HANDS]
+                    is_right[index, :len(hand_right)] = hand_right[:MAX_HANDS]
+                    scores[index, :len(hand_scores)] = hand_scores[:MAX_HANDS]
+            recording.update(landmarks=landmarks, is_right=is_right, scores=scores)
+
+        if label is not None:
+            recording['label'] = np.array(label)
+
+        np.savez_compressed(path, **recording)
+
+
+def load_session(path):
+    """
+    Load a recorded session.
+
+    :param path: Path of the .npz file, or directory of a frame archive whose frames are memory-mapped.
+    :return: **session** - A Session, the missing fields are None.
+    """
+
+    if os.path.isdir(path):
+        archive = frame_archive.FrameArchive(path)
+        label = archive.metadata.get('label')
+        return Session(archive, archive.timestamps, archive.frame_ids, None, None, None,
+                       None if label is None else int(label))
+
+    with np.load(path) as recording:
+        return Session(recording['frames'], recording['timestamps'], recording['frame_ids'],
+                       recording['landmarks'] if 'landmarks' in recording else None,
+                       recording['is_right'] if 'is_right' in recording else None,
+                       recording['scores'] if 'scores' in recording else None,
+                       int(recording['label']) if 'label' in recording else None)
+
+
+def close_session(session):
+    """
+    Release the files of a session loaded from a frame archive, its frames cannot be read anymore.
+
+    :param session: The Session.
+    """
+
+    if isinstance(session.frames, frame_archive.FrameArchive):
+        session.frames.close()
+
+
+class ReplayFrameSource(frames.FrameSource):
+    """
+    This class pushes the frames of a recorded session, at their recorded pace or as fast as they are consumed.
+    """
+
+    def __init__(self, session, realtime=True, loop=False, latency_window=100):
+        """
+        :param session: The Session to replay.
+        :param realtime: To push the frames at their recorded pace, otherwise each frame is pushed once the previous
+            one has been consumed.
+        :param loop: To start again from the first frame after the last one.
+        :param latency_window: Number of latencies kept to compute the mean latency.
+        """
+
+        super().__init__(latency_window)
+        self.session = session
+        self.realtime = realtime
+        self.loop = loop
+        self.finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for image, frame_id in iter_session(self.session, self.realtime, self.loop, self.finished):
+            if not self.realtime:
+                self.queue.wait_empty()
+            self.push(image, frame_id)
+        self.finished.set()
+
+    def close(self):
+        self.finished.set()
+        super().close()
+
+
+def iter_session(session, realtime=True, loop=False, stop_event=None):
+    """
+    Iterate over the frames of a session.
+
+    :param session: The Session to replay.
+    :param realtime: To wait between the frames as long as during the recording.
+    :param loop: To start again from the first frame after the last one.
+    :param stop_event: A threading.Event stopping the iteration when set.
+    :return: Tuples (frame, frame id).
+    """
+
+    while True:
+        start = time.monotonic()
+        for index in range(len(session.frames)):
+            if stop_event is not None and stop_event.is_set():
+                return
+            if realtime:
+                delay = session.timestamps[index] - session.timestamps[0] - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield session.frames[index], int(session.frame_ids[index])
+        if not loop:
+            return
+
+
+class ReplayAction:
+    """
+    An action of the ReplayRobot, it completes after a fixed duration.
+    """
+
+    def __init__(self, duration):
+        self._end = time.monotonic() + duration
+
+    @property
+    def is_running(self):
+        return time.monotonic() < self._end
+
+    @property
+    def is_completed(self):
+        return not self.is_running
+
+    def wait_for_completed(self, timeout=None):
+        delay = self._end - time.monotonic()
+        if delay > 0:
+            time.sleep(delay if timeout is None else min(delay, timeout))
+        return self
+
+
+class ReplayCube:
+    """
+    A light cube of the ReplayRobot, its lights are only remembered.
+    """
+
+    def __init__(self, object_id):
+        self.object_id = object_id
+        self.lights = None
+
+    def set_lights(self, light):
+        self.lights = (light,) * 4
+
+    def set_light_corners(self, light1, light2, light3, light4):
+        self.lights = (light1, light2, light3, light4)
+
+    def set_lights_off(self):
+        self.lights = (cozmo.lights.off_light,) * 4
+
+
+class ReplayImage:
+    """
+    A camera image of the ReplayRobot, with the attributes of cozmo's CameraImage used by the project.
+    """
+
+    def __init__(self, raw_image, image_number):
+        self.raw_image = raw_image
+        self.image_number = image_number
+        self.image_recv_time = time.time()
+
+
+class ReplayHandler:
+    """
+    An event handler of the ReplayRobot.
+    """
+
+    def __init__(self, robot, event, f):
+        self.robot = robot
+        self.event = event
+        self.f = f
+
+    def disable(self):
+        self.robot.remove_event_handler(self.event, self.f)
+
+
+class ReplayRobot:
+    """
+    This class stands for a cozmo Robot and plays a recorded session through its camera events.
+
+    Its world is the robot itself: handlers can be added on both, robot actions complete after action_duration
+    seconds and the spoken texts are kept in said.
+    """
+
+    def __init__(self, session, realtime=True, loop=False, action_duration=0.0):
+        """
+        :param session: The Session to replay, or the path of its file.
+        :param realtime: To send the frames at their recorded pace, otherwise as fast as possible.
+        :param loop: To start again from the first frame after the last one.
+        :param action_duration: Duration in seconds of the robot actions.
+        """
+
+        self.own_session = isinstance(session, str)
+        self.session = load_session(session) if self.own_session else session
+        self.realtime = realtime
+        self.loop = loop
+        self.action_duration = action_duration
+
+        self.world = self
+        self.latest_image = None
+        self.head_angle = cozmo.util.degrees(0)
+        self.lift_height = cozmo.util.distance_mm(cozmo.robot.MIN_LIFT_HEIGHT_MM)
+        self.said = []
+        self.cubes = {cube_id: ReplayCube(object_id) for object_id, cube_id in
+                      enumerate((cozmo.objects.LightCube1Id, cozmo.objects.LightCube2Id,
+                                 cozmo.objects.LightCube3Id), start=1)}
+
+        self._handlers = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self.finished = threading.Event()
+        self._thread = None
+
+    def play(self):
+        """
+        Start sending the frames of the session in a background thread.
+        """
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sending the frames, the session is closed if it was loaded from its path.
+        """
+
+        self.finished.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self.own_session:
+            close_session(self.session)
+
+    def _run(self):
+        for image, frame_id in iter_session(self.session, self.realtime, self.loop, self.finished):
+            self.latest_image = ReplayImage(image, frame_id)
+            self.dispatch_event(cozmo.world.EvtNewCameraImage, image=self.latest_image)
+            if not self.realtime:
+                # Let the consumers run between two frames
+                time.sleep(0)
+        self.finished.set()
+
+    def add_event_handler(self, event, f):
+        """
+        Register an event handler, as cozmo's Dispatcher.add_event_handler.
+
+        :param event: The Event class.
+        :param f: Callable called with the event and its parameters.
+        :return: **handler** - An object whose disable method removes the handler.
+        """
+
+        with self._lock:
+            self._handlers[event].append(f)
+        return ReplayHandler(self, event, f)
+
+    def remove_event_handler(self, event, f):
+        with self._lock:
+            if f in self._handlers[event]:
+                self._handlers[event].remove(f)
+
+    def dispatch_event(self, event, **kw):
+        """
+        Call the handlers of an event.
+
+        :param event: The Event class.
+        :param kw: The parameters of the event.
+        """
+
+        evt = event(**kw)
+        with self._lock:
+            handlers = [f for event_class, fs in self._handlers.items() if issubclass(event, event_class) for f in fs]
+        for f in handlers:
+            result = f(evt, **kw)
+            # Coroutine handlers are run to completion, as the SDK would on its event loop
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+
+    def wait_for(self, event, timeout=30):
+        """
+        Wait for an event.
+
+        :param event: The Event class.
+        :param timeout: Maximum waiting time in seconds, None to wait indefinitely.
+        :return: **evt** - The dispatched event.
+        """
+
+        received = []
+        done = threading.Event()
+
+        def on_event(evt, **kw):
+            received.append(evt)
+            done.set()
+
+        handler = self.add_event_handler(event, on_event)
+        try:
+            if not done.wait(timeout):
+                raise TimeoutError("%s was not received within %s seconds" % (event.__name__, timeout))
+            return received[0]
+        finally:
+            handler.disable()
+
+    def tap_cube(self, cube_id):
+        """
+        Simulate a tap on a cube.
+
+        :param cube_id: The id of the cube, e.g. cozmo.objects.LightCube1Id.
+        """
+
+        self.dispatch_event(cozmo.objects.EvtObjectTapped, obj=self.cubes[cube_id], tap_count=1)
+
+    def get_light_cube(self, cube_id):
+        return self.cubes.get(cube_id)
+
+    def say_text(self, text, *args, **kwargs):
+        self.said.append(text)
+        return ReplayAction(self.action_duration)
+
+    def play_anim(self, *args, **kwargs):
+        return ReplayAction(self.action_duration)
+
+    def play_anim_trigger(self, *args, **kwargs):
+        return ReplayAction(self.action_duration)
+
+    def set_head_angle(self, angle, *args, **kwargs):
+        self.head_angle = angle
+        return ReplayAction(self.action_duration)
+
+    def set_lift_height(self, height, *args, **kwargs):
+        return ReplayAction(self.action_duration)
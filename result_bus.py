@@ -0,0 +1,161 @@
+"""
+Publication of the detection results of a robot.
+
+The DetectionWorker publishes each DetectionResult on the ResultBus of its robot, which turns it into a BusResult
+made of plain arrays, numbers it and hands it to every subscriber: the WebSocket pushing the counts to the page, or
+the overlay drawn on the video stream. The results are only computed once, by the detection of the game, whatever
+the number of subscribers.
+"""
+
+import collections
+import threading
+import time
+
+import hand_backends
+
+try:
+    from PIL import ImageDraw
+except ImportError:
+    import sys
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+# A published detection result: the landmarks are a float32 array of shape (hands, 21, 3) in coordinates normalized
+# to the mirrored frame, total and score are None when no hand is detected
+BusResult = collections.namedtuple('BusResult', ['sequence', 'frame_sequence', 'frame_id', 'arrival_time',
+                                                 'landmarks', 'is_right', 'fingers_statuses', 'count', 'total',
+                                                 'score'])
+
+# Pairs of landmarks linked when a hand is drawn, as in mediapipe's HAND_CONNECTIONS
+HAND_CONNECTIONS = ((0, 1), (1, 2), (2, 3), (3, 4), (0, 5), (5, 6), (6, 7), (7, 8), (5, 9), (9, 10), (10, 11),
+                    (11, 12), (9, 13), (13, 14), (14, 15), (15, 16), (13, 17), (0, 17), (17, 18), (18, 19), (19, 20))
+
+
+class ResultBus:
+    """
+    This class shares the detection results of a robot with any number of subscribers.
+
+    Subscribers are called from the detection thread and must return quickly. The latest result can also be read or
+    waited for at any time.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._subscribers = []
+        self._last_results = None
+        self._last_arrays = None
+        self.latest = None
+        self.sequence = 0
+
+    @property
+    def subscribers(self):
+        """
+        Number of callables subscribed.
+        """
+
+        return len(self._subscribers)
+
+    def subscribe(self, subscriber):
+        """
+        Call a callable with each new BusResult.
+
+        :param subscriber: The callable.
+        """
+
+        with self._condition:
+            self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        """
+        Stop calling a subscribed callable.
+
+        :param subscriber: The callable.
+        """
+
+        with self._condition:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, result):
+        """
+        Publish a detection result, it can be used as a listener of a DetectionWorker.
+
+        :param result: The DetectionResult.
+        :return: **bus_result** - The published BusResult.
+        """
+
+        # The same result is published again for the frames skipped by the motion gate
+        if result.results is not self._last_results:
+            self._last_results = result.results
+            self._last_arrays = hand_backends.results_to_arrays(result.results)[:2]
+        landmarks, is_right = self._last_arrays
+
+        frame = result.frame
+        with self._condition:
+            self.sequence += 1
+            bus_result = BusResult(self.sequence, frame.sequence, frame.frame_id, frame.arrival_time, landmarks,
+                                   is_right, result.fingers_statuses, result.count, result.total, result.score)
+            self.latest = bus_result
+            subscribers = list(self._subscribers)
+            self._condition.notify_all()
+
+        for subscriber in subscribers:
+            subscriber(bus_result)
+        return bus_result
+
+    def wait(self, after=0, timeout=None):
+        """
+        Wait for a result more recent than a given one.
+
+        :param after: Sequence number of the last result known by the caller.
+        :param timeout: Maximum waiting time in seconds.
+        :return: **bus_result** - The latest BusResult, or None on timeout.
+        """
+
+        with self._condition:
+            if self._condition.wait_for(lambda: self.sequence > after, timeout):
+                return self.latest
+        return None
+
+
+def draw_result(image, bus_result):
+    """
+    Draw the hands and the count of a result on a copy of a frame.
+
+    :param image: The mirrored frame as a PIL image.
+    :param bus_result: The BusResult of the frame.
+    :return: **image** - The annotated copy of the frame.
+    """
+
+    image = image.copy()
+    draw = ImageDraw.Draw(image)
+    width, height = image.size
+
+    for hand_landmarks in bus_result.landmarks:
+        points = [(float(x) * width, float(y) * height) for x, y, _ in hand_landmarks]
+        for start, end in HAND_CONNECTIONS:
+            draw.line([points[start], points[end]], fill=(255, 255, 255), width=2)
+        for x, y in points:
+            draw.ellipse([x - 3, y - 3, x + 3, y + 3], fill=(240, 84, 84))
+
+    if bus_result.total is not None:
+        draw.text((8, 8), "%d (%d + %d)" % (bus_result.total, bus_result.count['RIGHT'], bus_result.count['LEFT']),
+                  fill=(255, 255, 0))
+    return image
+
+
+def result_overlay(bus, max_age=0.5):
+    """
+    Build the overlay of a FrameBroadcaster drawing the latest result of a bus.
+
+    :param bus: The ResultBus of the robot.
+    :param max_age: Maximum time in seconds since the arrival of the analysed frame for its result to be drawn.
+    :return: **overlay** - A callable taking the mirrored frame as a PIL image and returning the annotated image.
+    """
+
+    def overlay(image):
+        bus_result = bus.latest
+        if bus_result is None or time.monotonic() - bus_result.arrival_time > max_age:
+            return image
+        return draw_result(image, bus_result)
+
+    return overlay
@@ -0,0 +1,219 @@
+"""
+Sessions of the robots driven by the web interface.
+
+Each connected robot gets a RobotSession holding its cubes, its remote control, its video broadcaster and its own
+hands detection process, so that several robots can be served by the same server without sharing their frames or
+their inference. The first robot added is the default one, used by the routes that do not name a robot.
+"""
+
+import threading
+
+import commands as cmd
+import cubes as cb
+import game
+import hand_backends
+import quality
+import result_bus
+import speech as sp
+import streaming
+
+
+class RobotSession:
+    """
+    This class holds everything the web interface and the program need to drive one robot.
+    """
+
+    def __init__(self, robot_id, robot, cubes=None, remote_control=None, hands=None, hands_backend='mediapipe',
+                 backend_params=None, use_process=True, commands=None, continuous_game=False, adaptive_quality=True,
+                 quality_params=None, gestures=False):
+        """
+        :param robot_id: Identifier of the robot in the URLs.
+        :param robot: An instance of cozmo Robot.
+        :param cubes: The Cubes of the robot, created if None.
+        :param remote_control: Object controlling the robot from the web page, e.g. a UI.RemoteControlCozmo.
+        :param hands: A backend shared with other robots, e.g. an inference_pool.InferencePool, it is not closed with
+            the session. The robot's own backend is created if None.
+        :param hands_backend: Name of the backend performing the hands landmarks detection.
+        :param backend_params: Parameters of the backend.
+        :param use_process: To run the backend in a dedicated process, otherwise in the program's threads.
+        :param commands: The CommandScheduler sending the commands to the robot, created if None.
+        :param continuous_game: To start a new round as soon as one ends, otherwise each round is requested.
+        :param adaptive_quality: To adjust the quality of the detection and of the video stream to the load of the host.
+        :param quality_params: Parameters of the quality.AdaptiveQualityController, e.g. its target.
+        :param gestures: To also let the players show the operators with their hands instead of tapping a cube.
+        """
+
+        self.robot_id = robot_id
+        self.robot = robot
+        self.commands = commands if commands is not None else cmd.CommandScheduler()
+        self.cubes = cubes if cubes is not None else cb.Cubes(robot, self.commands)
+        self.remote_control = remote_control
+        # Detection results of the robot's program, also drawn on the video stream for the clients asking for it
+        self.results = result_bus.ResultBus()
+        self.broadcaster = streaming.FrameBroadcaster(streaming.robot_frame_grabber(lambda: self.robot),
+                                                      overlay=result_bus.result_overlay(self.results))
+        self.speech = sp.SpeechManager(robot)
+        self.quality = None
+        if adaptive_quality:
+            self.quality = quality.AdaptiveQualityController(self.broadcaster, **(quality_params or {}))
+            self.quality.start()
+
+        self.hands_backend = hands_backend
+        self.backend_params = dict(backend_params or {})
+        self.use_process = use_process
+        self._shared_hands = hands
+        self._hands = None
+        self._lock = threading.Lock()
+        self.continuous_game = continuous_game
+        self.gestures = gestures
+        self.game = None
+
+    @property
+    def hands(self):
+        """
+        The backend of the robot, its process is started on first use and kept for all the rounds.
+        """
+
+        with self._lock:
+            return self._get_hands()
+
+    def _get_hands(self):
+        if self._shared_hands is not None:
+            return self._shared_hands
+        if self._hands is None:
+            if self.use_process:
+                self._hands = hand_backends.create_backend('process', backend=self.hands_backend,
+                                                           **self.backend_params)
+            else:
+                self._hands = hand_backends.create_backend(self.hands_backend, **self.backend_params)
+        return self._hands
+
+    @property
+    def program_running(self):
+        """
+        True while a round of the game is running.
+        """
+
+        return self.game is not None and self.game.round_active
+
+    def start_program(self):
+        """
+        Start a round of the game, the game engine of the robot is created on the first call.
+
+        :return: True if the round starts, False if a round is already running.
+        """
+
+        with self._lock:
+            if self.game is None:
+                self.game = game.GameEngine(self.robot, self.cubes, self._get_hands(), [self.results.publish],
+                                            self.speech, continuous=self.continuous_game, quality=self.quality,
+                                            gestures=self.gestures)
+            # Also restarts the engine's thread if it died
+            self.game.start()
+        return self.game.request_round()
+
+    def close(self):
+        """
+        Stop the game, the detection process, the speech and the command scheduler of the robot.
+        """
+
+        if self.game is not None:
+            self.game.stop()
+        if self.quality is not None:
+            self.quality.stop()
+        self.speech.close()
+        self.commands.close()
+        with self._lock:
+            if self._hands is not None and hasattr(self._hands, 'close'):
+                self._hands.close()
+            self._hands = None
+
+
+class SessionManager:
+    """
+    This class keeps the sessions of the connected robots by id.
+    """
+
+    def __init__(self, hands=None, **session_params):
+        """
+        :param hands: A backend shared by all the robots, e.g. an inference_pool.InferencePool, otherwise each robot
+            gets its own.
+        :param session_params: Default parameters of the RobotSession of each robot.
+        """
+
+        self.hands = hands
+        self.session_params = session_params
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.default_id = None
+
+    def add(self, robot, robot_id=None, **params):
+        """
+        Create the session of a newly connected robot.
+
+        :param robot: An instance of cozmo Robot.
+        :param robot_id: Identifier of the robot in the URLs, its connection number if None. The SDK gives the same
+            robot id to the robots of different connections, so it cannot be used.
+        :param params: Parameters of the RobotSession, in addition to session_params.
+        :return: **session** - The new RobotSession.
+        """
+
+        with self._lock:
+            if robot_id is None:
+                robot_id = self._next_id
+            self._next_id += 1
+            robot_id = str(robot_id)
+            if robot_id in self._sessions:
+                raise ValueError("A robot is already connected with the id %s" % robot_id)
+            params = dict(self.session_params, **params)
+            params.setdefault('hands', self.hands)
+            session = RobotSession(robot_id, robot, **params)
+            self._sessions[robot_id] = session
+            if self.default_id is None:
+                self.default_id = robot_id
+        return session
+
+    def get(self, robot_id=None):
+        """
+        :param robot_id: Identifier of the robot, the default robot if None.
+        :return: **session** - The RobotSession of the robot, None if it is not connected.
+        """
+
+        return self._sessions.get(self.default_id if robot_id is None else str(robot_id))
+
+    def remove(self, robot_id):
+        """
+        Close and forget the session of a robot.
+
+        :param robot_id: Identifier of the robot.
+        """
+
+        with self._lock:
+            session = self._sessions.pop(str(robot_id), None)
+            if self.default_id == str(robot_id):
+                self.default_id = next(iter(self._sessions), None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        """
+        Close all the sessions.
+        """
+
+        for robot_id in self.ids():
+            self.remove(robot_id)
+
+    def ids(self):
+        """
+        :return: **ids** - The identifiers of the connected robots, in their connection order.
+        """
+
+        with self._lock:
+            return list(self._sessions)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
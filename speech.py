@@ -0,0 +1,184 @@
+"""
+Speech of cozmo during the game.
+
+cozmo's SDK synthesizes the speech on the device when say_text is called. The phrases are turned into the words cozmo
+pronounces, e.g. the operators are spelled out, and the SpeechManager says them one after the other in its own thread,
+so that the detection of the next input goes on while cozmo speaks. It also measures the time spent speaking in each
+round.
+"""
+
+import functools
+import queue
+import threading
+import time
+
+import metrics
+import tracing
+
+# Words said for the operators of the game
+OPERATOR_WORDS = {'+': "plus", '-': "moins", '*': "fois", '=': "égale"}
+
+
+@functools.lru_cache(maxsize=512)
+def normalize(text):
+    """
+    Turn a phrase into the words cozmo pronounces: operators are spelled out and spaces collapsed. The phrases of the
+    game come back often, so the results are memoized.
+
+    :param text: The phrase, e.g. "2+3=5".
+    :return: **text** - The normalized phrase, e.g. "2 plus 3 égale 5".
+    """
+
+    for symbol, word in OPERATOR_WORDS.items():
+        text = text.replace(symbol, " %s " % word)
+    return " ".join(text.split())
+
+
+def result_sentence(first_number, operation, second_number, result):
+    """
+    Build the single utterance announcing an operation and its result.
+
+    :param first_number: The first operand.
+    :param operation: The operator, '+', '-' or '*'.
+    :param second_number: The second operand.
+    :param result: The result of the operation.
+    :return: **text** - The normalized sentence.
+    """
+
+    return normalize("%s %s %s = %s" % (first_number, operation, second_number, result))
+
+
+class Utterance:
+    """
+    A phrase waiting to be said or being said.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.duration = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the phrase has been said.
+
+        :param timeout: Maximum waiting time in seconds.
+        :return: True if the phrase has been said.
+        """
+
+        return self._done.wait(timeout)
+
+
+class SpeechManager:
+    """
+    This class says cozmo's phrases one at a time in a dedicated thread, in the order they are asked for.
+    """
+
+    def __init__(self, robot):
+        """
+        :param robot: An instance of cozmo Robot.
+        """
+
+        self.robot = robot
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+
+        # Time spent speaking since the beginning of the round
+        self.round_speaking_time = 0.0
+
+    def say(self, text, wait=False):
+        """
+        Say a phrase after the ones already asked for.
+
+        :param text: The phrase, it is normalized.
+        :param wait: To wait until the phrase has been said.
+        :return: **utterance** - The Utterance of the phrase.
+        """
+
+        utterance = Utterance(normalize(str(text)))
+        with self._lock:
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put(utterance)
+        if wait:
+            utterance.wait()
+        return utterance
+
+    def announce(self, first_number, operation, second_number, result, wait=True):
+        """
+        Announce an operation and its result in a single utterance.
+
+        :return: **utterance** - The Utterance of the announcement.
+        """
+
+        return self.say(result_sentence(first_number, operation, second_number, result), wait)
+
+    def wait_idle(self, timeout=None):
+        """
+        Wait until all the phrases asked for have been said.
+
+        :param timeout: Maximum waiting time in seconds.
+        :return: True if cozmo does not speak anymore.
+        """
+
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def start_round(self):
+        """
+        Start measuring the speaking time of a new round.
+        """
+
+        self.round_speaking_time = 0.0
+
+    def end_round(self):
+        """
+        End the round once cozmo has finished speaking.
+
+        :return: **speaking_time** - The time in seconds spent speaking during the round.
+        """
+
+        self.wait_idle()
+        metrics.observe('round.speaking', self.round_speaking_time)
+        return self.round_speaking_time
+
+    def close(self):
+        """
+        Stop the speech thread after the phrases already asked for.
+        """
+
+        with self._lock:
+            if self._thread is None:
+                return
+            thread, self._thread = self._thread, None
+        self._queue.put(None)
+        thread.join(timeout=10.0)
+
+    def _run(self):
+        while True:
+            utterance = self._queue.get()
+            if utterance is None:
+                return
+
+            start = time.perf_counter()
+            try:
+                with metrics.timer('robot.say_text'), tracing.span('robot.say_text', text=utterance.text):
+                    self.robot.say_text(utterance.text, in_parallel=True).wait_for_completed()
+            except Exception as e:
+                print("Cannot say %r: %r" % (utterance.text, e))
+            utterance.duration = time.perf_counter() - start
+
+            with self._idle:
+                self.round_speaking_time += utterance.duration
+                self._pending -= 1
+                self._idle.notify_all()
+            utterance._done.set()
@@ -1,12 +1,44 @@
 
+// WebSocket of the asynchronous server mode, the requests fall back on XHR when it is not available
+let controlSocket = null;
+
+function openControlSocket() {
+    const protocol = location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const path = location.pathname.endsWith('/') ? location.pathname : location.pathname + '/';
+    const socket = new WebSocket(protocol + location.host + path + 'ws');
+
+    socket.onopen = () => { controlSocket = socket; };
+    socket.onclose = () => { controlSocket = null; };
+    socket.onerror = () => {};
+    socket.onmessage = event => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'detection') {
+            document.getElementById('detectionCount').textContent =
+                message.total === null ? 'No hand' : `${message.total} finger(s)`;
+        }
+    };
+}
+
+function sendCommand(command) {
+    if (controlSocket && controlSocket.readyState === WebSocket.OPEN) {
+        controlSocket.send(JSON.stringify(command));
+        return true;
+    }
+    return false;
+}
+
 function sendHeadValue(val) {
+    // The server only sends the latest angle to the robot
+    if (sendCommand({type: 'headAngle', value: Number(val)})) {
+        return;
+    }
     const xhr = new XMLHttpRequest();
     xhr.open('POST', `headAngle/${JSON.stringify(val)}`)
     xhr.send()
 }
 
 function sendChangeColorRequest(newColor, cubeId) {
-    fetch('/colorChange/', {
+    fetch('colorChange/', {
         method: 'POST',
         body: JSON.stringify({
             "cubeId": cubeId,
@@ -17,16 +49,60 @@ function sendChangeColorRequest(newColor, cubeId) {
         }
     })
     .then(res => {
-        res.text().then(imageName => {
-
-            document.getElementById(imageName).setAttribute('src', "static/temp/" + imageName+".png");
+        if (!res.ok) {
+            return;
+        }
+        res.json().then(cubeImage => {
+            // The URL changes with the image content, so the browser only downloads new colors
+            document.getElementById(cubeImage.cubeId).setAttribute('src', cubeImage.url);
         });
     });
 }
 
 function relaunchCozmoProgram() {
+    if (sendCommand({type: 'reload'})) {
+        return;
+    }
     const xhr = new XMLHttpRequest();
     xhr.open('POST', `reload`)
     xhr.send()
 }
 
+
+function toggleOverlay(overlay) {
+    // The annotated stream is drawn by the server from the results of the game's detection
+    document.getElementById('cozmoImageId').src = overlay ? 'cozmoImage?overlay=1' : 'cozmoImage';
+}
+
+
+function refreshMetrics() {
+    fetch('/metrics.json')
+    .then(res => res.json())
+    .then(metrics => {
+        const rows = Object.entries(metrics.stages).map(([stage, values]) =>
+            `<tr><td>${stage}</td><td>${values.p50_ms.toFixed(1)}</td><td>${values.p95_ms.toFixed(1)}</td>` +
+            `<td>${values.p99_ms.toFixed(1)}</td><td>${values.rate.toFixed(1)}</td></tr>`);
+        document.querySelector('#metricsPanel tbody').innerHTML =
+            metrics.enabled ? rows.join('') : '<tr><td colspan="5">Metrics are disabled</td></tr>';
+    })
+    .catch(() => {});
+}
+
+function refreshQuality() {
+    fetch('quality')
+    .then(res => res.json())
+    .then(quality => {
+        const rows = quality.enabled ? [
+            `<tr><td>Target</td><td>${quality.target} ${quality.target_value}</td></tr>`,
+            `<tr><td>Measure</td><td>${quality.measure === null ? '-' : quality.measure.toFixed(3)}</td></tr>`,
+            `<tr><td>Level</td><td>${quality.level + 1} / ${quality.levels}</td></tr>`,
+        ].concat(Object.entries(quality.settings).map(([name, value]) => `<tr><td>${name}</td><td>${value}</td></tr>`))
+        : ['<tr><td colspan="2">Fixed quality</td></tr>'];
+        document.querySelector('#qualityPanel tbody').innerHTML = rows.join('');
+    })
+    .catch(() => {});
+}
+
+setInterval(refreshMetrics, 1000);
+setInterval(refreshQuality, 1000);
+openControlSocket();
@@ -0,0 +1,274 @@
+"""
+Shared camera stream for the web interface.
+
+A single broadcaster thread encodes every new camera frame once and hands the same bytes to all the clients
+watching the stream, whatever their number.
+"""
+
+import io
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    import sys
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+
+def robot_frame_grabber(get_robot):
+    """
+    Build a frame grabber reading the latest image of a robot's camera.
+
+    :param get_robot: Callable returning the robot to read from, or None when no robot is connected yet.
+    :return: **grab** - A callable returning a tuple (frame id, PIL image) or None if there is no image.
+    """
+
+    def grab():
+        robot = get_robot()
+        if robot is None:
+            return None
+        latest_image = robot.world.latest_image
+        if latest_image is None:
+            return None
+        # image_number is 0 on old SDK versions, fall back on the reception time in that case
+        frame_id = latest_image.image_number or latest_image.image_recv_time
+        return frame_id, latest_image.raw_image
+
+    return grab
+
+
+class FrameBroadcaster:
+    """
+    This class encodes each new camera frame once in JPEG and shares it with every subscriber.
+
+    The encoding thread only runs while there is at least one subscriber. Each subscriber always receives the most
+    recent frame: a client that is too slow simply skips the frames it missed, nothing is buffered for it.
+
+    Subscribers can ask for the frames annotated by an overlay instead, e.g. the detection results. The overlay is
+    only drawn and encoded while at least one of them is subscribed.
+    """
+
+    def __init__(self, grab_frame, jpeg_quality=70, max_fps=15, mirror=True, poll_interval=0.01, overlay=None):
+        """
+        :param grab_frame: Callable returning a tuple (frame id, PIL image or numpy array) or None if there is no
+            image yet.
+        :param jpeg_quality: JPEG quality of the encoded frames, from 1 to 95.
+        :param max_fps: Maximum number of frames encoded per second.
+        :param mirror: To flip horizontally the frames before encoding them.
+        :param poll_interval: Time in seconds between two checks for a new frame.
+        :param overlay: Callable taking the mirrored frame as a PIL image and returning an annotated copy, see
+            result_bus.result_overlay.
+        """
+
+        self.grab_frame = grab_frame
+        self.jpeg_quality = jpeg_quality
+        self.max_fps = max_fps
+        self.mirror = mirror
+        self.poll_interval = poll_interval
+        self.overlay = overlay
+
+        self._condition = threading.Condition()
+        self._thread = None
+        self._subscribers = 0
+        self._overlay_subscribers = 0
+        self._listeners = []
+        self._frame = None
+        self._overlay_frame = None
+        self._sequence = 0
+        self._error = None
+
+        self.frames_encoded = 0
+        self.frames_dropped = 0
+
+    @property
+    def subscribers(self):
+        """
+        Number of clients currently reading the stream.
+        """
+
+        return self._subscribers
+
+    @property
+    def overlay_subscribers(self):
+        """
+        Number of clients currently reading the annotated stream.
+        """
+
+        return self._overlay_subscribers
+
+    def set_quality(self, jpeg_quality=None, max_fps=None):
+        """
+        Change the encoding settings, they are used from the next frame.
+
+        :param jpeg_quality: New JPEG quality, unchanged if None.
+        :param max_fps: New maximum frame rate, unchanged if None.
+        """
+
+        if jpeg_quality is not None:
+            self.jpeg_quality = int(jpeg_quality)
+        if max_fps is not None:
+            self.max_fps = max_fps
+
+    def encode(self, image):
+        """
+        Encode an image as it is sent to the subscribers.
+
+        :param image: PIL image or numpy array to encode.
+        :return: **data** - The JPEG bytes of the image.
+        """
+
+        return self._to_jpeg(self._prepare(image))
+
+    def _prepare(self, image):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if self.mirror:
+            image = ImageOps.mirror(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        return image
+
+    def _to_jpeg(self, image):
+        img_io = io.BytesIO()
+        image.save(img_io, 'JPEG', quality=self.jpeg_quality)
+        return img_io.getvalue()
+
+    def frames(self, overlay=False):
+        """
+        Generator yielding the JPEG bytes of each new frame for one subscriber.
+
+        It raises the exception met by the encoding thread, if any, e.g. when the SDK shuts down.
+
+        :param overlay: To get the frames annotated by the overlay, if the broadcaster has one.
+        """
+
+        overlay = overlay and self.overlay is not None
+        self._subscribe(overlay)
+        try:
+            last_sequence = 0
+            while True:
+                with self._condition:
+                    while self._sequence == last_sequence and self._error is None:
+                        self._condition.wait()
+                    if self._error is not None:
+                        raise self._error
+                    if last_sequence:
+                        self.frames_dropped += self._sequence - last_sequence - 1
+                    last_sequence = self._sequence
+                    frame = self._overlay_frame if overlay else self._frame
+                # The frame was only encoded for the other kind of subscribers
+                if frame is not None:
+                    yield frame
+        finally:
+            self._unsubscribe(overlay)
+
+    def add_listener(self, listener, overlay=False):
+        """
+        Subscribe a callable to the stream instead of a generator, e.g. to feed an asyncio stream.
+
+        It is called from the encoding thread as ``listener(frame, error)`` with the JPEG bytes of each new frame and
+        None, or with None and the exception met by the encoding thread. It must return quickly.
+
+        :param listener: The callable to subscribe.
+        :param overlay: To get the frames annotated by the overlay, if the broadcaster has one.
+        """
+
+        overlay = overlay and self.overlay is not None
+        with self._condition:
+            self._listeners.append((listener, overlay))
+        self._subscribe(overlay)
+
+    def remove_listener(self, listener):
+        """
+        Unsubscribe a callable added with add_listener.
+
+        :param listener: The callable to unsubscribe.
+        """
+
+        with self._condition:
+            for entry in self._listeners:
+                if entry[0] == listener:
+                    self._listeners.remove(entry)
+                    break
+            else:
+                return
+        self._unsubscribe(entry[1])
+
+    def _subscribe(self, overlay=False):
+        with self._condition:
+            self._subscribers += 1
+            self._overlay_subscribers += overlay
+            if self._thread is None:
+                self._error = None
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _unsubscribe(self, overlay=False):
+        with self._condition:
+            self._subscribers -= 1
+            self._overlay_subscribers -= overlay
+
+    def _notify_listeners(self, frame, overlay_frame=None, error=None):
+        with self._condition:
+            listeners = list(self._listeners)
+        for listener, overlay in listeners:
+            data = overlay_frame if overlay else frame
+            if data is not None or error is not None:
+                listener(data, error)
+
+    def _run(self):
+        last_frame_id = None
+        next_frame_time = 0.0
+
+        while True:
+            with self._condition:
+                # Stop encoding as soon as nobody is watching
+                if self._subscribers == 0:
+                    self._thread = None
+                    return
+
+            now = time.monotonic()
+            if now < next_frame_time:
+                time.sleep(next_frame_time - now)
+
+            try:
+                grabbed = self.grab_frame()
+                if grabbed is None or grabbed[0] == last_frame_id:
+                    time.sleep(self.poll_interval)
+                    continue
+
+                last_frame_id, image = grabbed
+                with self._condition:
+                    overlay_subscribers = self._overlay_subscribers if self.overlay is not None else 0
+                    plain_subscribers = self._subscribers - overlay_subscribers
+
+                data = overlay_data = None
+                with metrics.timer('stream.encode'):
+                    image = self._prepare(image)
+                    if plain_subscribers:
+                        data = self._to_jpeg(image)
+                if overlay_subscribers:
+                    with metrics.timer('stream.overlay'):
+                        overlay_data = self._to_jpeg(self.overlay(image))
+            except Exception as e:
+                # Wake up the subscribers so that they can handle the error
+                with self._condition:
+                    self._error = e
+                    self._thread = None
+                    self._condition.notify_all()
+                self._notify_listeners(None, error=e)
+                return
+
+            next_frame_time = time.monotonic() + 1.0 / self.max_fps
+            with self._condition:
+                self._frame = data
+                self._overlay_frame = overlay_data
+                self._sequence += 1
+                self.frames_encoded += 1
+                self._condition.notify_all()
+            self._notify_listeners(data, overlay_data)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the project are at its root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+import commands
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = commands.CommandScheduler(intervals={'head': 0.2}, default_interval=0.0)
+    yield scheduler
+    scheduler.close()
+
+
+def test_only_the_latest_command_of_an_actuator_is_sent(scheduler):
+    sent = []
+    scheduler.submit('head', sent.append, 10)
+    assert scheduler.wait_idle(timeout=2.0)
+    # The head now waits for its interval, meanwhile an angle replaces the previous one
+    scheduler.submit('head', sent.append, 20)
+    scheduler.submit('head', sent.append, 30)
+    assert scheduler.wait_idle(timeout=2.0)
+    assert sent == [10, 30]
+    assert scheduler.dropped == 1
+
+
+def test_the_commands_of_an_actuator_are_rate_limited(scheduler):
+    times = []
+    for angle in (10, 20):
+        scheduler.submit('head', lambda angle: times.append(time.monotonic()), angle)
+        assert scheduler.wait_idle(timeout=2.0)
+    assert times[1] - times[0] >= 0.19
+
+
+def test_a_command_identical_to_the_last_one_is_skipped(scheduler):
+    sent = []
+    assert scheduler.submit('cube1.lights', sent.append, 'red', key='red')
+    assert scheduler.wait_idle(timeout=2.0)
+    assert not scheduler.submit('cube1.lights', sent.append, 'red', key='red')
+    assert scheduler.submit('cube1.lights', sent.append, 'blue', key='blue')
+    assert scheduler.wait_idle(timeout=2.0)
+    assert sent == ['red', 'blue']
+    assert scheduler.skipped == 1
+
+
+def test_a_command_without_key_is_never_skipped_and_resets_the_last_key(scheduler):
+    sent = []
+    scheduler.submit('cube1.lights', sent.append, 'red', key='red')
+    assert scheduler.wait_idle(timeout=2.0)
+    scheduler.submit('cube1.lights', sent.append, 'blink')
+    assert scheduler.wait_idle(timeout=2.0)
+    assert scheduler.submit('cube1.lights', sent.append, 'red', key='red')
+    assert scheduler.wait_idle(timeout=2.0)
+    assert sent == ['red', 'blink', 'red']
+
+
+def test_a_failed_command_can_be_sent_again(scheduler):
+    calls = []
+
+    def send(value):
+        calls.append(value)
+        if len(calls) == 1:
+            raise RuntimeError("radio error")
+
+    scheduler.submit('cube2.lights', send, 'red', key='red')
+    assert scheduler.wait_idle(timeout=2.0)
+    # The last key is forgotten once the error is handled
+    deadline = time.monotonic() + 2.0
+    while scheduler.errors == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.submit('cube2.lights', send, 'red', key='red')
+    assert scheduler.wait_idle(timeout=2.0)
+    assert calls == ['red', 'red']
+    assert scheduler.errors == 1
+
+
+def test_the_actuators_do_not_wait_for_each_other(scheduler):
+    sent = []
+    scheduler.submit('head', sent.append, 'head')
+    scheduler.submit('cube1.lights', sent.append, 'cube1')
+    scheduler.submit('cube2.lights', sent.append, 'cube2')
+    assert scheduler.wait_idle(timeout=2.0)
+    assert sorted(sent) == ['cube1', 'cube2', 'head']
+
+
+def test_a_closed_scheduler_refuses_the_commands():
+    scheduler = commands.CommandScheduler()
+    scheduler.close()
+    with pytest.raises(RuntimeError):
+        scheduler.submit('head', print, 0)
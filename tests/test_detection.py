@@ -0,0 +1,63 @@
+import detection
+
+
+def feed(stabilizer, totals, score=1.0):
+    return [stabilizer.update(total, score) for total in totals]
+
+
+def test_stabilizer_emits_a_count_once_it_has_enough_votes():
+    stabilizer = detection.FingerCountStabilizer(window=5, min_agreement=0.6)
+    assert feed(stabilizer, [3, 3, 3]) == [None, None, 3]
+    assert stabilizer.stable_count == 3
+
+
+def test_stabilizer_emits_the_same_count_only_once():
+    stabilizer = detection.FingerCountStabilizer(window=5, min_agreement=0.6)
+    assert feed(stabilizer, [3] * 10).count(3) == 1
+
+
+def test_stabilizer_emits_another_count_then_the_first_one_again():
+    stabilizer = detection.FingerCountStabilizer(window=3, min_agreement=1.0)
+    assert feed(stabilizer, [2, 2, 2, 4, 4, 4, 2, 2, 2]) == [None, None, 2, None, None, 4, None, None, 2]
+
+
+def test_stabilizer_ignores_frames_without_hand_and_with_a_low_score():
+    stabilizer = detection.FingerCountStabilizer(window=5, min_agreement=0.6, min_score=0.5)
+    assert feed(stabilizer, [None, None, None, 1, 1]) == [None] * 5
+    assert feed(stabilizer, [4, 4, 4], score=0.2) == [None] * 3
+    assert stabilizer.update(1, None) is None
+
+
+def test_stabilizer_does_not_emit_on_a_tie():
+    stabilizer = detection.FingerCountStabilizer(window=4, min_agreement=0.75)
+    assert feed(stabilizer, [1, 2, 1, 2, 1, 2]) == [None] * 6
+
+
+def test_stabilizer_reset_forgets_the_votes_and_the_emitted_count():
+    stabilizer = detection.FingerCountStabilizer(window=3, min_agreement=0.6)
+    feed(stabilizer, [5, 5])
+    stabilizer.reset()
+    assert stabilizer.update(5) is None
+    assert stabilizer.update(5) == 5
+    stabilizer.reset()
+    assert feed(stabilizer, [5, 5]) == [None, 5]
+
+
+def test_count_gap_passes_at_once_without_previous_count():
+    gap = detection.CountGap()
+    assert gap.update(3)
+
+
+def test_count_gap_waits_for_the_previous_count_to_go():
+    gap = detection.CountGap(min_frames=2)
+    gap.reset(3)
+    assert [gap.update(total) for total in (3, 3, 4, 3, 4, 4, 3)] == [False] * 5 + [True] * 2
+
+
+def test_count_gap_passes_when_the_hands_are_lowered():
+    gap = detection.CountGap(min_frames=2)
+    gap.reset(2)
+    assert [gap.update(total) for total in (2, None, None)] == [False, False, True]
+    # A count with a low score is no hand
+    gap.reset(2)
+    assert [gap.update(2, score) for score in (1.0, 0.1, 0.1)] == [False, False, True]
@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import frame_archive
+
+SHAPE = (24, 32, 3)
+
+
+def frame(value):
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+def test_the_frames_are_read_back_after_reopening(tmp_path):
+    path = str(tmp_path / "archive")
+    writer = frame_archive.FrameArchiveWriter(path, SHAPE, chunk_frames=4, metadata={'label': 2})
+    for value in range(10):
+        assert writer.append(frame(value), timestamp=float(value), frame_id=100 + value) == value
+    writer.close()
+
+    archive = frame_archive.FrameArchive(path)
+    try:
+        assert len(archive) == 10
+        assert archive.metadata == {'label': 2}
+        assert archive.timestamps.tolist() == [float(value) for value in range(10)]
+        assert archive.frame_ids.tolist() == list(range(100, 110))
+        assert np.array_equal(archive[3], frame(3))
+        assert np.array_equal(archive[-1], frame(9))
+        assert [int(image[0, 0, 0]) for image in archive[2:5]] == [2, 3, 4]
+    finally:
+        archive.close()
+
+
+def test_the_frames_are_appended_to_an_existing_archive(tmp_path):
+    path = str(tmp_path / "archive")
+    writer = frame_archive.FrameArchiveWriter(path, SHAPE)
+    writer.append(frame(1))
+    writer.close()
+    writer = frame_archive.FrameArchiveWriter(path, SHAPE)
+    assert writer.append(frame(2)) == 1
+    writer.close()
+
+    archive = frame_archive.FrameArchive(path)
+    assert [int(image[0, 0, 0]) for image in archive[:]] == [1, 2]
+    archive.close()
+
+    with pytest.raises(ValueError):
+        frame_archive.FrameArchiveWriter(path, (12, 16, 3))
+
+
+def test_an_archive_is_read_while_it_is_written(tmp_path):
+    path = str(tmp_path / "archive")
+    writer = frame_archive.FrameArchiveWriter(path, SHAPE, chunk_frames=2)
+    writer.append(frame(0))
+    archive = frame_archive.FrameArchive(path)
+    try:
+        assert len(archive) == 1
+        # The frames file grows by chunks, the new frames are only seen after a refresh
+        for value in range(1, 5):
+            writer.append(frame(value))
+        assert len(archive) == 1
+        assert archive.refresh() == 5
+        assert np.array_equal(archive[4], frame(4))
+    finally:
+        archive.close()
+        writer.close()
+
+
+def test_a_frame_of_another_shape_is_refused(tmp_path):
+    writer = frame_archive.FrameArchiveWriter(str(tmp_path / "archive"), SHAPE)
+    with pytest.raises(ValueError):
+        writer.append(np.zeros((10, 10, 3), dtype=np.uint8))
+    writer.close()
+
+
+class FakeWorld:
+    """
+    World of a robot whose camera images are given by the test.
+    """
+
+    def __init__(self):
+        self.handler = None
+        self.disabled = False
+
+    def add_event_handler(self, event, handler):
+        self.handler = handler
+        return SimpleNamespace(disable=lambda: setattr(self, 'disabled', True))
+
+
+def test_the_recorder_writes_the_camera_images_from_its_thread(tmp_path):
+    path = str(tmp_path / "archive")
+    world = FakeWorld()
+    recorder = frame_archive.ArchiveRecorder(SimpleNamespace(world=world), path, metadata={'robot': 1})
+    for value in range(5):
+        image = SimpleNamespace(raw_image=frame(value), image_recv_time=float(value), image_number=value)
+        world.handler(None, image=image)
+    recorder.stop()
+    assert world.disabled and recorder.dropped == 0
+
+    archive = frame_archive.FrameArchive(path)
+    try:
+        assert archive.metadata == {'robot': 1}
+        assert archive.frame_ids.tolist() == list(range(5))
+        assert np.array_equal(archive[4], frame(4))
+    finally:
+        archive.close()
+
@@ -0,0 +1,159 @@
+import time
+
+import numpy as np
+
+import detection
+import gestures
+import hand_backends
+import replay
+import sessions
+
+
+def finger(base, direction, folded=False):
+    # Three segments from the base of the finger, the last two turned back when it is folded
+    direction = np.array(direction, dtype=float) / np.linalg.norm(direction)
+    points = [np.array(base, dtype=float)]
+    for joint in range(3):
+        if folded and joint == 1:
+            step = np.array([direction[1], -direction[0]])
+        elif folded and joint == 2:
+            step = -direction
+        else:
+            step = direction
+        points.append(points[-1] + 0.04 * step)
+    return points
+
+
+def make_hand(wrist, fingers):
+    landmarks = np.zeros((21, 3), dtype=np.float32)
+    landmarks[0, :2] = wrist
+    for index, (base, direction, folded) in enumerate(fingers):
+        landmarks[1 + 4 * index:5 + 4 * index, :2] = finger(base, direction, folded)
+    return landmarks
+
+
+FLAT = make_hand((0.3, 0.5), [((0.35, 0.55), (1, 0.3), True)] +
+                 [((0.4, 0.44 + 0.03 * index), (1, 0), False) for index in range(4)])
+UPRIGHT = make_hand((0.5, 0.8), [((0.45, 0.7), (-1, -1), False)] +
+                    [((0.44 + 0.03 * index, 0.65), (0, -1), False) for index in range(4)])
+CROSSED = make_hand((0.5, 0.8), [((0.45, 0.7), (1, -0.2), True), ((0.45, 0.65), (0.4, -1), False),
+                                 ((0.5, 0.65), (-0.4, -1), False), ((0.53, 0.65), (0, -1), True),
+                                 ((0.56, 0.65), (0, -1), True)])
+VERTICAL_INDEX = make_hand((0.5, 0.9), [((0.45, 0.7), (1, -0.2), True), ((0.5, 0.6), (0, -1), False),
+                                        ((0.52, 0.65), (0, -1), True), ((0.54, 0.65), (0, -1), True),
+                                        ((0.56, 0.65), (0, -1), True)])
+HORIZONTAL_INDEX = make_hand((0.3, 0.55), [((0.35, 0.6), (1, 0.3), True), ((0.44, 0.5), (1, 0), False),
+                                           ((0.4, 0.53), (1, 0), True), ((0.4, 0.56), (1, 0), True),
+                                           ((0.4, 0.59), (1, 0), True)])
+# Index crossing VERTICAL_INDEX at 65 degrees
+SLANTED_INDEX = make_hand((0.3, 0.6), [((0.35, 0.65), (1, 0.3), True), ((0.44, 0.53), (1, -0.466), False),
+                                       ((0.4, 0.56), (1, 0), True), ((0.4, 0.59), (1, 0), True),
+                                       ((0.4, 0.62), (1, 0), True)])
+
+
+def test_joint_angles_of_straight_and_folded_fingers():
+    angles = gestures.joint_angles(np.stack([UPRIGHT, CROSSED]))
+    assert angles.shape == (2, 5, 3)
+    assert np.allclose(angles[0, 1:, 1:], 180.0, atol=1e-3)
+    assert (angles[1, 3:, 1:] <= 90.0 + 1e-3).all()
+
+
+def test_a_flat_horizontal_hand_is_a_minus():
+    assert gestures.classify(FLAT[None]) == '-'
+
+
+def test_crossed_index_and_middle_fingers_are_a_times():
+    assert gestures.classify(CROSSED[None]) == '*'
+
+
+def test_crossing_index_fingers_are_a_plus():
+    assert gestures.classify(np.stack([VERTICAL_INDEX, HORIZONTAL_INDEX])) == '+'
+
+
+def test_index_fingers_that_do_not_cross_are_not_a_plus():
+    # Parallel
+    assert gestures.classify(np.stack([VERTICAL_INDEX, VERTICAL_INDEX + [0.2, 0.0, 0.0]])) is None
+    # At a right angle but apart
+    assert gestures.classify(np.stack([VERTICAL_INDEX, HORIZONTAL_INDEX + [0.0, 0.3, 0.0]])) is None
+
+
+def test_an_open_upright_hand_or_no_hand_is_no_operator():
+    assert gestures.classify(UPRIGHT[None]) is None
+    assert gestures.classify(np.zeros((0, 21, 3))) is None
+
+
+def framed(landmarks, width, height):
+    # The hands above are drawn in a square of 240 pixels, mediapipe normalizes the landmarks by the size of the image
+    return landmarks * 240.0 / np.array([width, height, width])
+
+
+def test_the_same_hands_show_the_same_operator_at_4_3_and_at_1_1():
+    for hands, operator in ((FLAT[None], '-'), (np.stack([VERTICAL_INDEX, SLANTED_INDEX]), '+')):
+        assert gestures.classify(framed(hands, 320, 240)) == operator
+        assert gestures.classify(framed(hands, 240, 240), aspect_ratio=1.0) == operator
+        # Without the correction, the hand looks steeper and the fingers cross at a smaller angle in a 4:3 image
+        assert gestures.classify(framed(hands, 320, 240), aspect_ratio=1.0) is None
+
+
+def result_of(landmarks, reused=False):
+    results = hand_backends.results_from_arrays(landmarks[None], np.array([True]))
+    return detection.DetectionResult(None, results, None, None, 2, 1.0, reused)
+
+
+def test_the_recognizer_emits_a_stable_operator_once_and_the_reused_results_vote():
+    recognizer = gestures.GestureRecognizer(window=3, min_agreement=1.0)
+    assert recognizer.update(result_of(CROSSED)) is None
+    assert recognizer.update(result_of(CROSSED)) is None
+    # A hand held still is only analysed once, its result is given again for the next frames
+    result = result_of(CROSSED)
+    assert recognizer.update(result) == '*'
+    assert [recognizer.update(result._replace(reused=True)) for _ in range(5)] == [None] * 5
+    recognizer.reset()
+    assert [recognizer.update(result._replace(reused=True)) for _ in range(3)] == [None, None, '*']
+
+
+class GestureBackend:
+    """
+    Show the landmarks of its hand attribute on every frame, no hand if None.
+    """
+
+    def __init__(self, hand):
+        self.hand = hand
+
+    def process(self, image):
+        if self.hand is None:
+            return hand_backends.results_from_arrays(np.zeros((0, 21, 3), np.float32), np.zeros(0, bool))
+        return hand_backends.results_from_arrays(self.hand[None], np.array([True]))
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_the_operator_shown_is_not_counted_as_the_second_number():
+    # The frames change all the time, as those of a camera in front of moving hands
+    images = np.broadcast_to((np.arange(150, dtype=np.uint8) * 37)[:, None, None, None], (150, 240, 320, 3))
+    session = replay.Session(images, np.arange(150) / 15.0, np.arange(150), None, None, None, None)
+    robot = replay.ReplayRobot(session, loop=True)
+    robot.play()
+    manager = sessions.SessionManager(adaptive_quality=False, gestures=True)
+    backend = GestureBackend(UPRIGHT)
+    try:
+        robot_session = manager.add(robot, hands=backend)
+        assert robot_session.start_program()
+        wait_for(lambda: robot_session.game is not None and robot_session.game.state == 'waiting_for_operator')
+        backend.hand = CROSSED
+        wait_for(lambda: robot_session.game.state == 'waiting_for_operand')
+
+        # The crossed fingers show 2, the second number is only counted once the hand changed
+        time.sleep(1.0)
+        assert robot_session.game.state == 'waiting_for_operand'
+        backend.hand = UPRIGHT
+        wait_for(lambda: not robot_session.program_running)
+        assert robot.said[-1] == "5 fois 5 égale 25"
+    finally:
+        manager.close()
+        robot.stop()
@@ -0,0 +1,221 @@
+import itertools
+from types import SimpleNamespace
+
+import numpy as np
+
+import detection
+import frames
+import hand as hd
+import hand_backends
+
+FINGERS_TIPS = {'INDEX': 8, 'MIDDLE': 12, 'RING': 16, 'PINKY': 20}
+
+
+def reference_count_fingers(results):
+    # The loop counting the fingers before count_fingers_array, landmark by landmark
+    count = {'RIGHT': 0, 'LEFT': 0}
+    fingers_statuses = dict.fromkeys(hd.FINGERS_STATUSES_KEYS['RIGHT'] + hd.FINGERS_STATUSES_KEYS['LEFT'], False)
+    for hand_info, hand_landmarks in zip(results.multi_handedness, results.multi_hand_landmarks):
+        label = hand_info.classification[0].label.upper()
+        landmark = hand_landmarks.landmark
+        for name, tip in FINGERS_TIPS.items():
+            if landmark[0].y > landmark[tip].y:
+                up = landmark[tip].y < landmark[tip - 2].y
+            else:
+                up = landmark[tip].y > landmark[tip - 2].y
+            if up:
+                fingers_statuses[label + "_" + name] = True
+                count[label] += 1
+        thumb_tip_x, thumb_mcp_x = landmark[4].x, landmark[2].x
+        if (label == 'RIGHT' and thumb_tip_x < thumb_mcp_x) or (label == 'LEFT' and thumb_tip_x > thumb_mcp_x):
+            fingers_statuses[label + "_THUMB"] = True
+            count[label] += 1
+    return fingers_statuses, count
+
+
+def make_hand(fingers_up, thumb_tip_x, hand_up=True):
+    # The wrist is below the fingers when the hand is up, above them when it is down
+    sign = 1.0 if hand_up else -1.0
+    points = np.zeros((21, 3))
+    points[:, 0] = 0.5
+    points[:, 1] = 0.5
+    points[0, 1] = 0.5 + sign * 0.4
+    for up, tip in zip(fingers_up, FINGERS_TIPS.values()):
+        points[tip - 2, 1] = 0.5 - sign * 0.1
+        points[tip, 1] = 0.5 - sign * (0.2 if up else 0.05)
+    points[2, 0] = 0.5
+    points[4, 0] = thumb_tip_x
+    return points
+
+
+def to_results(hands):
+    return SimpleNamespace(
+        multi_hand_landmarks=[SimpleNamespace(landmark=[SimpleNamespace(x=x, y=y, z=z) for x, y, z in points])
+                              for points, _ in hands],
+        multi_handedness=[SimpleNamespace(classification=[SimpleNamespace(label=label, score=1.0)])
+                          for _, label in hands])
+
+
+def check(hands):
+    results = to_results(hands)
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    _, fingers_statuses, count = hd.countFingers(image, results)
+    assert (fingers_statuses, count) == reference_count_fingers(results)
+
+
+def test_every_combination_of_fingers_of_each_hand_side():
+    for label, hand_up, thumb_tip_x in itertools.product(('Right', 'Left'), (True, False), (0.4, 0.6)):
+        for fingers_up in itertools.product((True, False), repeat=4):
+            check([(make_hand(fingers_up, thumb_tip_x, hand_up), label)])
+
+
+def test_the_thumb_and_the_fingers_on_the_edge():
+    # The tip of the thumb above its mcp, and the tip of each finger at the height of its pip
+    points = make_hand((True,) * 4, 0.5)
+    for tip in FINGERS_TIPS.values():
+        points[tip, 1] = points[tip - 2, 1]
+    for label in ('Right', 'Left'):
+        check([(points, label)])
+
+
+def test_two_hands_at_once():
+    check([(make_hand((True, True, False, False), 0.4), 'Right'), (make_hand((True,) * 4, 0.6), 'Left')])
+    check([(make_hand((False,) * 4, 0.6), 'Right'), (make_hand((True, False) * 2, 0.6, hand_up=False), 'Right')])
+
+
+def test_count_fingers_array_handles_several_frames_and_missing_hands():
+    landmarks = np.full((2, 2, 21, 3), np.nan)
+    landmarks[0, 0] = make_hand((True, True, True, False), 0.4)
+    landmarks[1, 1] = make_hand((True,) * 4, 0.6)
+    is_right = np.array([[True, False], [True, False]])
+    fingers_statuses, count = hd.count_fingers_array(landmarks, is_right)
+    assert fingers_statuses.shape == (2, 2, 5)
+    assert count.tolist() == [[4, 0], [0, 5]]
+
+
+class MarkerHands:
+    """
+    Hands function finding a single hand on the bright pixels of the image: its landmarks go from the top left corner
+    to the bottom right corner of the bright area, in coordinates normalized to the image given.
+    """
+
+    def __init__(self):
+        self.shapes = []
+
+    def process(self, image):
+        self.shapes.append(image.shape[:2])
+        rows, columns = np.nonzero(image[..., 0] > 128)
+        if not len(rows):
+            return SimpleNamespace(multi_hand_landmarks=None, multi_handedness=None)
+        height, width = image.shape[:2]
+        start = np.array([columns.min() / width, rows.min() / height])
+        end = np.array([(columns.max() + 1) / width, (rows.max() + 1) / height])
+        points = [(*(start + (end - start) * index / 20.0), 0.0) for index in range(21)]
+        return to_results([(points, 'Right')])
+
+
+def marker_frame(x0, y0, x1, y1, width=320, height=240):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[y0:y1, x0:x1] = 255
+    return image
+
+
+def test_the_region_is_analysed_and_mapped_back_to_the_full_frame():
+    hands = MarkerHands()
+    tracker = hd.HandsRoiTracker(hands)
+    image = marker_frame(100, 60, 140, 120)
+    full_results = tracker.process(image)
+    assert tracker.roi is not None and tracker.full_frames == 1
+
+    roi_results = tracker.process(image)
+    assert tracker.roi_frames == 1
+    x0, y0, x1, y1 = tracker.roi
+    assert hands.shapes[-1] == (y1 - y0, x1 - x0)
+    # The landmarks found on the region are in full frame coordinates
+    roi_landmarks = hand_backends.results_to_arrays(roi_results)[0]
+    assert np.allclose(roi_landmarks, hand_backends.results_to_arrays(full_results)[0], atol=1e-6)
+
+
+def test_a_large_region_is_downscaled_and_still_mapped_back():
+    hands = MarkerHands()
+    tracker = hd.HandsRoiTracker(hands, max_side=64)
+    image = marker_frame(80, 40, 240, 200)
+    full_landmarks = hand_backends.results_to_arrays(tracker.process(image))[0]
+    roi_landmarks = hand_backends.results_to_arrays(tracker.process(image))[0]
+    assert max(hands.shapes[-1]) <= 64
+    assert np.allclose(roi_landmarks[..., :2], full_landmarks[..., :2], atol=2.0 / 64)
+
+
+def test_the_full_frame_is_analysed_again_when_the_hand_leaves_the_region():
+    hands = MarkerHands()
+    tracker = hd.HandsRoiTracker(hands)
+    tracker.process(marker_frame(100, 60, 140, 120))
+    # The hand moved, it touches the border of the region
+    results = tracker.process(marker_frame(20, 20, 60, 80))
+    assert tracker.full_frames == 2 and tracker.roi_frames == 0
+    assert hands.shapes[-1] == (240, 320)
+    landmarks = hand_backends.results_to_arrays(results)[0]
+    assert np.allclose(landmarks[0, 0, :2], (20 / 320, 20 / 240))
+
+
+def test_the_full_frame_is_analysed_every_refresh_interval():
+    hands = MarkerHands()
+    tracker = hd.HandsRoiTracker(hands, refresh_interval=2)
+    image = marker_frame(100, 60, 140, 120)
+    for _ in range(6):
+        tracker.process(image)
+    assert (tracker.full_frames, tracker.roi_frames) == (2, 4)
+
+
+def gray_frame(level=100, width=320, height=240):
+    return np.full((height, width, 3), level, dtype=np.uint8)
+
+
+def test_motion_gate_skips_a_static_scene():
+    gate = hd.MotionGate(refresh_interval=100)
+    frame = gray_frame()
+    assert gate.changed(frame)
+    assert not any(gate.changed(frame) for _ in range(10))
+    assert gate.skipped == 10 and gate.frames == 11
+
+
+def test_motion_gate_ignores_noise_over_the_whole_frame():
+    gate = hd.MotionGate(refresh_interval=100)
+    rng = np.random.default_rng(0)
+    gate.changed(gray_frame())
+    noisy = gray_frame() + rng.integers(0, 3, (240, 320, 3), dtype=np.uint8)
+    assert not gate.changed(noisy)
+
+
+def test_motion_gate_sees_a_small_local_change():
+    gate = hd.MotionGate(refresh_interval=100)
+    gate.changed(gray_frame())
+    # A finger raised in a corner covers about 1 % of the frame
+    frame = gray_frame()
+    frame[:32, :24] = 200
+    assert gate.changed(frame)
+
+
+def test_motion_gate_forces_a_detection_every_refresh_interval():
+    gate = hd.MotionGate(refresh_interval=3)
+    frame = gray_frame()
+    assert [gate.changed(frame) for _ in range(9)] == [True, False, False, False] * 2 + [True]
+
+
+def test_motion_gate_analyses_the_next_frame_after_reset_or_a_new_size():
+    gate = hd.MotionGate(refresh_interval=100)
+    gate.changed(gray_frame())
+    gate.reset()
+    assert gate.changed(gray_frame())
+    assert gate.changed(gray_frame(width=160, height=120))
+
+
+def test_worker_marks_the_results_of_the_skipped_frames_as_reused():
+    hands = hand_backends.create_backend('synthetic', counts=[2])
+    worker = detection.DetectionWorker(frames.FrameSource(), hands=hands,
+                                       motion_gate=hd.MotionGate(refresh_interval=100))
+    image = gray_frame()
+    results = [worker.detect(frames.Frame(sequence, image, sequence, 0.0)) for sequence in range(3)]
+    assert [result.reused for result in results] == [False, True, True]
+    assert [result.total for result in results] == [2, 2, 2]
+    assert results[1].frame.sequence == 1
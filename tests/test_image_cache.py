@@ -0,0 +1,49 @@
+import hashlib
+
+import image_cache
+
+
+def producer(data, calls):
+    def produce():
+        calls.append(data)
+        return data
+
+    return produce
+
+
+def test_an_image_is_only_produced_on_a_miss():
+    cache = image_cache.EncodedImageCache()
+    calls = []
+    digest = cache.get_or_create(('cube1', '#ff0000'), producer(b'red', calls))
+    assert cache.get_or_create(('cube1', '#ff0000'), producer(b'red', calls)) == digest
+    assert calls == [b'red']
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert digest == hashlib.sha1(b'red').hexdigest()
+    assert cache.get(digest) == b'red'
+
+
+def test_the_least_recently_used_image_is_evicted():
+    cache = image_cache.EncodedImageCache(maxsize=2)
+    calls = []
+    red = cache.get_or_create('red', producer(b'red', calls))
+    green = cache.get_or_create('green', producer(b'green', calls))
+    # Using red makes green the least recently used one
+    cache.get_or_create('red', producer(b'red', calls))
+    blue = cache.get_or_create('blue', producer(b'blue', calls))
+
+    assert len(cache) == 2
+    assert cache.get(green) is None
+    assert cache.get(red) == b'red' and cache.get(blue) == b'blue'
+    cache.get_or_create('green', producer(b'green', calls))
+    assert calls == [b'red', b'green', b'blue', b'green']
+
+
+def test_an_image_shared_by_two_keys_stays_while_one_of_them_is_cached():
+    cache = image_cache.EncodedImageCache(maxsize=2)
+    calls = []
+    digest = cache.get_or_create('first', producer(b'same', calls))
+    assert cache.get_or_create('second', producer(b'same', calls)) == digest
+    cache.get_or_create('other', producer(b'other', calls))
+    assert cache.get(digest) == b'same'
+    cache.get_or_create('another', producer(b'another', calls))
+    assert cache.get(digest) is None
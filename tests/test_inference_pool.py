@@ -0,0 +1,126 @@
+import threading
+
+import numpy as np
+import pytest
+
+import hand as hd
+import hand_backends
+import inference_pool
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = inference_pool.InferencePool(2, 'synthetic', slots=4, counts=[3])
+    yield pool
+    pool.close()
+
+
+def frame(value):
+    return np.full((24, 32, 3), value, dtype=np.uint8)
+
+
+def total(results):
+    return int(hd.count_fingers_array(*hand_backends.results_to_arrays(results)[:2])[1].sum())
+
+
+def test_the_results_come_back_in_the_order_of_submission(pool):
+    sequences = [pool.submit(frame(value)) for value in range(3)]
+    results = []
+    for value in range(3, 12):
+        sequences.append(pool.submit(frame(value)))
+        results.append(pool.get(timeout=10.0))
+    while pool.pending:
+        results.append(pool.get(timeout=10.0))
+
+    assert [sequence for sequence, _ in results] == sequences
+    assert all(total(hands_results) == 3 for _, hands_results in results)
+
+
+def test_the_frames_analysed_with_process_are_skipped_by_get(pool):
+    first = pool.submit(frame(0))
+    assert total(pool.process(frame(1))) == 3
+    assert pool.get(timeout=10.0)[0] == first
+    assert pool.pending == 0
+    assert pool.get(timeout=0.1) is None
+
+
+def test_a_frame_larger_than_the_slots_is_refused(pool):
+    with pytest.raises(ValueError):
+        pool.submit(np.zeros(inference_pool.SLOT_BYTES + 1, dtype=np.uint8))
+
+
+def test_closing_the_pool_while_frames_are_submitted():
+    pool = inference_pool.InferencePool(1, 'synthetic', slots=2, counts=[1])
+    errors = []
+
+    def submit():
+        try:
+            while True:
+                pool.submit(frame(0), timeout=5.0)
+                pool.get(timeout=5.0)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=submit, daemon=True)
+    thread.start()
+    pool.close()
+    thread.join(timeout=10.0)
+    assert not thread.is_alive()
+    assert errors
+    with pytest.raises(RuntimeError):
+        pool.submit(frame(0))
+
+
+class HeldTasks:
+    """
+    Tasks queue of a pool keeping the frames from the workers, or refusing them if failing is set.
+    """
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.failing = False
+
+    def put(self, task):
+        if task is None:
+            self.tasks.put(task)
+        elif self.failing:
+            raise ValueError("Queue is closed")
+
+
+def test_a_submit_waiting_for_a_slot_is_woken_up_by_close():
+    pool = inference_pool.InferencePool(1, 'synthetic', slots=1, counts=[1])
+    pool._tasks = HeldTasks(pool._tasks)
+    pool.submit(frame(0))
+    errors = []
+
+    def submit():
+        try:
+            pool.submit(frame(1))
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=submit, daemon=True)
+    thread.start()
+    thread.join(timeout=0.2)
+    assert thread.is_alive()
+    pool.close()
+    thread.join(timeout=5.0)
+    assert not thread.is_alive() and errors
+
+
+def test_a_frame_that_cannot_be_submitted_frees_its_slot_and_fails_in_get():
+    pool = inference_pool.InferencePool(1, 'synthetic', slots=1, counts=[1])
+    tasks = pool._tasks
+    pool._tasks = HeldTasks(tasks)
+    pool._tasks.failing = True
+    try:
+        with pytest.raises(ValueError):
+            pool.submit(frame(0))
+        with pytest.raises(RuntimeError, match="not submitted"):
+            pool.get(timeout=1.0)
+
+        pool._tasks = tasks
+        assert pool.get(timeout=0.1) is None
+        assert total(pool.process(frame(1))) == 1
+    finally:
+        pool.close()
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+import light_animations as la
+
+
+class Recorder:
+    """
+    Send function keeping the lights shown on each cube and when.
+    """
+
+    def __init__(self):
+        self.shown = []
+        self._lock = threading.Lock()
+
+    def __call__(self, cube, lights):
+        with self._lock:
+            self.shown.append((cube, lights, time.monotonic()))
+
+    def lights(self, cube):
+        with self._lock:
+            return [lights for shown_cube, lights, _ in self.shown if shown_cube == cube]
+
+
+def pattern(repeat=2, final='final'):
+    return la.LightPattern([la.Keyframe('a', 0.05), la.Keyframe('b', 0.1)], repeat=repeat, final=final)
+
+
+def test_the_keyframes_are_shown_at_the_pace_of_the_pattern():
+    send = Recorder()
+    start = time.monotonic()
+    animation = la.LightAnimator().play('cube', pattern(), send)
+
+    assert animation.wait(timeout=2.0)
+    assert not animation.cancelled
+    assert send.lights('cube') == ['a', 'b', 'a', 'b', 'final']
+    times = [shown - start for _, _, shown in send.shown]
+    for shown, expected in zip(times, [0.0, 0.05, 0.15, 0.2, 0.3]):
+        assert expected - 0.01 <= shown <= expected + 0.04
+    assert pattern().duration == pytest.approx(0.3)
+
+
+def test_the_cubes_are_animated_at_the_same_time():
+    send = Recorder()
+    animator = la.LightAnimator()
+    start = time.monotonic()
+    animations = [animator.play(cube, pattern(), send) for cube in ('first', 'second')]
+
+    assert all(animation.wait(timeout=2.0) for animation in animations)
+    assert time.monotonic() - start < 0.45
+    assert send.lights('first') == send.lights('second') == ['a', 'b', 'a', 'b', 'final']
+    assert animator.running == 0
+
+
+def test_cancelling_shows_the_final_lights_at_once():
+    send = Recorder()
+    animator = la.LightAnimator()
+    animation = animator.play('cube', pattern(repeat=None), send)
+    time.sleep(0.12)
+
+    animation.cancel()
+    assert animation.done and animation.cancelled
+    shown = send.lights('cube')
+    assert shown[-1] == 'final' and shown[:-1] == ['a', 'b']
+    time.sleep(0.15)
+    assert send.lights('cube') == shown
+    assert pattern(repeat=None).duration is None
+
+
+def test_playing_on_a_cube_replaces_its_animation():
+    send = Recorder()
+    animator = la.LightAnimator()
+    first = animator.play('cube', pattern(repeat=None), send)
+    second = animator.play('cube', la.LightPattern([la.Keyframe('c', 0.05)], final=None), send)
+
+    assert first.done and first.cancelled
+    assert second.wait(timeout=1.0)
+    assert send.lights('cube')[-1] == 'c'
+    assert 'final' not in send.lights('cube')
+    assert animator.running == 0
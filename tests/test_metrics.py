@@ -0,0 +1,59 @@
+import re
+import sys
+import threading
+
+import pytest
+
+import metrics
+
+
+def test_the_percentiles_and_the_mean_of_a_stage():
+    registry = metrics.MetricsRegistry(enabled=True)
+    for duration in [0.001] * 90 + [0.1] * 10:
+        registry.observe('hands.infer', duration)
+
+    summary = registry.summary()['hands.infer']
+    assert summary['count'] == 100
+    assert summary['mean_ms'] == pytest.approx(10.9)
+    assert 0.5 < summary['p50_ms'] <= 1.0
+    assert 75.0 < summary['p99_ms'] <= 100.0
+
+
+def test_a_disabled_registry_records_nothing():
+    registry = metrics.MetricsRegistry()
+    with registry.timer('hands.infer'):
+        pass
+    registry.observe('hands.count', 1.0)
+    assert registry.summary() == {}
+
+
+def test_the_stages_are_formatted_while_they_are_observed():
+    registry = metrics.MetricsRegistry(enabled=True)
+
+    def observe(thread):
+        for index in range(10000):
+            # New stages are created while the registry is formatted
+            registry.observe('stage%d.%d' % (thread, index % 10), 0.001 * (index % 7))
+
+    # Switch threads as often as possible
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=observe, args=(thread,), daemon=True) for thread in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            registry.summary()
+            text = registry.prometheus()
+            # The buckets of each stage are cumulated up to its count
+            buckets = {}
+            for stage, value in re.findall(r'_bucket\{stage="([^"]+)",le="[^"]+"\} (\d+)', text):
+                buckets.setdefault(stage, []).append(int(value))
+            counts = dict(re.findall(r'_count\{stage="([^"]+)"\} (\d+)', text))
+            for stage, values in buckets.items():
+                assert values == sorted(values) and values[-1] == int(counts[stage])
+    finally:
+        sys.setswitchinterval(switch_interval)
+        for thread in threads:
+            thread.join()
+    assert sum(stage['count'] for stage in registry.summary().values()) == 40000
@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+
+import recolor
+from benchmarks import bench_recolor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CUBE_IMAGES = [os.path.join(ROOT, path) for path in bench_recolor.CUBE_IMAGES]
+
+
+def test_the_vectorized_recoloring_matches_the_former_loop():
+    for image_path in CUBE_IMAGES:
+        for rgb in ((18, 52, 86), (255, 255, 255), (0, 0, 0)):
+            assert np.array_equal(recolor.recolor_cube_array(image_path, rgb),
+                                  bench_recolor.recolor_cube_loop(image_path, rgb))
+
+
+def test_the_mask_is_mirrored_on_the_four_borders():
+    im = np.zeros((150, 150, 4), dtype=np.uint8)
+    im[5, 40] = (0, 255, 0, 255)
+    im[6, 41] = (10, 255, 0, 255)
+    mask = recolor.recolorable_mask(im)
+    assert sorted(zip(*np.nonzero(mask))) == [(5, 40), (40, 5), (109, 144), (144, 109)]
+
+
+def test_the_cached_template_is_not_modified():
+    template, mask = recolor.load_cube_template(CUBE_IMAGES[0])
+    before = template.copy()
+    recolor.recolor_cube_array(CUBE_IMAGES[0], (1, 2, 3))
+    assert not template.flags.writeable and not mask.flags.writeable
+    assert np.array_equal(template, before)
@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+
+import detection
+import frames
+import hand_backends
+import replay
+import two_hands
+
+
+def synthetic_session(nb_frames, width=320, height=240, label=None, still=False):
+    images = np.zeros((nb_frames, height, width, 3), dtype=np.uint8)
+    if not still:
+        images[:, 0, 0, 0] = np.arange(nb_frames)
+    return replay.Session(images, np.arange(nb_frames, dtype=np.float64) / 15.0, np.arange(nb_frames, dtype=np.int64),
+                          None, None, None, label)
+
+
+def test_a_recorded_session_is_loaded_back(tmp_path):
+    robot = replay.ReplayRobot(synthetic_session(20), realtime=False)
+    recorder = replay.SessionRecorder(robot)
+    robot.play()
+    assert robot.finished.wait(5.0)
+    recorder.stop()
+    recorder.save(str(tmp_path / "session.npz"), label=4)
+
+    session = replay.load_session(str(tmp_path / "session.npz"))
+    assert session.label == 4
+    assert session.landmarks is None
+    assert np.array_equal(session.frames, synthetic_session(20).frames)
+    assert session.frame_ids.tolist() == list(range(20))
+
+
+def test_the_frames_are_replayed_in_order():
+    session = synthetic_session(10)
+    assert [frame_id for _, frame_id in replay.iter_session(session, realtime=False)] == list(range(10))
+
+
+def test_hand_detection_counts_the_fingers_of_a_replayed_session():
+    robot = replay.ReplayRobot(synthetic_session(150), loop=True)
+    worker = detection.DetectionWorker(frames.CameraFrameSource(robot),
+                                       hands=hand_backends.create_backend('synthetic', counts=[7]))
+    worker.start()
+    robot.play()
+    try:
+        assert two_hands.hand_detection(robot, worker) == 7
+    finally:
+        worker.stop()
+        robot.stop()
+
+
+def test_a_still_hand_is_counted_quickly_with_the_default_motion_gate():
+    robot = replay.ReplayRobot(synthetic_session(150, still=True), loop=True)
+    worker = detection.DetectionWorker(frames.CameraFrameSource(robot),
+                                       hands=hand_backends.create_backend('synthetic', counts=[4]))
+    worker.start()
+    robot.play()
+    try:
+        start = time.monotonic()
+        assert two_hands.hand_detection(robot, worker) == 4
+        # The results reused for the skipped frames vote, the count does not wait for refresh_interval frames
+        assert time.monotonic() - start < 2.0
+        assert worker.motion_gate.skipped > 0
+    finally:
+        worker.stop()
+        robot.stop()
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from PIL import Image
+
+import streaming
+
+
+class Camera:
+    """
+    Camera whose frame changes when its frame id is changed.
+    """
+
+    def __init__(self):
+        self.frame_id = 1
+
+    def grab(self):
+        return self.frame_id, Image.new('RGB', (32, 24), (self.frame_id * 40 % 256, 0, 0))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_each_frame_is_encoded_once_for_all_the_subscribers():
+    broadcaster = streaming.FrameBroadcaster(Camera().grab, max_fps=1000)
+    first, second = broadcaster.frames(), broadcaster.frames()
+    try:
+        assert next(first) is next(second)
+        assert broadcaster.frames_encoded == 1
+        assert broadcaster.subscribers == 2
+    finally:
+        first.close()
+        second.close()
+    assert broadcaster.subscribers == 0
+
+
+def test_a_slow_subscriber_only_gets_the_latest_frame():
+    camera = Camera()
+    broadcaster = streaming.FrameBroadcaster(camera.grab, max_fps=1000)
+    frames = broadcaster.frames()
+    try:
+        next(frames)
+        # Four new frames are encoded while the subscriber does not read
+        for frame_id in range(2, 6):
+            camera.frame_id = frame_id
+            wait_for(lambda: broadcaster.frames_encoded == frame_id)
+        assert next(frames) == broadcaster.encode(camera.grab()[1])
+        assert broadcaster.frames_dropped == 3
+    finally:
+        frames.close()
+
+
+def test_the_encoding_stops_without_subscriber():
+    broadcaster = streaming.FrameBroadcaster(Camera().grab, max_fps=1000)
+    frames = broadcaster.frames()
+    next(frames)
+    frames.close()
+    wait_for(lambda: broadcaster._thread is None)
+
+
+def test_the_error_of_the_encoding_thread_reaches_the_subscribers():
+    def grab():
+        raise RuntimeError("SDK closed")
+
+    frames = streaming.FrameBroadcaster(grab).frames()
+    with pytest.raises(RuntimeError, match="SDK closed"):
+        next(frames)
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+import time
+
+import tracing
+
+
+def spans(trace):
+    return {event['name']: event for event in trace['traceEvents'] if event['ph'] == 'X'}
+
+
+def test_nested_spans_are_nested_in_the_chrome_trace():
+    tracer = tracing.Tracer(enabled=True)
+
+    @tracer.traced('hands.count')
+    def count():
+        time.sleep(0.01)
+
+    with tracer.span('round.detect', frame=3):
+        with tracer.span('hands.infer'):
+            time.sleep(0.01)
+        count()
+
+    events = spans(tracer.chrome_trace())
+    outer, inner, traced = events['round.detect'], events['hands.infer'], events['hands.count']
+    assert outer['cat'] == 'round' and inner['cat'] == traced['cat'] == 'hands'
+    assert outer['args'] == {'frame': 3}
+    assert outer['tid'] == inner['tid'] == traced['tid'] == threading.get_ident()
+    for child in (inner, traced):
+        assert outer['ts'] <= child['ts'] and child['ts'] + child['dur'] <= outer['ts'] + outer['dur']
+    assert inner['ts'] + inner['dur'] <= traced['ts']
+
+
+def test_the_spans_of_another_process_keep_their_ids_and_the_threads_are_named():
+    tracer = tracing.Tracer(enabled=True)
+    tracer.add_span('hands.infer', 1.0, 0.5, {'worker': object()}, pid=1234, tid=5)
+
+    def work():
+        with tracer.span('robot.say_text'):
+            pass
+
+    thread = threading.Thread(target=work, name='speech')
+    thread.start()
+    thread.join()
+
+    trace = json.loads(json.dumps(tracer.chrome_trace()))
+    events = spans(trace)
+    assert events['hands.infer']['ts'] == 1e6 and events['hands.infer']['dur'] == 5e5
+    assert (events['hands.infer']['pid'], events['hands.infer']['tid']) == (1234, 5)
+    assert isinstance(events['hands.infer']['args']['worker'], str)
+    names = {(event['pid'], event['tid']): event['args']['name'] for event in trace['traceEvents']
+             if event['ph'] == 'M'}
+    assert names == {(os.getpid(), thread.ident): 'speech'}
+
+
+def test_a_disabled_tracer_records_nothing():
+    tracer = tracing.Tracer()
+    with tracer.span('round.detect'):
+        pass
+    tracer.traced()(lambda: None)()
+    tracer.add_span('hands.infer', 0.0, 1.0)
+    assert tracer.chrome_trace()['traceEvents'] == []
+
+
+def test_the_oldest_spans_are_dropped():
+    tracer = tracing.Tracer(enabled=True, capacity=2)
+    for name in ('a', 'b', 'c'):
+        tracer.add_span(name, 0.0, 1.0, pid=1, tid=1)
+    assert list(spans(tracer.chrome_trace())) == ['b', 'c']
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import cozmo
+
+import UI
+
+
+class FakeTransport:
+    """
+    Transport of a device that accepts every message and never answers.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        pass
+
+
+class FakeConnector(cozmo.run.DeviceConnector):
+    """
+    Device whose robot is ready as soon as the connection is open.
+    """
+
+    serial = 'fake'
+
+    async def connect(self, loop, protocol_factory, conn_check):
+        connection = protocol_factory()
+        connection.connection_made(FakeTransport())
+        robot = connection.robot_factory(connection, 1, is_primary=True)
+        robot._is_ready = True
+        robot.drive_off_charger_on_connect = False
+        connection._primary_robot = robot
+        return connection.transport, connection
+
+
+class FakeSessions:
+    """
+    SessionManager keeping the robots it is given.
+    """
+
+    def __init__(self):
+        self.robots = []
+
+    def add(self, robot, robot_id=None, **kwargs):
+        self.robots.append(robot)
+        return SimpleNamespace(robot_id=len(self.robots), start_program=lambda: True)
+
+
+def test_a_robot_connection_gives_the_robot_to_add_robot(monkeypatch):
+    robot_sessions = FakeSessions()
+    monkeypatch.setattr(UI, 'robot_sessions', robot_sessions)
+    connection = UI.RobotConnection(FakeConnector(), timeout=5.0)
+    try:
+        session = UI.add_robot(connection.open())
+        assert session.robot_id == 1
+        robot, = robot_sessions.robots
+        assert isinstance(robot, cozmo.robot.Robot)
+        assert robot.camera.image_stream_enabled and robot.camera.color_image_enabled
+    finally:
+        connection.close()
@@ -0,0 +1,206 @@
+"""
+Tracing of the rounds of the game.
+
+Spans record when a piece of work started and how long it lasted, in which process and thread. They are kept in a
+ring buffer and exported in the trace event format of Chrome, which chrome://tracing and https://ui.perfetto.dev
+display as a timeline where the spans of each thread are nested. The trace can be read from the ``/trace.json`` route
+of the web interface, or written to a file when the program receives SIGUSR2.
+
+When the tracer is disabled, spans are a shared no-op object, as the metrics timers, so that traced code costs about
+one attribute lookup and one function call.
+"""
+
+import collections
+import functools
+import json
+import os
+import signal
+import threading
+import time
+
+# Number of spans kept, the oldest ones are dropped
+CAPACITY = 100000
+
+
+class _Span:
+    """
+    Context manager recording a span when it exits.
+    """
+
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add_span(self.name, self.start, time.monotonic() - self.start, self.args)
+        return False
+
+
+class _NullSpan:
+    """
+    Context manager doing nothing, returned when the tracer is disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    This class keeps the last spans of the program in a ring buffer.
+    """
+
+    def __init__(self, enabled=False, capacity=CAPACITY):
+        """
+        :param enabled: To record the spans, otherwise the spans do nothing.
+        :param capacity: Number of spans kept.
+        """
+
+        self.enabled = enabled
+        self.events = collections.deque(maxlen=capacity)
+        self._thread_names = {}
+
+    def span(self, name, **args):
+        """
+        Trace a block of code, e.g. ``with tracing.span('robot.say_text', text=text): ...``.
+
+        :param name: Name of the span, its category is the part before the first dot.
+        :param args: Values shown with the span.
+        :return: A context manager.
+        """
+
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def traced(self, name=None):
+        """
+        Decorator tracing each call of a function.
+
+        :param name: Name of the spans, the qualified name of the function if None.
+        """
+
+        def decorator(function):
+            span_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Span(self, span_name, {}):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add_span(self, name, start, duration, args=None, pid=None, tid=None):
+        """
+        Record a span measured by the caller.
+
+        :param name: Name of the span.
+        :param start: Start of the span, from time.monotonic.
+        :param duration: Duration in seconds.
+        :param args: Dictionary of values shown with the span.
+        :param pid: Id of the process the span ran in, the current one if None.
+        :param tid: Id of the thread the span ran in, the current one if None.
+        """
+
+        if not self.enabled:
+            return
+        if pid is None:
+            pid = os.getpid()
+        if tid is None:
+            thread = threading.current_thread()
+            tid = thread.ident
+            self._thread_names[(pid, tid)] = thread.name
+        self.events.append((name, start, duration, pid, tid, args))
+
+    def clear(self):
+        """
+        Forget the recorded spans.
+        """
+
+        self.events.clear()
+
+    def chrome_trace(self):
+        """
+        :return: **trace** - The recorded spans as a JSON-serializable dictionary in the trace event format.
+        """
+
+        trace_events = []
+        for name, start, duration, pid, tid, args in list(self.events):
+            event = {'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6,
+                     'pid': pid, 'tid': tid}
+            if args:
+                event['args'] = {key: value if isinstance(value, (int, float, bool, type(None))) else str(value)
+                                 for key, value in args.items()}
+            trace_events.append(event)
+
+        for (pid, tid), thread_name in list(self._thread_names.items()):
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                 'args': {'name': thread_name}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        """
+        Write the recorded spans to a file in the trace event format.
+
+        :param path: Path of the JSON file.
+        """
+
+        with open(path, 'w') as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+# Tracer shared by the whole program, enabled with the COZMO_TRACE environment variable or set_enabled
+tracer = Tracer(enabled=os.environ.get('COZMO_TRACE', '') not in ('', '0'))
+span = tracer.span
+traced = tracer.traced
+add_span = tracer.add_span
+
+
+def set_enabled(enabled):
+    """
+    Enable or disable the recording of the spans.
+
+    :param enabled: True to record the spans.
+    """
+
+    tracer.enabled = enabled
+
+
+def install_signal_handler(directory="."):
+    """
+    Write the trace to a file of a directory each time the program receives SIGUSR2, it must be called from the main
+    thread.
+
+    :param directory: Directory of the trace files.
+    :return: True if the handler is installed, False if the platform has no SIGUSR2.
+    """
+
+    if not hasattr(signal, 'SIGUSR2'):
+        return False
+
+    def dump_trace(signum, frame):
+        path = os.path.join(directory, "cozmo_trace_%d_%s.json" % (os.getpid(), time.strftime("%Y%m%d-%H%M%S")))
+        tracer.dump(path)
+        print("Trace written to %s" % path)
+
+    signal.signal(signal.SIGUSR2, dump_trace)
+    return True
@@ -1,146 +1,219 @@
-import json
 import sys
+import threading
 import time
 import cozmo
-import numpy as np
-from PIL import ImageOps
-import cubes as cb
-import hand as hd
+import detection
+import frames
+import metrics
+import tracing
 
-try:
-    import requests
-except ImportError:
-    sys.exit("Cannot import from requests: Do `pip3 install --user requests` to install")
+# Time in seconds without any hand after which cozmo complains, about 100 polls of the camera every 2 s
+NO_HAND_COMPLAINT_DELAY = 200.0
 
-
-def hand_detection(robot: cozmo.robot.Robot):
+class RobotReactions:
     """
-    This function will use the two above functions to count fingers on both hands with cozmo's camera.
+    This class plays robot behaviors in a background thread so that they never hold up the detection.
 
-    :param robot: An instance of cozmo Robot.
-    :return: **finalTotal** - An int that represents the counted fingers.
+    Only one behavior runs at a time, the ones asked for meanwhile are skipped.
     """
 
-    try:
-        hand = -1
-        finalTotal = -2
-
-        # Times of no hand detected
-        nbNoHand = 0
-
-        # To check twice the number of fingers
-        while hand != finalTotal:
-            # Get the image of cozmo's camera
-            latest_image = robot.world.latest_image
-
-            if latest_image:
-                # Get the raw image
-                im = latest_image.raw_image
-                # Flip horizontally the image
-                im = ImageOps.mirror(im)
-                # Transform image in a numpy array
-                im = np.array(im)
-
-                # Hand landmarks process
-                frame, results = hd.detectHandsLandmarks(im, hd.hands_videos)
-
-                # Check if the hands landmarks in the frame are detected.
-                if results.multi_hand_landmarks:
-                    # Count the number of fingers up of each hand in the frame.
-                    frame, fingers_statuses, count = hd.countFingers(frame, results)
-                    totalFingers = sum(count.values())
-
-                    # Check if detected number is the right number
-                    if hand != totalFingers:
-                        hand = totalFingers
-                    else:
-                        finalTotal = totalFingers
-                        if finalTotal == 1 and (fingers_statuses.get("RIGHT_MIDDLE") is True or fingers_statuses.get(
-                                "LEFT_MIDDLE") is True):
-                            robot.say_text("Tu veux te battre LAAAAAAA", in_parallel=True).wait_for_completed()
-                        robot.say_text(f'{totalFingers}', in_parallel=True).wait_for_completed()
-                        currentHeadAngle = robot.head_angle
-                        robot.play_anim_trigger(cozmo.anim.Triggers.CodeLabHappy,
-                                                ignore_lift_track=True, ignore_body_track=True,
-                                                in_parallel=True).wait_for_completed()
-                        robot.set_head_angle(currentHeadAngle, in_parallel=True).wait_for_completed()
-                        return finalTotal
+    def __init__(self):
+        self._thread = None
 
-                    time.sleep(2)
+    @property
+    def busy(self):
+        """
+        True while a behavior is running.
+        """
 
-                else:
-                    print("No hand detected")
+        return self._thread is not None and self._thread.is_alive()
 
-                    # One more no hand detected
-                    nbNoHand += 1
-                    robot.play_anim(name="anim_mm_thinking", ignore_head_track=True,
-                                    in_parallel=True).wait_for_completed()
+    def react(self, behavior, *args):
+        """
+        Start a behavior if none is running.
 
-                    # If hands are not detected for a long time
-                    if nbNoHand == 100:
-                        nbNoHand = 0
-                        currentHeadAngle = robot.head_angle
-                        robot.say_text("Je ne te vois pas", in_parallel=True).wait_for_completed()
-                        robot.play_anim(name="anim_bored_01", ignore_body_track=True,
-                                        in_parallel=True).wait_for_completed()
-                        robot.set_head_angle(currentHeadAngle, in_parallel=True).wait_for_completed()
+        :param behavior: Function performing the behavior.
+        :param args: Arguments of the behavior.
+        :return: True if the behavior was started, False if it was skipped.
+        """
 
-    # To detect Ctrl+F2 and shut down properly
-    except KeyboardInterrupt:
-        sys.exit()
+        if self.busy:
+            return False
+        self._thread = threading.Thread(target=behavior, args=args, daemon=True)
+        self._thread.start()
+        return True
+
+    def wait(self):
+        """
+        Wait for the end of the running behavior.
+        """
+
+        if self._thread is not None:
+            self._thread.join()
 
 
-def cozmo_program(robot: cozmo.robot.Robot, cubesArg):
+def think(robot: cozmo.robot.Robot):
     """
-    This function will be executed by cozmo and handled all interactions between cozmo, cubes and the code.
+    Cozmo thinks while it does not see any hand.
 
-    :param cubesArg: All cube object
     :param robot: An instance of cozmo Robot.
     """
-    # Set cozmo's head angle
-    robot.set_head_angle(cozmo.robot.MAX_HEAD_ANGLE / 2, in_parallel=True).wait_for_completed()
 
-    # Set cozmo's lift height
-    if robot.lift_height.distance_mm != cozmo.robot.MIN_LIFT_HEIGHT_MM:
-        robot.set_lift_height(0.0).wait_for_completed()
+    with tracing.span('robot.play_anim', animation="anim_mm_thinking"):
+        robot.play_anim(name="anim_mm_thinking", ignore_head_track=True, in_parallel=True).wait_for_completed()
+
 
-    handler = robot.add_event_handler(cozmo.objects.EvtObjectTapped,
-                                      cb.Cubes.on_cube_tapped)
+def complain_no_hand(robot: cozmo.robot.Robot, speech=None):
+    """
+    Cozmo complains when it has not seen any hand for a long time.
 
-    cubes = cubesArg
+    :param robot: An instance of cozmo Robot.
+    :param speech: The SpeechManager saying cozmo's phrases, cozmo speaks directly if None.
+    """
 
-    # The final result initialized
-    finalResult = -1
+    currentHeadAngle = robot.head_angle
+    if speech is None:
+        with tracing.span('robot.say_text', text="Je ne te vois pas"):
+            robot.say_text("Je ne te vois pas", in_parallel=True).wait_for_completed()
+    else:
+        speech.say("Je ne te vois pas", wait=True)
+    with tracing.span('robot.play_anim', animation="anim_bored_01"):
+        robot.play_anim(name="anim_bored_01", ignore_body_track=True, in_parallel=True).wait_for_completed()
+    with tracing.span('robot.set_head_angle'):
+        robot.set_head_angle(currentHeadAngle, in_parallel=True).wait_for_completed()
+
+
+@tracing.traced('hand_detection')
+def hand_detection(robot: cozmo.robot.Robot, worker=None, stabilizer=None, speech=None, stop_event=None,
+                   previous_total=None):
+    """
+    This function will use the two above functions to count fingers on both hands with cozmo's camera.
 
-    # Detect the first number
-    firstNumber = hand_detection(robot)
+    The detection runs in a DetectionWorker while this function reacts to its results, so that the frames keep being
+    analysed while cozmo speaks or plays an animation. A number is accepted as soon as the counts of the last frames
+    agree on it.
 
-    print(firstNumber)
+    :param robot: An instance of cozmo Robot.
+    :param worker: The DetectionWorker analysing cozmo's camera frames, one is started for this call if None.
+    :param stabilizer: The FingerCountStabilizer voting on the counts of the frames, a default one if None.
+    :param speech: The SpeechManager saying cozmo's phrases, cozmo speaks directly if None. The function waits until
+        the count has been said, so that cozmo's happy animation does not cut it off.
+    :param stop_event: A threading.Event making the function return None when set.
+    :param previous_total: The count shown just before, e.g. by the first number or by an operator shown with the
+        hands. The fingers are then only counted once the hands showing it have gone or changed, see detection.CountGap.
+    :return: **finalTotal** - An int that represents the counted fingers.
+    """
 
-    # Wait for any cubes tapped
-    print('J\'' + 'attends que tu tapes')
+    own_worker = worker is None
+    if own_worker:
+        worker = detection.DetectionWorker(frames.CameraFrameSource(robot))
+        worker.start()
 
-    robot.say_text("Tape sur un cube").wait_for_completed()
-    robot.world.wait_for(cozmo.objects.EvtObjectTapped)  # Timeout par defaut 30 secondes
-    operation = cubes.cube_blinking(cubes.cube_tapped_id)
+    if stabilizer is None:
+        stabilizer = detection.FingerCountStabilizer()
+    stabilizer.reset()
+    gap = detection.CountGap()
+    gap.reset(previous_total)
 
-    # Detect the second number
-    secondNumber = hand_detection(robot)
+    reactions = RobotReactions()
 
-    if operation == '+':
-        finalResult = firstNumber + secondNumber
-    elif operation == '-':
-        finalResult = firstNumber - secondNumber
+    try:
+        # Results of frames older than this are ignored
+        startTime = time.monotonic()
 
-        if finalResult < 0:
-            finalResult = "moins" + str(-finalResult)
+        # Fingers statuses of the last frame of each count
+        fingersStatuses = {}
 
-    elif operation == '*':
-        finalResult = firstNumber * secondNumber
+        # Time since which no hand is detected, None while hands are detected
+        noHandSince = None
 
-    # Cozmo say the result
+        while stop_event is None or not stop_event.is_set():
+            # Wait for the detection on a new image of cozmo's camera
+            result = worker.get(timeout=1.0)
 
-    robot.say_text(f'{firstNumber}' + operation + f'{secondNumber}' + "=" + f'{finalResult}',
-                   in_parallel=True).wait_for_completed()
+            # A reused result votes too: a still hand keeps showing its count while the detection is skipped
+            if result is None or result.frame.arrival_time < startTime:
+                continue
 
-    print(finalResult)
+            # Vote on the count of the frame, once the previous hands have gone
+            if gap.update(result.total, result.score):
+                finalTotal = stabilizer.update(result.total, result.score)
+            else:
+                finalTotal = None
+
+            # Check if the hands landmarks in the frame are detected.
+            if result.total is not None:
+                fingersStatuses[result.total] = result.fingers_statuses
+                noHandSince = None
+
+            else:
+                # Only say it when the hands are lost, not for every frame
+                if noHandSince is None:
+                    print("No hand detected")
+                    noHandSince = result.frame.arrival_time
+
+                # If hands are not detected for a long time
+                if result.frame.arrival_time - noHandSince >= NO_HAND_COMPLAINT_DELAY:
+                    if reactions.react(complain_no_hand, robot, speech):
+                        noHandSince = result.frame.arrival_time
+                else:
+                    reactions.react(think, robot)
+
+            # Check if the count is stable
+            if finalTotal is not None:
+                fingers_statuses = fingersStatuses[finalTotal]
+                reactions.wait()
+                middleFinger = finalTotal == 1 and (fingers_statuses.get("RIGHT_MIDDLE") is True or
+                                                    fingers_statuses.get("LEFT_MIDDLE") is True)
+                if speech is not None:
+                    if middleFinger:
+                        speech.say("Tu veux te battre LAAAAAAA")
+                    speech.say(finalTotal, wait=True)
+                else:
+                    with metrics.timer('robot.say_text'), tracing.span('robot.say_text', text=finalTotal):
+                        if middleFinger:
+                            robot.say_text("Tu veux te battre LAAAAAAA", in_parallel=True).wait_for_completed()
+                        robot.say_text(f'{finalTotal}', in_parallel=True).wait_for_completed()
+                with metrics.timer('robot.animation'), tracing.span('robot.play_anim_trigger', trigger="CodeLabHappy"):
+                    currentHeadAngle = robot.head_angle
+                    robot.play_anim_trigger(cozmo.anim.Triggers.CodeLabHappy,
+                                            ignore_lift_track=True, ignore_body_track=True,
+                                            in_parallel=True).wait_for_completed()
+                    robot.set_head_angle(currentHeadAngle, in_parallel=True).wait_for_completed()
+                return finalTotal
+
+        return None
+
+    # To detect Ctrl+F2 and shut down properly
+    except KeyboardInterrupt:
+        sys.exit()
+
+    finally:
+        if own_worker:
+            worker.stop()
+            worker.frame_source.close()
+
+
+def cozmo_program(robot: cozmo.robot.Robot, cubesArg, hands=None, listeners=None, speech=None):
+    """
+    This function will be executed by cozmo and handled all interactions between cozmo, cubes and the code.
+
+    It plays a single round with a game.GameEngine, the web interface keeps one engine per robot across the rounds.
+
+    :param cubesArg: All cube object
+    :param robot: An instance of cozmo Robot.
+    :param hands: The backend performing the hands landmarks detection, e.g. the robot's own detection process, the
+        shared mediapipe one if None.
+    :param listeners: List of callables called with each detection result, see DetectionWorker.
+    :param speech: The SpeechManager saying cozmo's phrases, one is created for this round if None.
+    :return: **result** - A tuple (first number, operation, second number, result).
+    """
+    # Imported here, game uses the functions of this module
+    import game
+
+    engine = game.GameEngine(robot, cubesArg, hands=hands, listeners=listeners, speech=speech)
+    try:
+        engine.setup()
+        return engine.play_round()
+    finally:
+        engine.stop()